@@ -6,14 +6,17 @@ import os
 import socket
 import subprocess
 import sys
+import threading
 from collections import OrderedDict
-from time import sleep
+from fnmatch import fnmatch
+from time import sleep, time
 
 import semver
-from future.utils import raise_from
-from websocket import create_connection
+from future.utils import raise_from, string_types
+from websocket import WebSocketTimeoutException, create_connection
 
 from blackfynn.log import get_logger
+from blackfynn.manifest import get_manifest
 from blackfynn.models import Collection, Dataset, DataPackage
 
 logger = get_logger('blackfynn.agent')
@@ -147,9 +150,118 @@ def create_agent_socket(port):
     raise AgentError("Could not connect to Agent")
 
 
-def agent_upload(destination, files, dataset, append, recursive, display_progress, settings):
+def _patterns(patterns):
+    if patterns is None:
+        return []
+    if isinstance(patterns, string_types):
+        return [patterns]
+    return list(patterns)
+
+
+def _matches(relpath, patterns):
+    name = os.path.basename(relpath)
+    return any(fnmatch(relpath, p) or fnmatch(name, p) for p in patterns)
+
+
+class _DirEntry(object):
+    """
+    ``os.DirEntry`` stand-in where ``os.scandir`` is not available.
+    """
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def _scandir(directory):
+    if hasattr(os, 'scandir'):
+        return os.scandir(directory)
+    return (_DirEntry(directory, name) for name in os.listdir(directory))
+
+
+def plan_upload(files, recursive=False, include=None, exclude=None, manifest=None):
+    """
+    Generator of the files to upload, as ``(absolute path, stat)`` tuples
+    (``stat`` is only looked up when there is a manifest, otherwise it is
+    ``None``). Directories are listed lazily with ``os.scandir``.
+
+    include:  only upload files matching one of these glob patterns
+    exclude:  skip files (and directories) matching one of these patterns
+    manifest: skip files that the manifest (see ``blackfynn.manifest``) lists
+              as uploaded
+
+    Patterns are matched against the path relative to the uploaded
+    directory and against the file name.
+    """
+    include = _patterns(include)
+    exclude = _patterns(exclude)
+
+    def selected(path, relpath, entry=None):
+        if include and not _matches(relpath, include):
+            return None
+        if exclude and _matches(relpath, exclude):
+            return None
+        if manifest is None:
+            return path, None
+        return path, entry.stat() if entry is not None else os.stat(path)
+
+    planned = _plan(files, recursive, exclude, selected)
+    if manifest is not None:
+        planned = manifest.filter(planned)
+    return planned
+
+
+def _plan(files, recursive, exclude, selected):
+    for f in files:
+        root = os.path.abspath(f)
+        if not os.path.isdir(root):
+            planned = selected(root, os.path.basename(root))
+            if planned is not None:
+                yield planned
+            continue
+
+        prefix = len(root) + len(os.sep)
+        stack = [root]
+        while stack:
+            for entry in _scandir(stack.pop()):
+                relpath = entry.path[prefix:]
+                if entry.is_dir():
+                    if recursive and not (exclude and _matches(relpath, exclude)):
+                        stack.append(entry.path)
+                elif entry.is_file():
+                    planned = selected(entry.path, relpath, entry)
+                    if planned is not None:
+                        yield planned
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def agent_upload(destination, files, dataset, append, recursive, display_progress, settings,
+                 include=None, exclude=None, manifest=None):
     """
     Push an upload through the agent.
+
+    Files are queued in batches of ``agent_queue_batch_size`` while the
+    directories are still being listed (see ``plan_upload``). Recursive
+    uploads are queued as a whole, since the agent recreates the folder
+    structure; they cannot be filtered.
     """
     directory_upload = any(os.path.isdir(f) for f in files)
 
@@ -166,28 +278,8 @@ def agent_upload(destination, files, dataset, append, recursive, display_progres
     if recursive and append:
         raise AgentError('Cannot use `recursive=True` when appending`')
 
-    # Figure out what files the agent is going to upload.
-    # We cannot count on the agent to send "upload queued" messages for
-    # all files before it starts uploading, so we generate the files we
-    # plan to wait for.
-    if directory_upload:
-        directory = files[0]
-        if recursive:
-            expected_files = []
-            for dirpath, _, filenames in os.walk(directory):
-                for f in filenames:
-                    expected_files.append(os.path.join(dirpath, f))
-        else:
-            expected_files = []
-            for f in os.listdir(directory):
-                path = os.path.join(directory, f)
-                if os.path.isfile(path):
-                    expected_files.append(path)
-    else:
-        expected_files = files
-
-    # Agent uses absolute paths
-    expected_files = [os.path.abspath(f) for f in expected_files]
+    if recursive and (include or exclude or manifest):
+        raise AgentError('Cannot use `include`, `exclude` or `manifest` with `recursive=True`')
 
     if isinstance(destination, Dataset):
         dataset_id = destination.id
@@ -198,55 +290,64 @@ def agent_upload(destination, files, dataset, append, recursive, display_progres
     else:
         raise ValueError('Can only upload to a Dataset, Package, or Collection')
 
+    manifest = get_manifest(manifest, settings, scope=package_id or dataset_id)
+    planned = plan_upload(files, recursive, include, exclude, manifest)
+    batch_size = settings.agent_queue_batch_size
+
+    def queue_upload(ws, files, recursive):
+        ws.send(json.dumps({
+            'message': 'queue_upload',
+            'body': {
+                'dataset': dataset_id,
+                'package': package_id,
+                'files': files,
+                'append': append,
+                'recursive': recursive
+        }}))
+
     with AgentListener(settings, DEFAULT_LISTEN_PORT):
         try:
             ws = create_agent_socket(DEFAULT_LISTEN_PORT)
-
-            ws.send(json.dumps({
-                'message': 'queue_upload',
-                'body': {
-                    'dataset': dataset_id,
-                    'package': package_id,
-                    'files': files,
-                    'append': append,
-                    'recursive': recursive
-            }}))
-
-            upload_manager = UploadManager(expected_files, display_progress)
-            upload_manager.print_progress()
-
-            for msg in ws:
-                msg = json.loads(msg)
-
-                if msg['message'] == 'file_queued_for_upload':
-                    upload_manager.set_queued(msg['path'], msg['import_id'])
-
-                elif msg['message'] == 'upload_progress':
-                    upload_manager.set_progress(msg['path'], msg['import_id'],
-                                                msg['percent_done'], msg['done'])
-
-                elif msg['message'] == 'upload_complete':
-                    upload_manager.set_complete(msg['import_id'])
-
-                elif msg['message'] == 'upload_error':
-                    logger.error(msg['context'])
-                    upload_manager.set_error(msg['import_id'])
-
-                elif msg['message'] == 'error':
-                    raise AgentError(msg['context'])
-
-                else:
-                    logger.debug("Unknown message", msg)
-
-                upload_manager.print_progress()
-                if upload_manager.done:
-                    break
+            upload_manager = UploadManager([], display_progress, manifest=manifest)
+            upload_manager.planning = True
+            errors = []
+
+            def plan():
+                # Figure out what files the agent is going to upload.
+                # We cannot count on the agent to send "upload queued" messages
+                # for all files before it starts uploading, so we track the
+                # files we plan to wait for before queueing them.
+                try:
+                    if recursive:
+                        queue_upload(ws, files, recursive=True)
+                        for batch in _batches(planned, batch_size):
+                            upload_manager.track_files(batch)
+                    else:
+                        for batch in _batches(planned, batch_size):
+                            upload_manager.track_files(batch)
+                            queue_upload(ws, [path for path, _ in batch], recursive=False)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    upload_manager.planning = False
+
+            planner = threading.Thread(target=plan, name='blackfynn-upload-planner')
+            planner.daemon = True
+            planner.start()
+            try:
+                upload_manager.follow(ws, errors)
+            finally:
+                planner.join()
+            if errors:
+                raise errors[0]
 
         finally:
             try:
                 ws.close()
             except UnboundLocalError:
                 pass
+            if manifest is not None:
+                manifest.close()
 
 
 class UploadManager(object):
@@ -259,33 +360,76 @@ class UploadManager(object):
     have to track both the filename and import id. We only want to wait for
     all "our" files to upload.
     """
-    def __init__(self, files, display_progress):
+    def __init__(self, files, display_progress, frame_interval=0.1, stream=None, manifest=None):
         # Should we show progress bars?
         self.display_progress = display_progress
+        # completed files are added to the manifest
+        self.manifest = manifest
+        # more of our files may still be added while True
+        self.planning = False
 
-        # map of filepath -> list(FileProgress)
+        # map of filepath -> list(FileProgress), in display order
         self.uploads = OrderedDict()
+        # (filepath, import id) -> FileProgress
+        self._by_file = {}
+        # import id -> list(FileProgress)
+        self._by_import = {}
+        # number of "our" files that are not done yet
+        self._remaining = 0
+        self._count = 0
+        # files are tracked by the planner thread
+        self._lock = threading.RLock()
 
         for file in files:
             self.track_file(file, import_id=None, ours=True)
 
-        # Keep track of whether progress bars have already been rendered so
-        # we know if/what to erase when re-drawing
+        # Redraw at most once per `frame_interval` seconds. Keep track of
+        # whether progress bars have already been rendered so we know
+        # if/what to erase when re-drawing
+        self.frame_interval = frame_interval
+        self.stream = stream or sys.stdout
         self.lines_on_screen = 0
+        self._last_draw = None
+        self._dirty = True
 
     def track_file(self, file, import_id, ours):
-        progress = FileProgress(file, import_id, ours)
-        if file in self.uploads:
-            self.uploads[file].append(progress)
-        else:
-            self.uploads[file] = [progress]
-        return progress
+        with self._lock:
+            if ours and import_id is None:
+                # the agent may already have queued it (recursive uploads)
+                for p in self.uploads.get(file, ()):
+                    if p.early:
+                        p.early = False
+                        p.ours = True
+                        if not p.done:
+                            self._remaining += 1
+                        elif self.manifest is not None:
+                            self.manifest.add(p.filename)
+                        return p
+
+            progress = FileProgress(file, import_id, ours)
+            self.uploads.setdefault(file, []).append(progress)
+            self._by_file.setdefault((file, import_id), progress)
+            if import_id is not None:
+                self._by_import.setdefault(import_id, []).append(progress)
+            if ours:
+                self._remaining += 1
+            self._count += 1
+            self._dirty = True
+            return progress
+
+    def track_files(self, files):
+        """
+        Track our ``(path, stat)`` tuples (see ``plan_upload``), and start
+        hashing them for the manifest before they are queued.
+        """
+        with self._lock:
+            for path, _ in files:
+                if self.manifest is not None:
+                    self.manifest.prepare(path)
+                self.track_file(path, import_id=None, ours=True)
 
     def get_tracked_file(self, file, import_id):
-        if file in self.uploads:
-            for p in self.uploads[file]:
-                if p.import_id == import_id:
-                    return p
+        return self._by_file.get((file, import_id))
 
     def all_tracked_files(self):
         for filegroup in self.uploads.values():
@@ -293,66 +437,148 @@ class UploadManager(object):
                 yield progress
 
     def set_queued(self, file, import_id):
-        # Update the unqueued version of the file with an import id
-        progress = self.get_tracked_file(file, None)
-
-        # This import is queued from a different process - we don't care
-        if progress is None:
-            return
+        with self._lock:
+            # Update the unqueued version of the file with an import id
+            progress = self._by_file.get((file, None))
+
+            if progress is None:
+                if self.planning:
+                    # This may be one of ours that we have not listed yet
+                    progress = self.track_file(file, import_id, ours=False)
+                    progress.early = True
+                    progress.queued = True
+                # Otherwise, this import is queued from a different process -
+                # we don't care
+                return
+
+            del self._by_file[(file, None)]
+            # another unqueued entry for the same file (queued twice by us)
+            for p in self.uploads[file]:
+                if p.import_id is None and p is not progress:
+                    self._by_file[(file, None)] = p
+                    break
 
-        progress.queued = True
-        progress.import_id = import_id
+            progress.queued = True
+            progress.import_id = import_id
+            self._by_file.setdefault((file, import_id), progress)
+            self._by_import.setdefault(import_id, []).append(progress)
+            self._dirty = True
 
     def set_progress(self, file, import_id, percent_done, done):
-        # Absorb any files that are in the DB/already queued
-        if self.get_tracked_file(file, import_id) is None:
-            self.track_file(file, import_id, ours=False)
+        with self._lock:
+            # Absorb any files that are in the DB/already queued
+            progress = self._by_file.get((file, import_id))
+            if progress is None:
+                progress = self.track_file(file, import_id, ours=False)
+
+            progress.percent_done = percent_done
+            self._dirty = True
 
-        progress = self.get_tracked_file(file, import_id)
-        progress.percent_done = percent_done
+    def _completed(self, progress):
+        self._remaining -= 1
+        if self.manifest is not None:
+            self.manifest.add(progress.filename)
 
     def set_complete(self, import_id):
-        for progress in self.all_tracked_files():
-            if progress.import_id == import_id:
-                progress.done = True
+        with self._lock:
+            for progress in self._by_import.get(import_id, ()):
+                if not progress.done:
+                    progress.done = True
+                    if progress.ours:
+                        self._completed(progress)
+            self._dirty = True
 
     def set_error(self, import_id):
-        for progress in self.all_tracked_files():
-            if progress.import_id == import_id:
+        with self._lock:
+            for progress in self._by_import.get(import_id, ()):
                 progress.errored = True
+            self._dirty = True
 
     @property
     def done(self):
-        return all([fstat.done for fstat in self.all_tracked_files() if fstat.ours])
+        return not self.planning and self._remaining <= 0
+
+    def handle_message(self, msg):
+        """
+        Update progress from an agent message.
+        """
+        if msg['message'] == 'file_queued_for_upload':
+            self.set_queued(msg['path'], msg['import_id'])
 
-    def print_progress(self, width=24):
-        if not self.display_progress:
+        elif msg['message'] == 'upload_progress':
+            self.set_progress(msg['path'], msg['import_id'],
+                              msg['percent_done'], msg['done'])
+
+        elif msg['message'] == 'upload_complete':
+            self.set_complete(msg['import_id'])
+
+        elif msg['message'] == 'upload_error':
+            logger.error(msg['context'])
+            self.set_error(msg['import_id'])
+
+        elif msg['message'] == 'error':
+            raise AgentError(msg['context'])
+
+        else:
+            logger.debug("Unknown message: %s", msg)
+
+    def follow(self, ws, errors=(), poll_interval=0.5):
+        """
+        Process messages from the agent websocket until all of our files
+        are uploaded (or something was added to ``errors``).
+        """
+        ws.settimeout(poll_interval)
+        self.print_progress()
+        try:
+            while not (self.done or errors):
+                try:
+                    msg = ws.recv()
+                except WebSocketTimeoutException:
+                    self.print_progress()
+                    continue
+                self.handle_message(json.loads(msg))
+                self.print_progress()
+        finally:
+            self.print_progress(force=True)
+
+    def print_progress(self, width=24, force=False):
+        if not self.display_progress or not (self._dirty or force):
+            return
+
+        now = time()
+        if not force and self._last_draw is not None and now - self._last_draw < self.frame_interval:
             return
 
-        # move cursor to relative beginning
-        sys.stdout.write("\033[F" * self.lines_on_screen)
+        with self._lock:
+            self._last_draw = now
+            self._dirty = False
 
-        for fstat in self.all_tracked_files():
-            if fstat.done:
-                state = 'DONE'
-            elif fstat.errored:
-                state = 'ERRORED'
-            elif fstat.queued:
-                state = 'UPLOADING'
-            else:
-                state = 'WAITING'
+            # move cursor to relative beginning
+            lines = ["\033[F" * self.lines_on_screen]
+
+            for fstat in self.all_tracked_files():
+                if fstat.done:
+                    state = 'DONE'
+                elif fstat.errored:
+                    state = 'ERRORED'
+                elif fstat.queued:
+                    state = 'UPLOADING'
+                else:
+                    state = 'WAITING'
+
+                text = ' [ {bars}{dashes} ] {state:12s} {percent:05.1f}% {name}\n'.format(
+                    bars='#' * int(fstat.progress * width),
+                    dashes='-' * (width - int(fstat.progress * width)),
+                    percent=fstat.percent_done,
+                    name=fstat.name,
+                    state=state)
 
-            text = ' [ {bars}{dashes} ] {state:12s} {percent:05.1f}% {name}\n'.format(
-                bars='#' * int(fstat.progress * width),
-                dashes='-' * (width - int(fstat.progress * width)),
-                percent=fstat.percent_done,
-                name=fstat.name,
-                state=state)
+                lines.append('{}\r'.format(text))
 
-            sys.stdout.write('{}\r'.format(text))
-            sys.stdout.flush()
+            self.lines_on_screen = self._count
 
-        self.lines_on_screen = len(list(self.all_tracked_files()))
+        self.stream.write(''.join(lines))
+        self.stream.flush()
 
 
 class FileProgress(object):
@@ -366,6 +592,8 @@ class FileProgress(object):
         self.done = False
         self.errored = False
         self.queued = False
+        # queued by the agent before we listed it
+        self.early = False
 
     @property
     def percent_done(self):
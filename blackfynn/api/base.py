@@ -1,6 +1,13 @@
 from __future__ import absolute_import, division, print_function
 from future.utils import integer_types, string_types
 
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import ConnectionError, ConnectTimeout
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
 import blackfynn.log as log
 from blackfynn.models import get_package_class
 
@@ -10,6 +17,18 @@ standard_library.install_aliases()
 import urllib.parse
 
 
+def _not_sent(error):
+    """
+    Did the request fail with ``error`` before it was sent?
+    """
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # wrapped in a urllib3 MaxRetryError
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, ConnectTimeoutError)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Base class
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -56,6 +75,38 @@ class APIBase(object):
 
         return pkg
 
+    def _map(self, func, items, max_workers=None):
+        """
+        Apply ``func`` to every item using a bounded pool of worker threads.
+        Results are returned in the same order as ``items``.
+        """
+        items = list(items)
+        if max_workers is None:
+            max_workers = self.session.settings.max_request_workers
+        max_workers = min(len(items), max_workers)
+        if max_workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as e:
+            return list(e.map(func, items))
+
+    def _with_retries(self, func, *args, **kwargs):
+        """
+        Call ``func``, retrying with exponential backoff when the request
+        could not be sent (connection refused or timed out). Requests that
+        reached the server are never retried, so this is safe for requests
+        (such as POSTs) that are not idempotent and not retried by the
+        session itself.
+        """
+        retries = self.session.settings.max_request_timeout_retries
+        for attempt in itertools.count():
+            try:
+                return func(*args, **kwargs)
+            except ConnectionError as e:
+                if not _not_sent(e) or attempt >= retries:
+                    raise
+                self._logger.warning("Request failed ({}), retrying...".format(e))
+                time.sleep(0.5 * 2**attempt)
+
     def _uri(self, url_str, **kwvars):
         vals = {k:urllib.parse.quote(str(var)) for k,var in kwvars.items()}
         return url_str.format(**vals)
@@ -2,17 +2,27 @@
 from __future__ import absolute_import, division, print_function
 from future.utils import string_types
 
+import datetime
 import itertools
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
 import requests
 
 from blackfynn.api.base import APIBase
+from blackfynn.utils import chunks
 from blackfynn.models import (
     DataPackage,
     LinkedModelProperty,
     LinkedModelValue,
     Model,
     ModelProperty,
+    ModelPropertyEnumType,
     ModelTemplate,
     ModelSelect,
     ModelFilter,
@@ -21,6 +31,7 @@ from blackfynn.models import (
     QueryResult,
     Record,
     RecordSet,
+    RecordTable,
     Relationship,
     RelationshipProperty,
     RelationshipSet,
@@ -54,6 +65,66 @@ class ModelsAPIBase(APIBase):
             raise Exception("could not get relationship type from relationship {} or instance {} ".format(relationship, instance))
 
 
+class ModelCache(object):
+    """
+    Per-session cache of models and model schemas, keyed by dataset and
+    model type (or id). Entries expire after ``ttl`` seconds; a ``ttl`` of
+    zero disables caching.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, dataset_id, key):
+        with self._lock:
+            entry = self._entries.get((kind, dataset_id, key))
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                self._entries.pop((kind, dataset_id, key), None)
+                return None
+            return value
+
+    def set(self, kind, dataset_id, key, value):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[(kind, dataset_id, key)] = (time.time() + self.ttl, value)
+
+    def set_model(self, model):
+        self.set('model', model.dataset_id, model.type, model)
+        self.set('model', model.dataset_id, model.id, model)
+
+    def invalidate(self, dataset_id, key=None, kind=None):
+        """
+        Drop all entries for a model (given by type, id or ``Model``), or
+        for the whole dataset if ``key`` is not given. If ``kind`` is given,
+        only entries of that kind are dropped.
+        """
+        with self._lock:
+            if key is None:
+                keys = None
+            elif isinstance(key, Model):
+                keys = set([key.id, key.type])
+            else:
+                keys = set([key])
+                # a name may be cached under its id, and vice versa
+                for (entry_kind, ds, k), (_, value) in self._entries.items():
+                    if entry_kind == 'model' and ds == dataset_id and k == key:
+                        keys.update([value.id, value.type])
+
+            for entry in list(self._entries):
+                entry_kind, ds, k = entry
+                if ds == dataset_id and (keys is None or k in keys) and kind in (None, entry_kind):
+                    self._entries.pop(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class ModelsAPI(ModelsAPIBase):
     base_uri = "/models/datasets"
     name = 'concepts'
@@ -64,6 +135,7 @@ class ModelsAPI(ModelsAPIBase):
         self.proxies = ModelProxiesAPI(session)
         self.query = ModelQueryAPI(session)
         super(ModelsAPI, self).__init__(session)
+        self.cache = ModelCache(ttl=session.settings.model_cache_ttl)
 
     def get_properties(self, dataset, concept):
         dataset_id = self._get_id(dataset)
@@ -77,12 +149,58 @@ class ModelsAPI(ModelsAPIBase):
         resp = self._get(self._uri('/{dataset_id}/concepts/{id}/linked', dataset_id=dataset_id, id=concept_id))
         return {r['link']['name']: LinkedModelProperty.from_dict(r) for r in resp}
 
+    def get_schema(self, dataset, concept):
+        """
+        Return the properties and linked properties of a model, memoized
+        per ``(dataset, model id)``.
+        """
+        dataset_id = self._get_id(dataset)
+        concept_id = self._get_id(concept)
+        schema = self.cache.get('schema', dataset_id, concept_id)
+        if schema is None:
+            schema = (
+                self.get_properties(dataset, concept),
+                self.get_linked_properties(dataset, concept))
+            self.cache.set('schema', dataset_id, concept_id, schema)
+        properties, linked = schema
+        return list(properties), dict(linked)
+
+    def invalidate_cache(self, dataset, concept=None):
+        """
+        Drop cached models and schemas for a single model, or for every
+        model in the dataset if ``concept`` is not given.
+        """
+        key = concept if isinstance(concept, Model) else self._get_id(concept)
+        self.cache.invalidate(self._get_id(dataset), key)
+
+    def _models_from_response(self, dataset, resp, lazy=False):
+        """
+        Build ``Model`` objects from a list of model responses. Schemas are
+        fetched concurrently, or deferred until first access if ``lazy``.
+        """
+        dataset_id = self._get_id(dataset)
+        for r in resp:
+            r['dataset_id'] = r.get('dataset_id', dataset_id)
+
+        if not lazy:
+            schemas = self._map(lambda r: self.get_schema(dataset_id, r['id']), resp)
+            for r, (schema, linked) in zip(resp, schemas):
+                r['schema'] = schema
+                r['linked'] = linked
+
+        models = [Model.from_dict(r, api=self.session) for r in resp]
+        if lazy:
+            for m in models:
+                m._unload_schema()
+        return models
+
     def update_properties(self, dataset, concept):
         assert isinstance(concept, Model), "concept must be type Model"
         assert concept.schema, "concept schema cannot be empty"
         data = concept.as_dict()['schema']
         dataset_id = self._get_id(dataset)
         resp = self._put(self._uri('/{dataset_id}/concepts/{id}/properties', dataset_id=dataset_id, id=concept.id), json=data)
+        self.invalidate_cache(dataset, concept)
         return [ModelProperty.from_dict(r) for r in resp]
 
     def update_linked_property(self, dataset, concept, prop):
@@ -90,12 +208,14 @@ class ModelsAPI(ModelsAPIBase):
         concept_id = self._get_id(concept)
         prop_id = self._get_id(prop)
         resp = self._put(self._uri('/{dataset_id}/concepts/{id}/linked/{prop_id}', dataset_id=dataset_id, id=concept_id, prop_id=prop_id), json=prop.as_dict())
+        self.invalidate_cache(dataset, concept)
         return LinkedModelProperty.from_dict(resp)
 
     def delete_property(self, dataset, concept, prop):
         dataset_id  = self._get_id(dataset)
         concept_id  = self._get_id(concept)
         property_id = self._get_id(prop)
+        self.invalidate_cache(dataset, concept)
         return self._del(self._uri('/{dataset_id}/concepts/{concept_id}/properties/{property_id}',
                 dataset_id  = dataset_id,
                 concept_id  = concept_id,
@@ -105,20 +225,31 @@ class ModelsAPI(ModelsAPIBase):
         dataset_id = self._get_id(dataset)
         concept_id = self._get_id(concept)
         prop_id = self._get_id(prop)
+        self.invalidate_cache(dataset, concept)
         self._del(self._uri('/{dataset_id}/concepts/{id}/linked/{prop_id}', dataset_id=dataset_id, id=concept_id, prop_id=prop_id))
 
-    def get(self, dataset, concept):
+    def get(self, dataset, concept, use_cache=False):
+        """
+        Get a model by type or id. If ``use_cache`` is set, a model cached
+        by a previous lookup in this session may be returned instead.
+        """
         dataset_id = self._get_id(dataset)
         concept_id = self._get_id(concept)
+        if use_cache:
+            model = self.cache.get('model', dataset_id, concept_id)
+            if model is not None:
+                return model
         r = self._get(self._uri('/{dataset_id}/concepts/{id}', dataset_id=dataset_id, id=concept_id))
         r['dataset_id'] = r.get('dataset_id', dataset_id)
-        r['schema'] = self.get_properties(dataset, concept)
-        r['linked'] = self.get_linked_properties(dataset, concept)
-        return Model.from_dict(r, api=self.session)
+        r['schema'], r['linked'] = self.get_schema(dataset_id, r['id'])
+        model = Model.from_dict(r, api=self.session)
+        self.cache.set_model(model)
+        return model
 
     def delete(self, dataset, concept):
         dataset_id = self._get_id(dataset)
         concept_id = self._get_id(concept)
+        self.invalidate_cache(dataset, concept)
         return self._del(self._uri('/{dataset_id}/concepts/{id}', dataset_id=dataset_id, id=concept.id))
 
     def update(self, dataset, concept):
@@ -126,6 +257,7 @@ class ModelsAPI(ModelsAPIBase):
         data = concept.as_dict()
         data['id'] = concept.id
         dataset_id = self._get_id(dataset)
+        self.invalidate_cache(dataset, concept)
         r = self._put(self._uri('/{dataset_id}/concepts/{id}', dataset_id=dataset_id, id=concept.id), json=data)
         r['dataset_id'] = r.get('dataset_id', dataset_id)
         if concept.schema:
@@ -162,6 +294,7 @@ class ModelsAPI(ModelsAPIBase):
         concept_id = self._get_id(concept)
         assert prop.name not in self.get_linked_properties(dataset, concept), "Linked property '{}' already exists".format(prop.name)
         resp = self._post(self._uri('/{dataset_id}/concepts/{id}/linked', dataset_id=dataset_id, id=concept_id), json=prop.as_dict())
+        self.invalidate_cache(dataset, concept)
         return LinkedModelProperty.from_dict(resp)
 
     def create_linked_properties(self, dataset, concept, props):
@@ -170,18 +303,13 @@ class ModelsAPI(ModelsAPIBase):
         for p in props:
             assert p.name not in self.get_linked_properties(dataset, concept), "Linked property '{}' already exists".format(p.name)
         resp = self._post(self._uri('/{dataset_id}/concepts/{id}/linked/bulk', dataset_id=dataset_id, id=concept_id), json=[p.as_dict() for p in props])
+        self.invalidate_cache(dataset, concept)
         return [LinkedModelProperty.from_dict(r) for r in resp]
 
-    def get_all(self, dataset):
+    def get_all(self, dataset, lazy=False):
         dataset_id = self._get_id(dataset)
         resp = self._get(self._uri('/{dataset_id}/concepts', dataset_id=dataset_id), stream=True)
-        for r in resp:
-            r['dataset_id'] = r.get('dataset_id', dataset_id)
-            r['schema'] = self.get_properties(dataset, r['id'])
-            r['linked'] = self.get_linked_properties(dataset, r['id'])
-        concepts = [Model.from_dict(r, api=self.session) for r in resp]
-        # for concept in concepts:
-        #     concept.linked = {x.name: x for x in self.get_linked_properties(dataset, concept)}
+        concepts = self._models_from_response(dataset_id, resp, lazy=lazy)
         return { c.type: c for c in concepts }
 
     def delete_instances(self, dataset, concept, *instances):
@@ -206,7 +334,7 @@ class ModelsAPI(ModelsAPIBase):
             ))
         return [DataPackage.from_dict(pkg, api=self.session) for r,pkg in resp]
 
-    def get_connected(self, dataset, model):
+    def get_connected(self, dataset, model, lazy=False):
         """ Return a list of concepts related to the given model """
         dataset_id = self._get_id(dataset)
         model_id = self._get_id(model)
@@ -214,29 +342,19 @@ class ModelsAPI(ModelsAPIBase):
                                    dataset_id=dataset_id,
                                    model_id=model_id),
                          stream=True)
-        for r in resp:
-            r['dataset_id'] = r.get('dataset_id', dataset_id)
-            r['schema'] = self.get_properties(dataset, r['id'])
-            r['linked'] = self.get_linked_properties(dataset, r['id'])
-
-        concepts = [Model.from_dict(r, api=self.session) for r in resp]
+        concepts = self._models_from_response(dataset_id, resp, lazy=lazy)
         return {c.type: c for c in concepts}
 
-    def get_related(self, dataset, concept):
+    def get_related(self, dataset, concept, lazy=False):
         """ Return all SchemaRelationships and the Concepts they point to """
         dataset_id = self._get_id(dataset)
         concept_id = self._get_id(concept)
         resp = self._get(
             self._uri('/{dataset_id}/concepts/{concept_id}/topology',
                       dataset_id=dataset_id, concept_id=concept_id))
-        for r in resp:
-            r['dataset_id'] = r.get('dataset_id', dataset_id)
-            r['schema'] = self.get_properties(dataset, r['id'])
-            r['linked'] = self.get_linked_properties(dataset, r['id'])
-        concepts = [Model.from_dict(r, api=self.session) for r in resp]
-        return concepts
+        return self._models_from_response(dataset_id, resp, lazy=lazy)
 
-    def get_topology(self, dataset):
+    def get_topology(self, dataset, lazy=False):
         dataset_id = self._get_id(dataset)
         resp = self._get(
             self._uri('/{dataset_id}/concepts/schema/graph',
@@ -247,6 +365,7 @@ class ModelsAPI(ModelsAPIBase):
             'relationships': [],
             'linked_properties': []
         }
+        models = []
         for r in resp:
             r['dataset_id'] = r.get('dataset_id', dataset_id)
             if r.get('type')  == 'schemaRelationship':
@@ -259,9 +378,8 @@ class ModelsAPI(ModelsAPIBase):
                     LinkedModelProperty.from_dict(r))
             else:
                 # This is a model
-                r['schema'] = self.get_properties(dataset, r['id'])
-                r['linked'] = self.get_linked_properties(dataset, r['id'])
-                results['models'].append(Model.from_dict(r, api=self.session))
+                models.append(r)
+        results['models'] = self._models_from_response(dataset_id, models, lazy=lazy)
         return results
 
     def get_summary(self, dataset):
@@ -275,6 +393,96 @@ class ModelsAPI(ModelsAPIBase):
 # Model Instances
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+class RecordCursor(object):
+    """
+    Iterates over all records of a model, one page at a time.
+
+    Up to ``prefetch`` pages are requested ahead of the page being consumed,
+    so at most ``(prefetch + 1) * page_size`` records are held in memory.
+
+    Example::
+
+        for record in mouse.iter_records(page_size=500):
+            print(record)
+
+        for df in mouse.iter_records().as_dataframes():
+            print(df.shape)
+    """
+    def __init__(self, api, dataset, concept, page_size=100, prefetch=2, offset=0):
+        assert page_size > 0, "page_size must be positive"
+        assert prefetch >= 0, "prefetch cannot be negative"
+        self._api = api
+        self.dataset_id = api._get_id(dataset)
+        self.concept = concept
+        self.concept_type = api._get_concept_type(concept)
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.offset = offset
+
+    def _get_page(self, offset):
+        resp = self._api._get(
+            self._api._uri('/{dataset_id}/concepts/{concept_type}/instances',
+                dataset_id=self.dataset_id, concept_type=self.concept_type),
+            params=dict(limit=self.page_size, offset=offset))
+        for r in resp:
+            r['dataset_id'] = r.get('dataset_id', self.dataset_id)
+        return resp
+
+    def pages(self):
+        """
+        Yield pages of raw record responses until all records are read.
+        """
+        offsets = itertools.count(self.offset, self.page_size)
+        if self.prefetch == 0:
+            for offset in offsets:
+                page = self._get_page(offset)
+                if page:
+                    yield page
+                if len(page) < self.page_size:
+                    return
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as e:
+            pending = deque(e.submit(self._get_page, next(offsets))
+                            for _ in range(self.prefetch + 1))
+            try:
+                while pending:
+                    page = pending.popleft().result()
+                    if page:
+                        yield page
+                    if len(page) < self.page_size:
+                        return
+                    pending.append(e.submit(self._get_page, next(offsets)))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def __iter__(self):
+        for page in self.pages():
+            for r in page:
+                yield Record.from_dict(r, api=self._api.session)
+
+    def as_dataframes(self, record_id_column_name=None):
+        """
+        Yield each page of records as a pandas DataFrame.
+        """
+        model = self.concept
+        if not isinstance(model, Model):
+            model = self._api.session.concepts.get(self.dataset_id, self.concept_type, use_cache=True)
+        for page in self.pages():
+            yield RecordTable.from_json(model, page).as_dataframe(record_id_column_name)
+
+
+class RecordCreateError(Exception):
+    """
+    Raised when some batches of records could not be created. The records
+    of the other batches were created, and are in ``records``.
+    """
+    def __init__(self, message, records, errors):
+        super(RecordCreateError, self).__init__(message)
+        self.records = records
+        self.errors = errors
+
+
 class RecordsAPI(ModelsAPIBase):
     base_uri = "/models/datasets"
     name = 'concepts.instances'
@@ -325,6 +533,12 @@ class RecordsAPI(ModelsAPIBase):
 
         return RecordSet(concept, instances)
 
+    def iter_all(self, dataset, concept, page_size=100, prefetch=2):
+        """
+        Return a ``RecordCursor`` over all records of the model.
+        """
+        return RecordCursor(self, dataset, concept, page_size=page_size, prefetch=prefetch)
+
     def delete(self, dataset, instance):
         assert isinstance(instance, Record), "instance must be type Record"
         dataset_id = self._get_id(dataset)
@@ -348,20 +562,142 @@ class RecordsAPI(ModelsAPIBase):
         r['dataset_id'] = r.get('dataset_id', dataset_id)
         return Record.from_dict(r, api=self.session)
 
+    def _create_batch(self, dataset_id, concept_type, values):
+        resp = self._with_retries(self._post,
+            self._uri('/{dataset_id}/concepts/{concept_type}/instances/batch', dataset_id=dataset_id, concept_type=concept_type),
+            json=values, stream=True)
+        for r in resp:
+            r['dataset_id'] = r.get('dataset_id', dataset_id)
+        return resp
+
     def create_many(self, dataset, concept, *instances):
+        """
+        Create records in batches of at most ``max_records_per_chunk``,
+        which are submitted concurrently.
+        """
         instance_type = instances[0].type
         for inst in instances:
             assert isinstance(inst, Record), "instance must be type Record"
             assert inst.type == instance_type, "Expected instance of type {}, found instance of type {}".format(instance_type, inst.type)
         dataset_id = self._get_id(dataset)
         values = [inst.as_dict() for inst in instances]
-        resp = self._post(self._uri('/{dataset_id}/concepts/{concept_type}/instances/batch', dataset_id=dataset_id, concept_type=instance_type), json=values, stream=True)
 
-        for r in resp:
-            r['dataset_id'] = r.get('dataset_id', dataset_id)
-        instances = [Record.from_dict(r, api=self.session) for r in resp]
+        def create(batch):
+            try:
+                return self._create_batch(dataset_id, instance_type, batch), None
+            except Exception as e:
+                return None, e
+
+        batches = self._map(create, chunks(values, self.session.settings.max_records_per_chunk))
+        instances = [Record.from_dict(r, api=self.session) for resp, _ in batches if resp for r in resp]
+        errors = [e for _, e in batches if e is not None]
+        if errors:
+            raise RecordCreateError(
+                "Failed to create {} of {} batches of records: {}".format(len(errors), len(batches), errors[0]),
+                RecordSet(concept, instances), errors)
         return RecordSet(concept, instances)
 
+    def _coerce_column(self, prop, column):
+        """
+        Validate a DataFrame column against a model property, converting
+        dates and numbers in a single vectorized pass. Returns the coerced
+        column and a list of invalid row labels.
+        """
+        present = column.notnull()
+        data_type = prop._type.data_type
+        if isinstance(prop._type, ModelPropertyEnumType) and prop._type.multi_select:
+            return column, []
+
+        if data_type in (datetime.date, datetime.datetime):
+            coerced = pd.to_datetime(column, errors='coerce')
+        elif data_type in (int, float):
+            coerced = pd.to_numeric(column, errors='coerce')
+        else:
+            coerced = column
+        invalid = present & coerced.isnull()
+        if data_type is int:
+            # no truncation of fractional values
+            invalid |= present & coerced.notnull() & (coerced % 1 != 0)
+
+        enum = prop._type.enum if isinstance(prop._type, ModelPropertyEnumType) else None
+        if enum:
+            invalid |= present & ~coerced.isin(enum)
+
+        return coerced, list(column.index[invalid])
+
+    def create_from_dataframe(self, dataset, concept, df):
+        """
+        Create one record per DataFrame row, with one column per model
+        property.
+
+        Columns are validated and encoded as a whole, rows are sent in
+        batches of at most ``max_records_per_chunk`` and batches are
+        submitted concurrently, retrying batches that could not be sent.
+
+        Returns:
+            A DataFrame with the same index as ``df`` and columns ``id``
+            (the new record id) and ``error`` (set for rows whose batch
+            failed).
+        """
+        if not isinstance(concept, Model):
+            concept = self.session.concepts.get(dataset, concept, use_cache=True)
+        dataset_id = self._get_id(dataset)
+
+        schema = concept.schema
+        invalid_columns = set(df.columns) - set(schema)
+        assert not invalid_columns, "Invalid properties: {}.\n\nAn instance of {} should only include values for properties defined in its schema: {}".format(invalid_columns, concept.type, set(schema))
+        assert len(df.columns) > 0, "An instance of {} must include values for at least one of its properties: {}".format(concept.type, set(schema))
+
+        missing = [name for name, prop in schema.items() if prop.required and name not in df.columns]
+        assert not missing, "Missing required properties: {}".format(missing)
+
+        # validate & encode, column by column
+        errors = []
+        encoded = []
+        for name in df.columns:
+            prop = schema[name]
+            column, invalid = self._coerce_column(prop, df[name])
+            if invalid:
+                errors.append("'{}' has invalid values in rows {}".format(name, invalid[:10]))
+            elif prop.required and column.isnull().any():
+                errors.append("'{}' is required but missing in rows {}".format(name, list(df.index[column.isnull()][:10])))
+            else:
+                column = column.astype(object).where(column.notnull(), None)
+                encoded.append([prop._type._encode_value(v) for v in column])
+        if errors:
+            raise Exception("Invalid values for {}:\n  {}".format(concept.type, "\n  ".join(errors)))
+
+        data_types = [schema[name]._type._blackfynn_type for name in df.columns]
+        values = [
+            {'values': [
+                dict(name=name, value=v, dataType=data_type)
+                for name, data_type, v in zip(df.columns, data_types, row)
+                if v is not None
+            ]}
+            for row in zip(*encoded)
+        ]
+
+        def create(batch):
+            start, values = batch
+            try:
+                resp = self._create_batch(dataset_id, concept.type, values)
+                return start, [r['id'] for r in resp], None
+            except Exception as e:
+                self._logger.error("Failed to create records {}-{}: {}".format(start, start + len(values) - 1, e))
+                return start, None, str(e)
+
+        size = self.session.settings.max_records_per_chunk
+        ids = np.full(len(df), None, dtype=object)
+        failures = np.full(len(df), None, dtype=object)
+        for start, batch_ids, error in self._map(create, [(i, values[i:i+size]) for i in range(0, len(values), size)]):
+            end = start + min(size, len(values) - start)
+            if error is None:
+                ids[start:end] = batch_ids
+            else:
+                failures[start:end] = error
+
+        return pd.DataFrame({'id': ids, 'error': failures}, index=df.index, columns=['id', 'error'])
+
     def get_all_related(self, dataset, source_instance):
         related = self.get_counts(dataset, source_instance)
         return {
@@ -400,7 +736,7 @@ class RecordsAPI(ModelsAPIBase):
         for edge, node in resp:
             node['dataset_id'] = node.get('dataset_id', dataset_id)
         if not isinstance(return_type, Model):
-            return_type = self.session.concepts.get(dataset, return_type)
+            return_type = self.session.concepts.get(dataset, return_type, use_cache=True)
         records = [Record.from_dict(r, api=self.session) for _,r in resp]
         return RecordSet(return_type, records)
 
@@ -418,10 +754,14 @@ class RecordsAPI(ModelsAPIBase):
         concept_id = self._get_id(concept)
         instance_id = self._get_id(instance)
         resp = self._get(self._uri('/{dataset_id}/concepts/{id}/instances/{instance_id}/linked', dataset_id=dataset_id, id=concept_id, instance_id=instance_id))
+        _, linked = self.session.concepts.get_schema(dataset, concept)
+        link_types = {link.id: link for link in linked.values()}
         values = []
         for r in resp:
-            link_type = concept.get_linked_property(r["schemaLinkedPropertyId"])
-            target = concept._api.concepts.get(dataset, link_type.target)
+            link_type = link_types.get(r["schemaLinkedPropertyId"])
+            if link_type is None:
+                link_type = concept.get_linked_property(r["schemaLinkedPropertyId"])
+            target = self.session.concepts.get(dataset, link_type.target, use_cache=True)
             values.append(LinkedModelValue.from_dict(r, source_model=concept,
                 target_model=target, link_type=link_type))
         return values
@@ -438,7 +778,7 @@ class RecordsAPI(ModelsAPIBase):
 
         resp = self._post(self._uri('/{dataset_id}/concepts/{id}/instances/{instance_id}/linked', dataset_id=dataset_id, id=concept_id, instance_id=instance_id), json=payload)
         link_type = concept.get_linked_property(resp["schemaLinkedPropertyId"])
-        target = concept._api.concepts.get(dataset, link_type.target)
+        target = self.session.concepts.get(dataset, link_type.target, use_cache=True)
         return LinkedModelValue.from_dict(resp, source_model=concept,
             target_model=target, link_type=link_type)
 
@@ -461,6 +801,9 @@ class ModelRelationshipsAPI(ModelsAPIBase):
     def __init__(self, session):
         self.instances = ModelRelationshipInstancesAPI(session)
         super(ModelRelationshipsAPI, self).__init__(session)
+        # registry of relationship types, per dataset
+        self.cache = ModelCache(ttl=session.settings.model_cache_ttl)
+        self._lock = threading.RLock()
 
     def create(self, dataset, relationship):
         assert isinstance(relationship, RelationshipType), "Must be of type Relationship"
@@ -468,7 +811,51 @@ class ModelRelationshipsAPI(ModelsAPIBase):
         rel_dict = relationship.as_dict()
         r = self._post(self._uri('/{dataset_id}/relationships', dataset_id=dataset_id), json=rel_dict)
         r['dataset_id'] = r.get('dataset_id', dataset_id)
-        return RelationshipType.from_dict(r, api=self.session)
+        created = RelationshipType.from_dict(r, api=self.session)
+        self.cache.set('relationship', dataset_id, created.type, created)
+        return created
+
+    def _get_model_id(self, dataset, model):
+        if isinstance(model, Model):
+            return model.id
+        if isinstance(model, Record):
+            model = model.type
+        return self.session.concepts.get(dataset, model, use_cache=True).id
+
+    def get_or_create(self, dataset, name, description=None, source=None, destination=None):
+        """
+        Get a relationship type by name from the session's registry, loading
+        the dataset's relationship types if needed, and create it if it does
+        not exist.
+
+        ``source`` and ``destination`` can be models, records or model
+        names; they are only resolved if the relationship type is created.
+        """
+        dataset_id = self._get_id(dataset)
+        with self._lock:
+            relationship = self.cache.get('relationship', dataset_id, name)
+            if relationship is None:
+                relationship = self.get_all(dataset_id).get(name)
+            if relationship is None:
+                if source is not None:
+                    source = self._get_model_id(dataset_id, source)
+                if destination is not None:
+                    destination = self._get_model_id(dataset_id, destination)
+                r = RelationshipType(dataset_id=dataset_id, name=name,
+                                     description=description or name,
+                                     source=source, destination=destination)
+                relationship = self.create(dataset_id, r)
+            return relationship
+
+    def invalidate_cache(self, dataset=None):
+        """
+        Forget registered relationship types for a dataset, or for all
+        datasets.
+        """
+        if dataset is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(self._get_id(dataset))
 
     def get(self, dataset, relationship):
         dataset_id = self._get_id(dataset)
@@ -483,8 +870,20 @@ class ModelRelationshipsAPI(ModelsAPIBase):
         for r in resp:
           r['dataset_id'] = r.get('dataset_id', dataset_id)
         relations = [RelationshipType.from_dict(r, api=self.session) for r in resp]
+        # the listing is complete: forget types that no longer exist
+        self.cache.invalidate(dataset_id, kind='relationship')
+        for r in relations:
+            self.cache.set('relationship', dataset_id, r.type, r)
         return {r.type: r for r in relations}
 
+    def delete(self, dataset, relationship):
+        assert isinstance(relationship, RelationshipType), "Must be of type RelationshipType"
+        dataset_id = self._get_id(dataset)
+        with self._lock:
+            self.cache.invalidate(dataset_id, relationship.type, kind='relationship')
+            return self._del(self._uri('/{dataset_id}/relationships/{r_id}',
+                                       dataset_id=dataset_id, r_id=relationship.id))
+
 class ModelRelationshipInstancesAPI(ModelsAPIBase):
     base_uri = "/models/datasets"
     name = 'concepts.relationships.instances'
@@ -540,17 +939,195 @@ class ModelRelationshipInstancesAPI(ModelsAPIBase):
         r['dataset_id'] = r.get('dataset_id', dataset_id)
         return Relationship.from_dict(r, api=self.session)
 
+    def _create_batch(self, dataset_id, relationship_type, instances):
+        values = [inst.as_dict() for inst in instances]
+        resp = self._with_retries(self._post,
+            self._uri('/{dataset_id}/relationships/{r_type}/instances/batch', dataset_id=dataset_id, r_type=relationship_type),
+            json=values)
+        for r in resp:
+            r[0]['dataset_id'] = r[0].get('dataset_id', dataset_id)
+        return [Relationship.from_dict(r[0], api=self.session) for r in resp]
+
     def create_many(self, dataset, relationship, *instances):
         assert all([isinstance(i, Relationship) for i in instances]), "instances must be of type Relationship"
         instance_type = instances[0].type
         dataset_id = self._get_id(dataset)
-        values = [inst.as_dict() for inst in instances]
-        resp = self._post( self._uri('/{dataset_id}/relationships/{r_type}/instances/batch', dataset_id=dataset_id, r_type=instance_type), json=values)
+        batches = self._map(
+            lambda batch: self._create_batch(dataset_id, instance_type, batch),
+            chunks(instances, self.session.settings.max_records_per_chunk))
+        return RelationshipSet(relationship, [r for batch in batches for r in batch])
 
-        for r in resp:
-            r[0]['dataset_id'] = r[0].get('dataset_id', dataset_id)
-        instances =  [Relationship.from_dict(r[0], api=self.session) for r in resp]
-        return RelationshipSet(relationship, instances)
+    def create_bulk(self, dataset, relationship, items):
+        """
+        Create relationships of a single type from a list of
+        ``(source, destination)`` tuples or ``source``/``destination`` dicts,
+        a two-column array, or a DataFrame (see ``RelationshipLoader``).
+
+        Raises:
+            RelationshipLoadError: if some relationships could not be created.
+                Call ``error.loader.run()`` to retry just those.
+        """
+        return RelationshipLoader(self, dataset, relationship, items).run()
+
+
+class RelationshipLoadError(Exception):
+    """
+    Raised when a bulk relationship load partially fails. The ``loader``
+    attribute can be used to resume it.
+    """
+    def __init__(self, message, loader):
+        super(RelationshipLoadError, self).__init__(message)
+        self.loader = loader
+
+
+class RelationshipLoader(object):
+    """
+    Creates many relationships of a single type.
+
+    Relationships between records are sent in batches of
+    ``max_records_per_chunk``; relationships to packages are created one
+    proxy at a time. Either way, requests are made concurrently and
+    retried if they could not be sent. Batches that still fail are kept, so calling
+    ``run()`` again only resubmits what is missing.
+
+    ``items`` can be a DataFrame with ``source``/``destination`` (or
+    ``from``/``to``) columns, where every other column is a relationship
+    value; a two-column array; or a list of ``(source, destination)``
+    tuples or dicts with ``source``/``destination`` and optional
+    ``values`` keys. Sources and destinations are ``Record`` or
+    ``DataPackage`` objects, or their ids.
+    """
+    def __init__(self, api, dataset, relationship, items):
+        assert isinstance(relationship, RelationshipType), "relationship must be of type RelationshipType"
+        self._api = api
+        self.dataset_id = api._get_id(dataset)
+        self.relationship = relationship
+
+        relationships, proxies = [], []
+        for src, dest, values in self._parse_items(items):
+            if self._is_package(src) or self._is_package(dest):
+                proxies.append(self._proxy_args(src, dest, values))
+            else:
+                relationships.append(Relationship(
+                    dataset_id  = self.dataset_id,
+                    type        = relationship.type,
+                    source      = src,
+                    destination = dest,
+                    values      = [
+                        dict(name=k, value=v, dataType=relationship.schema.get(k).type)
+                        for k,v in values.items()
+                    ]))
+
+        size = api.session.settings.max_records_per_chunk
+        self.batches = [('batch', b) for b in chunks(relationships, size)]
+        self.batches.extend(('proxy', p) for p in proxies)
+        self.results = {}
+        self.errors = {}
+
+    def _parse_items(self, items):
+        if isinstance(items, pd.DataFrame):
+            columns = list(items.columns)
+            src = 'source' if 'source' in columns else 'from'
+            dest = 'destination' if 'destination' in columns else 'to'
+            value_columns = [c for c in columns if c not in (src, dest)]
+            for row in items.itertuples(index=False):
+                # numpy scalars are not JSON serializable
+                row = dict(zip(columns, (v.item() if isinstance(v, np.generic) else v for v in row)))
+                values = {c: row[c] for c in value_columns if not pd.isnull(row[c])}
+                yield row[src], row[dest], values
+            return
+
+        if isinstance(items, (dict, tuple)):
+            items = [items]
+        for item in items:
+            if isinstance(item, dict):
+                src = item.get('from', item.get('source'))
+                dest = item.get('to', item.get('destination'))
+                values = item.get('values', {})
+            elif len(item) == 2:
+                src, dest = item
+                values = {}
+            else:
+                raise Exception("Expected relationship as tuple or dictionary, found {}".format(type(item)))
+
+            if not isinstance(src, (Record, DataPackage, string_types)):
+                raise Exception('source must be object of type Record, DataPackage, or UUID')
+            if not isinstance(dest, (Record, DataPackage, string_types)):
+                raise Exception('destination must be object of type Record, DataPackage, or UUID')
+            yield src, dest, values
+
+    @staticmethod
+    def _is_package(thing):
+        if isinstance(thing, DataPackage):
+            return True
+        return isinstance(thing, string_types) and thing.startswith('N:package:')
+
+    def _proxy_args(self, src, dest, values):
+        if self._is_package(src):
+            package, record, direction, model = src, dest, "ToTarget", self.relationship.destination
+        else:
+            package, record, direction, model = dest, src, "FromTarget", self.relationship.source
+        assert not self._is_package(record), "DataPackages can only be linked to Records"
+
+        concept = None
+        if not isinstance(record, Record):
+            assert model is not None, "Linking a package to a record id requires a RelationshipType with a source and destination model"
+            concept = self._api.session.concepts.get(self.dataset_id, model, use_cache=True)
+        return (self._api._get_id(package), record, values, direction, concept)
+
+    def _submit(self, index):
+        kind, args = self.batches[index]
+        try:
+            if kind == 'batch':
+                result = self._api._create_batch(self.dataset_id, self.relationship.type, args)
+            else:
+                package, record, values, direction, concept = args
+                result = [self._api._with_retries(
+                    self._api.session.concepts.proxies.create,
+                    self.dataset_id, package, self.relationship, record, values,
+                    direction, "package", concept)]
+        except Exception as e:
+            return index, None, e
+        return index, result, None
+
+    @property
+    def pending(self):
+        return [i for i in range(len(self.batches)) if i not in self.results]
+
+    @property
+    def complete(self):
+        return not self.pending
+
+    @property
+    def relationships(self):
+        """
+        All relationships created so far, in input order.
+        """
+        created = [r for i in sorted(self.results) for r in self.results[i]]
+        return RelationshipSet(self.relationship, created)
+
+    def run(self):
+        """
+        Submit all batches that have not been created yet.
+
+        Returns:
+            ``RelationshipSet`` of all created relationships
+
+        Raises:
+            RelationshipLoadError: if any batch failed.
+        """
+        self.errors = {}
+        for index, result, error in self._api._map(self._submit, self.pending):
+            if error is None:
+                self.results[index] = result
+            else:
+                self.errors[index] = error
+
+        if self.errors:
+            message = "Failed to create {} of {} relationship batches (first error: {}). Call loader.run() to resume.".format(
+                len(self.errors), len(self.batches), next(iter(self.errors.values())))
+            raise RelationshipLoadError(message, self)
+        return self.relationships
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Model Proxies
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function
+from builtins import object
+
+import threading
+import weakref
+from collections import OrderedDict
 
 from blackfynn.api.base import APIBase
 from blackfynn.models import (
     BaseDataNode,
+    BaseNode,
     Collection,
     DataPackage,
     Dataset,
@@ -13,9 +19,125 @@ from blackfynn.models import (
     Relationship,
     RelationshipType,
     User,
+    _merge_state,
     get_package_class
 )
 
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Local objects
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class LocalRegistry(object):
+    """
+    Identity map of platform objects, keyed by type and id (ids of some
+    objects, such as annotations and layers, are only unique per type).
+
+    Objects are referenced weakly and disappear once nothing else refers to
+    them. The ``size`` most recently used objects are also kept alive, so
+    that fetching the same object again shortly after still returns the
+    same instance.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._objects = weakref.WeakValueDictionary()
+        # id -> most recently registered object, for lookups without a type
+        self._latest = weakref.WeakValueDictionary()
+        self._recent = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _touch(self, key, thing):
+        if self.size <= 0:
+            return
+        self._recent.pop(key, None)
+        self._recent[key] = thing
+        while len(self._recent) > self.size:
+            self._recent.popitem(last=False)
+
+    def _register(self, thing):
+        key = (type(thing), thing.id)
+        self._objects[key] = thing
+        self._latest[thing.id] = thing
+        self._touch(key, thing)
+
+    def get(self, id, cls=None):
+        with self._lock:
+            if cls is None:
+                thing = self._latest.get(id)
+            else:
+                thing = self._objects.get((cls, id))
+            if thing is not None:
+                self._touch((type(thing), id), thing)
+            return thing
+
+    def set(self, thing):
+        if thing.id is None:
+            return
+        with self._lock:
+            self._register(thing)
+
+    def merge(self, thing, fields=None):
+        """
+        Returns the registered instance of ``thing``'s type and id, refreshed
+        with the state of ``thing`` (only ``fields``, if given; see
+        ``_merge_state``). If there is none ``thing`` is registered and
+        returned instead.
+        """
+        if thing.id is None:
+            return thing
+        with self._lock:
+            existing = self._objects.get((type(thing), thing.id))
+            if existing is not None:
+                if existing is not thing:
+                    _merge_state(existing, thing, fields)
+                self.hits += 1
+                self._latest[thing.id] = existing
+                self._touch((type(thing), thing.id), existing)
+                return existing
+
+            self.misses += 1
+            self._register(thing)
+            return thing
+
+    def pop(self, id, cls=None):
+        with self._lock:
+            thing = self.get(id, cls)
+            if thing is None:
+                return None
+            key = (type(thing), id)
+            self._recent.pop(key, None)
+            self._objects.pop(key, None)
+            if self._latest.get(id) is thing:
+                del self._latest[id]
+            return thing
+
+    def values(self):
+        with self._lock:
+            return list(self._objects.values())
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._latest.clear()
+            self._recent.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=len(self._objects),
+                recent=len(self._recent),
+                max_recent=self.size,
+                hits=self.hits,
+                misses=self.misses)
+
+    def __len__(self):
+        return len(self._objects)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Core API
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -29,7 +151,7 @@ class CoreAPI(APIBase):
 
     def __init__(self, *args, **kwargs):
         super(CoreAPI, self).__init__(*args, **kwargs)
-        self._data_registry = {}
+        self._data_registry = LocalRegistry(size=self.session.settings.max_local_objects)
 
     def create(self, thing):
         """
@@ -108,18 +230,32 @@ class CoreAPI(APIBase):
                 thing.id = None
 
     def set_local(self, thing):
-        self._data_registry.update({thing.id: thing})
+        self._data_registry.set(thing)
+
+    def merge_local(self, thing, fields=None):
+        """
+        Returns the local instance of ``thing``, refreshed with its state.
+        """
+        return self._data_registry.merge(thing, fields)
 
     def get_local(self, thing):
         id = self._get_id(thing)
-        return self._data_registry.get(id, None)
+        cls = type(thing) if isinstance(thing, BaseNode) else None
+        return self._data_registry.get(id, cls)
 
     def get_locals(self):
-        return list(self._data_registry.values())
+        return self._data_registry.values()
 
     def rm_local(self, thing):
         id = self._get_id(thing)
-        return self._data_registry.pop(id, None)
+        cls = type(thing) if isinstance(thing, BaseNode) else None
+        return self._data_registry.pop(id, cls)
+
+    def local_stats(self):
+        """
+        Size and hit/miss counts of the local object registry.
+        """
+        return self._data_registry.stats()
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -192,21 +328,34 @@ class SearchAPI(APIBase):
     base_uri = '/search'
     name = 'search'
 
-    def query(self, terms, max_results=10):
+    def query(self, terms, max_results=10, hydrate=True, raw=False):
+        """
+        Search the platform.
+
+        terms:       query string
+        max_results: maximum number of results
+        hydrate:     fetch the full object for every hit (concurrently). If
+                     False, objects are built from the search hits directly.
+        raw:         return the search hits as returned by the API
+        """
         data = dict(
             query = terms,
             maxResults = max_results
         )
         resp = self._post(endpoint='', json=data)
+        if raw:
+            return resp
 
-        results = []
-        for r in resp:
+        def get(r):
             pkg_cls = get_package_class(r)
-            if pkg_cls == Dataset:
-                pkg = self.session.datasets.get(r['id'])
+            if not hydrate:
+                data = r if 'content' in r else dict(content=dict(r))
+                return pkg_cls.from_dict(data, api=self.session)
+            elif pkg_cls == Dataset:
+                return self.session.datasets.get(r['id'])
             else:
-                pkg = self.session.packages.get(r['id'])
-
-            results.append(pkg)
+                return self.session.packages.get(r['id'])
 
-        return results
+        if not hydrate:
+            return [get(r) for r in resp]
+        return self._map(get, resp)
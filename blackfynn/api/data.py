@@ -4,6 +4,10 @@ from future.utils import string_types
 
 import datetime
 import math
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 import pandas as pd
 import requests
@@ -11,6 +15,7 @@ import requests
 import blackfynn.log as log
 from blackfynn.api.base import APIBase
 from blackfynn.models import (
+    BaseCollection,
     BaseDataNode,
     Collection,
     Dataset,
@@ -33,12 +38,72 @@ class DatasetsAPI(APIBase):
     base_uri='/datasets'
     name = 'datasets'
 
+    def __init__(self, *args, **kwargs):
+        super(DatasetsAPI, self).__init__(*args, **kwargs)
+        # name/id -> dataset, loaded on first lookup
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @staticmethod
+    def _name_key(name):
+        return name.lower().strip().replace(' ', '').replace('_','').replace('-','')
+
+    def _build_index(self, datasets):
+        index = {}
+        for ds in datasets:
+            index.setdefault(self._name_key(ds.name), ds)
+            index[ds.id] = ds
+        self._index = index
+
+    def _add_to_index(self, ds):
+        with self._index_lock:
+            if self._index is not None:
+                self._index[self._name_key(ds.name)] = ds
+                self._index[ds.id] = ds
+
+    def _find(self, name_or_id):
+        ds = self._index.get(name_or_id)
+        if ds is not None and ds.id == name_or_id:
+            return ds
+
+        key = self._name_key(name_or_id)
+        ds = self._index.get(key)
+        # indexed datasets may since have been renamed or deleted
+        if ds is not None and ds.id is not None and self._name_key(ds.name) == key:
+            return ds
+
+    def _lookup(self, name_or_id, refresh=True, cached=False):
+        """
+        Find a dataset in the index. The index is loaded on first use and
+        reloaded on a miss, unless ``refresh`` is False. If ``cached``, no
+        requests are made at all.
+        """
+        with self._index_lock:
+            if self._index is None:
+                if cached:
+                    return None
+                self._build_index(self.get_all())
+                return self._find(name_or_id)
+
+            ds = self._find(name_or_id)
+            if ds is None and refresh and not cached:
+                self._build_index(self.get_all())
+                ds = self._find(name_or_id)
+            return ds
+
+    def invalidate_cache(self):
+        """
+        Drop the dataset name index; it is reloaded on the next lookup.
+        """
+        with self._index_lock:
+            self._index = None
+
     def get(self, ds):
         id = self._get_id(ds)
         resp = self._get( self._uri('/{id}', id=id))
         return Dataset.from_dict(resp, api=self.session)
 
-    def get_by_name_or_id(self, name_or_id):
+    def get_by_name_or_id(self, name_or_id, cached=False):
         """
         Get Dataset by name or ID.
 
@@ -51,17 +116,11 @@ class DatasetsAPI(APIBase):
           - "my_DataSet"
           - "mYdata SET"
 
+        Datasets are looked up in an index that is loaded once and reloaded
+        when nothing matches. If ``cached`` is True, only the index is
+        searched (without making any requests).
         """
-        def name_key(n):
-            return n.lower().strip().replace(' ', '').replace('_','').replace('-','')
-
-        search_key = name_key(name_or_id)
-
-        def is_match(ds):
-            return (name_key(ds.name) == search_key) or (ds.id == name_or_id)
-
-        matches = [ds for ds in self.get_all() if is_match(ds)]
-        return matches[0] if matches else None
+        return self._lookup(name_or_id, cached=cached)
 
     def get_all(self):
         resp = self._get( self._uri('/'))
@@ -71,11 +130,15 @@ class DatasetsAPI(APIBase):
         """
         Create a dataset on the platform
         """
-        if self.get_by_name_or_id(ds.name) is not None:
+        # only the index is checked: the server rejects duplicates that
+        # it does not know about (e.g. created by other clients)
+        if self._lookup(ds.name, cached=True) is not None:
             raise Exception("Dataset with name {} already exists".format(ds.name))
 
         resp = self._post('', json=ds.as_dict())
-        return Dataset.from_dict(resp, api=self.session)
+        ds = Dataset.from_dict(resp, api=self.session)
+        self._add_to_index(ds)
+        return ds
 
     def update(self, ds):
         """
@@ -83,7 +146,9 @@ class DatasetsAPI(APIBase):
         """
         id = self._get_id(ds)
         resp = self._put( self._uri('/{id}', id=id), json=ds.as_dict())
-        return Dataset.from_dict(resp, api=self.session)
+        ds = Dataset.from_dict(resp, api=self.session)
+        self._add_to_index(ds)
+        return ds
 
     def delete(self, ds):
         """
@@ -91,6 +156,9 @@ class DatasetsAPI(APIBase):
         """
         id = self._get_id(ds)
         resp = self._del( self._uri('/{id}', id=id))
+        with self._index_lock:
+            if self._index is not None:
+                self._index = {k: v for k, v in self._index.items() if v.id != id}
         ds.id = None
         return resp
 
@@ -140,6 +208,52 @@ class DataAPI(APIBase):
         dest = self._get_id(destination) if destination is not None else None
         return self._post("/move", json=dict(things=ids, destination=dest))
 
+    def walk(self, collection, package_type=None, max_depth=None, max_workers=None, refresh=True):
+        """
+        Generator over all items below ``collection``, breadth-first.
+
+        Collections are fetched concurrently by up to ``max_workers`` threads
+        and ``(path, item)`` tuples are yielded as their contents arrive, where
+        ``path`` is the tuple of collection names leading to ``item``
+        (relative to ``collection``).
+
+        package_type: only yield items of this type (or types), e.g. 'TimeSeries'
+        max_depth:    do not descend more than this many levels (1 = direct items)
+        refresh:      fetch the contents of every collection, instead of using
+                      the items already loaded
+        """
+        if isinstance(package_type, string_types):
+            package_type = [package_type]
+        if package_type is not None:
+            package_type = set(t.lower() for t in package_type)
+        if max_workers is None:
+            max_workers = self.session.settings.max_request_workers
+        max_workers = max(max_workers, 1)
+
+        def list_items(c):
+            if refresh or c._items is None:
+                fresh = c._get_method(c)
+                c._items = fresh._items if fresh._items is not None else []
+                c._indexes = {}
+            return c._items
+
+        queue = deque([(collection, (), 1)])
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as e:
+            while queue or pending:
+                while queue and len(pending) < max_workers:
+                    c, path, depth = queue.popleft()
+                    pending[e.submit(list_items, c)] = (path, depth)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    for item in future.result():
+                        if isinstance(item, BaseCollection) and (max_depth is None or depth < max_depth):
+                            queue.append((item, path + (item.name,), depth + 1))
+                        if package_type is None or (item.type or '').lower() in package_type:
+                            yield path, item
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Packages
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -256,13 +370,66 @@ class PackagesAPI(APIBase):
         if 'url' in resp:
             return resp['url']
         else:
-            raise Exception("Unable to get URL for file ID = {}".format(file_id))
+            raise Exception("Unable to get URL for file ID = {}".format(args['file_id']))
+
+    def get_presigned_urls_for_files(self, files):
+        """
+        Get presigned URLs for many source files in one request. Returns a
+        ``{file id: url}`` map; files without a URL are left out.
+        """
+        payload = {'files': [
+            {'packageId': self._get_id(f.pkg_id), 'fileId': self._get_id(f)}
+            for f in files
+        ]}
+        resp = self._post(self._uri('/files/urls'), json=payload)
+        return {r['fileId']: r['url'] for r in resp if r.get('url')}
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Tabular
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required for Arrow and Parquet output: pip install pyarrow")
+    return pyarrow
+
+
+def _dataframe_chunk(schema, rows):
+    columns = schema.decode_rows(rows)
+    return pd.DataFrame(columns, columns=list(columns), copy=False)
+
+
+def _arrow_chunk(schema, rows):
+    """
+    Rows -> ``pyarrow.RecordBatch``. Column types only depend on the
+    schema, so that all chunks of a table share the same Arrow schema;
+    columns of unknown datatypes are strings.
+    """
+    pa = _import_pyarrow()
+    arrow_types = {
+        int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string(),
+        datetime.datetime: pa.timestamp('ns', tz='UTC'),
+    }
+    arrays, names = [], []
+    for column in schema.columns:
+        data_type = column.data_type
+        values = [row.get(column.name) for row in rows]
+        if data_type is datetime.datetime:
+            values = column.decode(values)
+        elif data_type is str or data_type not in arrow_types:
+            values = [v if v is None else str(v) for v in values]
+        else:
+            # empty strings in typed columns are missing values
+            values = [None if v == '' else v for v in values]
+        arrays.append(pa.array(values, type=arrow_types.get(data_type, pa.string()), from_pandas=True))
+        names.append(column.label)
+    return pa.RecordBatch.from_arrays(arrays, names)
+
+
 class TabularAPI(APIBase):
     base_uri = "/tabular"
     name = 'tabular'
@@ -276,40 +443,105 @@ class TabularAPI(APIBase):
 
         return self._get(path, params=params)
 
-    def get_tabular_data_iter(self, package, offset, order_by, order_direction, chunk_size=10000):
+    def get_tabular_data_iter(self, package, offset, order_by, order_direction, chunk_size=10000, limit=None, output='dataframe'):
         """
-        Return iterator that yields chunk_size data each call
+        Return iterator that yields chunk_size data each call, up to ``limit``
+        rows (all rows if None).
+
+        The next ``tabular_prefetch_chunks`` chunks are requested concurrently
+        while earlier chunks are consumed; chunks past ``limit`` are never
+        requested. Rows are decoded into typed columns using the table
+        schema, as DataFrames or, with ``output='arrow'``, as
+        ``pyarrow.RecordBatch`` (requires pyarrow).
         """
 
         if chunk_size > 10000:
             raise ValueError('Chunk size must be less than 10000')
+        if output == 'dataframe':
+            decode = _dataframe_chunk
+        elif output == 'arrow':
+            decode = _arrow_chunk
+        else:
+            raise ValueError("output must be 'dataframe' or 'arrow'")
 
         schema = self.get_table_schema(package)
-        column_names = {x.name: x.display_name if x.display_name else x.name
-                         for x in schema.column_schema}
-        internal_columns = [x.name for x in schema.column_schema if x.internal]
-
-        while True:
-            resp = self._get_data_chunked(package, chunk_size=chunk_size, offset=offset, order_direction=order_direction, order_by=order_by)
-            offset = offset + chunk_size
 
-            df = pd.DataFrame.from_records(resp['rows'], exclude=internal_columns)
-            df.columns = [column_names.get(c) for c in df.columns]
-
-            yield df
-
-            if len(df) < chunk_size:
-                break
+        def plan():
+            # (offset, size) of every chunk to request
+            start = offset
+            end = None if limit is None else offset + limit
+            while end is None or start < end:
+                size = chunk_size if end is None else min(chunk_size, end - start)
+                yield start, size
+                start += size
+
+        def fetch(chunk):
+            start, size = chunk
+            resp = self._get_data_chunked(package, chunk_size=size, offset=start, order_direction=order_direction, order_by=order_by)
+            rows = resp['rows']
+            return size, len(rows), decode(schema, rows)
+
+        chunks = plan()
+        pending = deque()
+        prefetch = max(self.session.settings.tabular_prefetch_chunks, 1)
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            try:
+                for chunk in islice(chunks, prefetch):
+                    pending.append(executor.submit(fetch, chunk))
+
+                first = True
+                while pending:
+                    size, n_rows, data = pending.popleft().result()
+                    if n_rows < size:
+                        # end of the table: requests ahead of it are wasted
+                        while pending:
+                            pending.pop().cancel()
+                    else:
+                        for chunk in islice(chunks, 1):
+                            pending.append(executor.submit(fetch, chunk))
+
+                    if not n_rows and not first:
+                        break
+                    first = False
+
+                    yield data
+            finally:
+                while pending:
+                    pending.pop().cancel()
 
     def get_tabular_data(self, package, limit, offset, order_by, order_direction):
         """
         Get data for tabular package using iterator
         """
-        tab_iter = self.get_tabular_data_iter(package=package, offset=offset, order_by=order_by, order_direction=order_direction)
-        df = pd.DataFrame()
-        for tmp_df in tab_iter:
-            df = df.append(tmp_df)
-        return df[0:limit]
+        tab_iter = self.get_tabular_data_iter(package=package, offset=offset, limit=limit, order_by=order_by, order_direction=order_direction)
+        frames = list(tab_iter)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def write_tabular_parquet(self, package, path, limit, offset, order_by, order_direction, chunk_size=10000):
+        """
+        Write data of tabular package to the Parquet file ``path``, one
+        chunk at a time (requires pyarrow). Returns the number of rows written.
+        """
+        pa = _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        tab_iter = self.get_tabular_data_iter(
+            package=package, offset=offset, limit=limit, order_by=order_by,
+            order_direction=order_direction, chunk_size=chunk_size, output='arrow')
+        writer = None
+        rows = 0
+        try:
+            for batch in tab_iter:
+                if writer is None:
+                    writer = pq.ParquetWriter(path, batch.schema)
+                writer.write_table(pa.Table.from_batches([batch]))
+                rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
 
     def set_table_schema(self, package, tabular_schema):
         """
@@ -8,6 +8,7 @@ import datetime
 import itertools
 import math
 import re
+import struct
 
 from concurrent.futures import ThreadPoolExecutor
 from itertools import count, islice
@@ -19,12 +20,14 @@ import requests
 # blackfynn
 from blackfynn.api.base import APIBase
 from blackfynn.cache import get_cache
+from blackfynn.cache.cache import create_segment
 from blackfynn.models import (
     File,
     TimeSeries,
     TimeSeriesAnnotation,
     TimeSeriesAnnotationLayer,
     TimeSeriesChannel,
+    _copy_state,
     get_package_class
 )
 from blackfynn.utils import infer_epoch, usecs_since_epoch, usecs_to_datetime
@@ -64,6 +67,104 @@ def parse_timedelta(time):
 
 vec_usecs_to_datetime = np.vectorize(usecs_to_datetime)
 
+
+def _sample_times(index, n, rate=None, start=None):
+    """
+    Times (nanoseconds since Epoch) of ``n`` samples. A ``DatetimeIndex`` is
+    used as-is; otherwise samples are spaced by ``rate`` (Hz) from ``start``.
+    Without ``rate``, a numeric index (other than the default ``RangeIndex``
+    of row numbers) is taken as microseconds since Epoch.
+    """
+    if isinstance(index, pd.DatetimeIndex):
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        return index.asi8
+    if rate is not None:
+        if start is None:
+            raise ValueError('`start` is required to place samples at `rate`')
+        offsets = np.round(np.arange(n) * (1.0e9 / rate)).astype(np.int64)
+        return infer_epoch(start) * 1000 + offsets
+    if (index is not None and not isinstance(index, pd.RangeIndex)
+            and np.issubdtype(index.dtype, np.number)):
+        if np.issubdtype(index.dtype, np.integer):
+            return np.asarray(index, dtype=np.int64) * 1000
+        return np.round(np.asarray(index, dtype=np.float64) * 1000).astype(np.int64)
+    raise ValueError('Cannot determine sample times: use a DatetimeIndex, '
+                     'or specify `rate` and `start`')
+
+
+def _stream_columns(data, channels=None, rate=None, start=None):
+    """
+    Split ``data`` (DataFrame, Series, dict or array) into
+    ``(channel, times, values)`` tuples, one per channel, where channel is a
+    name or ``TimeSeriesChannel``.
+    """
+    if isinstance(channels, (string_types, TimeSeriesChannel)):
+        channels = [channels]
+
+    if isinstance(data, pd.Series):
+        if channels and len(channels) != 1:
+            raise ValueError('Specify one channel for a Series')
+        name = channels[0] if channels else data.name
+        if name is None:
+            raise ValueError('Name the Series, or specify its channel')
+        columns = [(name, data)]
+    elif isinstance(data, (pd.DataFrame, dict)):
+        keys = list(data.keys())
+        if channels and len(channels) != len(keys):
+            raise ValueError('Specify one channel per column ({} columns, {} channels)'.format(
+                len(keys), len(channels)))
+        columns = list(zip(channels or keys, (data[k] for k in keys)))
+    else:
+        values = np.asarray(data)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        if channels is None or len(channels) != values.shape[1]:
+            raise ValueError('Specify one channel per column of the array')
+        columns = [(ch, values[:, i]) for i, ch in enumerate(channels)]
+
+    result = []
+    for channel, values in columns:
+        index = values.index if isinstance(values, pd.Series) else None
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            continue
+        # times of all rows, so missing samples do not shift the others
+        times = _sample_times(index, len(values), rate, start)
+        present = ~np.isnan(values)
+        if not present.any():
+            continue
+        result.append((channel, times[present], values[present]))
+    return result
+
+
+def _infer_rate(times):
+    """
+    Sampling rate (Hz) of samples at ``times`` (nanoseconds).
+    """
+    if len(times) < 2:
+        return None
+    period = np.median(np.diff(np.sort(times)))
+    return 1.0e9 / period if period > 0 else None
+
+
+def _frame_batches(segments, max_bytes):
+    """
+    Serialize ``segments``, each prefixed with its length (4 bytes, big
+    endian), into request bodies of about ``max_bytes``.
+    """
+    batch, size = [], 0
+    for segment in segments:
+        payload = segment.SerializeToString()
+        if batch and size + len(payload) + 4 > max_bytes:
+            yield b''.join(batch)
+            batch, size = [], 0
+        batch.append(struct.pack('>I', len(payload)))
+        batch.append(payload)
+        size += len(payload) + 4
+    if batch:
+        yield b''.join(batch)
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # TimeSeries Request
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -470,6 +571,100 @@ class TimeSeriesAPI(APIBase):
         )
         return [tuple(x) for x in resp]
 
+    # ~~~~~~~~~~~~~~~~~~~
+    # Streaming
+    # ~~~~~~~~~~~~~~~~~~~
+
+    def stream_data(self, ts, data, channels=None, rate=None, start=None):
+        """
+        Append samples to a timeseries package, without going through files.
+
+        ``data`` is a DataFrame (one column per channel), a Series, a dict of
+        channel to Series/array, or an array of shape (samples, channels).
+        Columns are matched to channels by name, or to ``channels`` (names or
+        ``TimeSeriesChannel`` objects, one per column, in column order) if
+        specified. Channels
+        that do not exist are created, with ``rate`` or the rate inferred from
+        the sample times.
+
+        Sample times are taken from a DatetimeIndex, or else placed at
+        ``rate`` (Hz) from ``start``; without ``rate``, a numeric index other
+        than the default row numbers is read as microseconds since Epoch.
+        Missing (NaN) samples are skipped without shifting the others.
+
+        Samples are encoded in binary chunks of ``stream_chunk_size`` samples
+        (the format of the local cache), which are POSTed to
+        ``/timeseries/{id}/data`` in concurrent requests of up to
+        ``stream_batch_size`` MB. Requests that could not be sent (connection
+        failures) are retried; others are not, as their samples may have been
+        appended already.
+
+        Returns the channels written to, in column order.
+        """
+        if isinstance(ts, string_types):
+            # assumed to be package ID
+            ts = self.session.core.get(ts)
+        columns = _stream_columns(data, channels, rate, start)
+        if not columns:
+            return []
+
+        # find (or create) channels
+        by_name = dict((ch.name, ch) for ch in self.get_channels(ts))
+        names, missing = [], []
+        for channel, times, _ in columns:
+            if isinstance(channel, TimeSeriesChannel) and channel.exists:
+                by_name[channel.name] = channel
+                names.append(channel.name)
+                continue
+            name = channel.name if isinstance(channel, TimeSeriesChannel) else str(channel)
+            names.append(name)
+            if name in by_name:
+                continue
+            if not isinstance(channel, TimeSeriesChannel):
+                channel_rate = rate or _infer_rate(times)
+                if channel_rate is None:
+                    raise ValueError("Cannot infer the rate of channel '{}', specify `rate`".format(name))
+                channel = TimeSeriesChannel(name=name, rate=channel_rate)
+            channel.start = int(times.min()) // 1000
+            channel.end = int(times.max()) // 1000
+            by_name[name] = channel
+            missing.append(channel)
+
+        for created in self._map(lambda ch: self.create_channel(ts, ch), missing):
+            by_name[created.name] = created
+        targets = [by_name[name] for name in names]
+
+        # encode & send
+        chunk_size = self.session.settings.stream_chunk_size
+        segments = (
+            create_segment(ch, pd.Series(values[i:i+chunk_size], index=pd.to_datetime(times[i:i+chunk_size])))
+            for ch, (_, times, values) in zip(targets, columns)
+            for i in range(0, len(values), chunk_size)
+        )
+        batches = _frame_batches(segments, self.session.settings.stream_batch_size * 1024 * 1024)
+        uri = self._uri('/{id}/data', id=ts.id)
+
+        def send(body):
+            return self._with_retries(
+                self._post, uri, data=body,
+                headers={'Content-Type': 'application/octet-stream'})
+
+        # only encode as many batches as can be sent at once
+        workers = self.session.settings.max_request_workers
+        while True:
+            group = list(islice(batches, workers))
+            if not group:
+                break
+            self._map(send, group, max_workers=workers)
+
+        for ch, (_, times, _) in zip(targets, columns):
+            first, last = int(times.min()) // 1000, int(times.max()) // 1000
+            if not ch.start or first < ch.start:
+                ch.start = first
+            if last > ch.end:
+                ch.end = last
+        return targets
+
     # ~~~~~~~~~~~~~~~~~~~
     # Annotation Layers
     # ~~~~~~~~~~~~~~~~~~~
@@ -496,7 +691,7 @@ class TimeSeriesAPI(APIBase):
             resp = self._post(path, json=data)
             tmp_layer = TimeSeriesAnnotationLayer.from_dict(resp, api=self.session)
             if isinstance(layer,TimeSeriesAnnotationLayer):
-                layer.__dict__.update(tmp_layer.__dict__)
+                _copy_state(layer, tmp_layer)
             return tmp_layer
 
     def get_annotation_layer(self, ts, layer):
@@ -604,7 +799,7 @@ class TimeSeriesAPI(APIBase):
         tmp = TimeSeriesAnnotation.from_dict(resp, api=self.session)
 
         if isinstance(annotation,TimeSeriesAnnotation):
-            annotation.__dict__.update(tmp.__dict__)
+            _copy_state(annotation, tmp)
 
         return tmp
 
@@ -4,148 +4,121 @@ from __future__ import absolute_import, division, print_function
 from builtins import dict, object
 from future.utils import string_types
 
+import hashlib
 import io
+import json
 import os
-import sys
 import threading
 import time
-import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 import boto3
-from boto3.s3.transfer import S3Transfer
+import requests
+from requests.adapters import HTTPAdapter
+from boto3.s3.transfer import S3Transfer, TransferConfig
 from botocore.client import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 import blackfynn.log as log
-from blackfynn.api.agent import validate_agent_installation, agent_upload
+from blackfynn.api.agent import agent_upload, plan_upload, validate_agent_installation
 from blackfynn.api.base import APIBase
+from blackfynn.manifest import get_manifest
 from blackfynn.models import Collection, DataPackage, Dataset, TimeSeries
-
-# GLOBAL
-UPLOADS = {}
+from blackfynn.progress import CallbackSink, ProgressSink, ProgressTracker, TerminalSink
 
 logger = log.get_logger('blackfynn.api.transfers')
 
 
-def check_files(files):
+class UploadError(Exception):
+    """
+    Raised when some files of an upload fail. ``errors`` maps each failed
+    file (or import id, if completing the import failed) to its exception;
+    ``results`` holds the responses of the import groups that did complete.
+    """
+    def __init__(self, message, errors, results):
+        super(UploadError, self).__init__(message)
+        self.errors = errors
+        self.results = results
+
+
+# list a directory instead of stat-ing files one by one when this many of
+# its files are requested
+SCANDIR_THRESHOLD = 8
+
+
+def _dir_file_sizes(directory, files):
+    names = set(os.path.basename(f) for f in files)
+    sizes = {}
+    if len(names) >= SCANDIR_THRESHOLD and hasattr(os, 'scandir'):
+        for entry in os.scandir(directory or '.'):
+            if entry.name in names:
+                sizes[entry.name] = entry.stat().st_size
+
+    result = {}
     for f in files:
-        if not os.path.exists(f):
-            raise Exception("File {} not found.".format(f))
+        name = os.path.basename(f)
+        result[f] = sizes[name] if name in sizes else os.path.getsize(f)
+    return result
 
 
-class ProgressPercentage(object):
-    def __init__(self, filename, upload_session_id):
-        self._filename = filename
-        self._size = float(os.path.getsize(filename))
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-        self._done = (self.progress == 1)
-        self._errored = False
-
-        if upload_session_id is None:
-            upload_session_id = str(uuid.uuid4())
-        self._session_id = upload_session_id
-
-    def __call__(self, bytes_amount):
-        global UPLOADS
-        # To simplify we'll assume this is hooked up
-        # to a single filename.
-        if self._errored:
-            return
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            self._done = self._seen_so_far >= self._size
-            UPLOADS[self._session_id] = self
+def get_file_sizes(files, max_workers=10):
+    """
+    Sizes of ``files`` (``{file: size}``). Directories are listed
+    concurrently.
+    """
+    by_dir = OrderedDict()
+    for f in files:
+        by_dir.setdefault(os.path.dirname(f), []).append(f)
 
-    @property
-    def progress(self):
-        if self._size == 0:
-            return 1
-        return (self._seen_so_far / self._size)
-
-    def set_error(self):
-        self._errored = True
-
-
-class UploadManager(object):
-    def __init__(self):
-        self.id = str(uuid.uuid4())
-        # map of filename -> progress callback
-        self._uploads = {}
-        self._exit = False
-
-    def init_file(self, filename):
-        global UPLOADS
-        # filename -> session
-        uid = str(uuid.uuid4())
-        self._uploads[filename] = uid
-        # init to blank progress
-        UPLOADS[uid] = ProgressPercentage(filename, None)
-        return uid
+    sizes = {}
+    workers = min(max_workers, len(by_dir))
+    if workers <= 1:
+        for d, fs in by_dir.items():
+            sizes.update(_dir_file_sizes(d, fs))
+        return sizes
 
-    @property
-    def uploads(self):
-        return [(f, UPLOADS[uid]) for f, uid in self._uploads.items()]
+    with ThreadPoolExecutor(max_workers=workers) as e:
+        for result in e.map(lambda item: _dir_file_sizes(*item), by_dir.items()):
+            sizes.update(result)
+    return sizes
 
-    @property
-    def done(self):
-        return sum([fstat._done for _,fstat in self.uploads]) == len(self._uploads)
-
-    def _print_progress(self, width=16):
-        for f, fstat in self.uploads:
-
-            if fstat._done:
-                state = 'DONE'
-            elif fstat._errored:
-                state = 'ERRORED'
-                self._exit = True
-            elif fstat._seen_so_far>0:
-                state = 'UPLOADING'
-            else:
-                state = 'WAITING'
 
-            text = ' [ {bars}{dashes} ] {state:12s} {percent:05.1f}% {name}\n'.format(
-                        bars = '#'*int(fstat.progress*width),
-                        dashes = '-'*(width - int(fstat.progress*width)),
-                        percent = fstat.progress*100,
-                        name = os.path.basename(f),
-                        state = state)
+def check_files(files):
+    for f in files:
+        if not os.path.exists(f):
+            raise Exception("File {} not found.".format(f))
 
-            sys.stdout.write('{}\r'.format(text))
-            sys.stdout.flush()
 
-        # move cursor to relative beginning
-        sys.stdout.write("\033[F"*len(self.uploads))
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# S3
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def display_progress(self):
-        while True:
-            self._print_progress()
-            time.sleep(0.2)
-            if self.done or self._exit: break
-        self._print_progress()
-        # move cursor to bottom
-        sys.stdout.write('\n'*len(self.uploads))
+# S3 does not accept multipart chunks smaller than this (except the last one)
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+# ... nor more parts than this
+MAX_PARTS = 10000
 
+# number of clients (credential sets) to keep around
+MAX_S3_CLIENTS = 8
 
-def upload_file(
-        file,
-        s3_host,
-        s3_port,
-        s3_bucket,
-        s3_keybase,
-        region,
-        access_key_id,
-        secret_access_key,
-        session_token,
-        encryption_key_id,
-        upload_session_id=None,
-        ):
+_s3_clients = OrderedDict()
+_s3_clients_lock = threading.Lock()
 
-    # progress callback
-    progress = ProgressPercentage(file, upload_session_id)
-    UPLOADS[upload_session_id] = progress
 
-    try:
+def get_s3_client(s3_host, s3_port, region, access_key_id, secret_access_key,
+                  session_token, max_pool_connections=10):
+    """
+    Returns an S3 client for the given credentials. Clients are thread-safe
+    and reused for as long as the same credentials are in use.
+    """
+    key = (s3_host, s3_port, region, access_key_id, secret_access_key,
+           session_token, max_pool_connections)
+    with _s3_clients_lock:
+        s3 = _s3_clients.get(key)
+        if s3 is not None:
+            return s3
+
         # account for dev connections
         resource_args = {}
         config_args = dict(signature_version='s3v4')
@@ -160,32 +133,584 @@ def upload_file(
             aws_access_key_id = access_key_id,
             aws_secret_access_key = secret_access_key,
             aws_session_token = session_token,
-            config = Config(**config_args),
+            config = Config(max_pool_connections=max_pool_connections, **config_args),
             **resource_args
         )
 
+        _s3_clients[key] = s3
+        while len(_s3_clients) > MAX_S3_CLIENTS:
+            _s3_clients.popitem(last=False)
+        return s3
+
+
+class MultipartUpload(object):
+    """
+    Multipart upload of a single file to S3, that can be resumed after an
+    interruption.
+
+    The multipart upload id and its key are persisted in ``state_dir``, keyed
+    by the bucket and the file's path, size and modification time. Uploading
+    the same file again reuses them and skips the parts S3 already has; when
+    the upload was started under a different key, the completed object is
+    then copied to the requested key.
+
+    Superseded uploads (different chunk size, or gone from S3) and uploads
+    that cannot be completed are aborted and their state is removed.
+
+    ``chunk_size`` is raised (to whole MiB) where needed to stay within the
+    ``MAX_PARTS`` parts S3 allows.
+    """
+    def __init__(self, s3, file, bucket, key, extra_args=None,
+                 chunk_size=MIN_CHUNK_SIZE, concurrency=4, retries=2,
+                 state_dir=None, callback=None):
+        self.s3 = s3
+        self.file = file
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args or {}
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.callback = callback
+        self.size = os.path.getsize(file)
+        mib = 1024 * 1024
+        min_part = -(-self.size // MAX_PARTS)
+        self.chunk_size = max(chunk_size, MIN_CHUNK_SIZE, -(-min_part // mib) * mib)
+
+        self.state_file = None
+        if state_dir is not None:
+            stat = os.stat(file)
+            fingerprint = u'{}|{}|{}|{}'.format(
+                bucket, os.path.abspath(file), stat.st_size, stat.st_mtime)
+            name = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+            self.state_file = os.path.join(state_dir, '{}.json'.format(name))
+
+    @property
+    def num_parts(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def _load_state(self):
+        """
+        The saved ``(key, upload_id)`` of a resumable upload, or None.
+        """
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return None
+        try:
+            with io.open(self.state_file, 'r') as f:
+                state = json.load(f)
+            key, upload_id = state['key'], state['upload_id']
+        except (ValueError, KeyError):
+            self._clear_state()
+            return None
+        if state.get('chunk_size') != self.chunk_size:
+            self._abort(key, upload_id)
+            return None
+        return key, upload_id
+
+    def _save_state(self, key, upload_id):
+        if self.state_file is None:
+            return
+        state_dir = os.path.dirname(self.state_file)
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp = '{}.tmp'.format(self.state_file)
+        with io.open(tmp, 'w') as f:
+            f.write(json.dumps(dict(
+                bucket=self.bucket,
+                key=key,
+                file=os.path.abspath(self.file),
+                chunk_size=self.chunk_size,
+                upload_id=upload_id)))
+        os.rename(tmp, self.state_file)
+
+    def _clear_state(self):
+        if self.state_file is not None and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def _abort(self, key, upload_id):
+        """
+        Abort a multipart upload, so S3 drops its parts, and forget it.
+        """
+        try:
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            logger.debug("Cannot abort upload of {}: {}".format(self.file, e))
+        self._clear_state()
+
+    def _uploaded_parts(self, key, upload_id):
+        """
+        Parts (number -> ETag) that S3 already has, or None if the multipart
+        upload no longer exists.
+        """
+        parts = {}
+        try:
+            paginator = self.s3.get_paginator('list_parts')
+            pages = paginator.paginate(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            for page in pages:
+                for part in page.get('Parts', []):
+                    parts[part['PartNumber']] = part['ETag']
+        except ClientError as e:
+            logger.debug("Cannot resume upload of {}: {}".format(self.file, e))
+            return None
+        return parts
+
+    def _upload_part(self, key, upload_id, number):
+        offset = (number - 1) * self.chunk_size
+        with io.open(self.file, 'rb') as f:
+            f.seek(offset)
+            data = f.read(self.chunk_size)
+
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self.s3.upload_part(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=data)
+                break
+            except (BotoCoreError, ClientError) as e:
+                if attempt >= self.retries:
+                    raise
+                logger.debug("Part {} of {} failed ({}), retrying...".format(number, self.file, e))
+                time.sleep(0.5 * 2**attempt)
+
+        if self.callback is not None:
+            self.callback(len(data))
+        return resp['ETag']
+
+    def _move(self, key):
+        """
+        Copy the object uploaded to ``key`` (server side) to the requested
+        key. The uploaded object is only deleted once the copy is in place.
+        """
+        self.s3.copy(
+            CopySource=dict(Bucket=self.bucket, Key=key),
+            Bucket=self.bucket,
+            Key=self.key,
+            ExtraArgs=self.extra_args,
+            Config=TransferConfig(
+                multipart_threshold=self.chunk_size,
+                multipart_chunksize=self.chunk_size,
+                max_concurrency=self.concurrency))
+        copied = self.s3.head_object(Bucket=self.bucket, Key=self.key)
+        if copied['ContentLength'] != self.size:
+            raise Exception("Copy of {} to {} is incomplete ({} of {} bytes)".format(
+                key, self.key, copied['ContentLength'], self.size))
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+    def upload(self):
+        state = self._load_state()
+        parts = None
+        if state is not None:
+            key, upload_id = state
+            parts = self._uploaded_parts(key, upload_id)
+            if parts is None:
+                self._clear_state()
+        if parts is None:
+            key = self.key
+            resp = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=key, **self.extra_args)
+            upload_id = resp['UploadId']
+            parts = {}
+            self._save_state(key, upload_id)
+        else:
+            logger.debug("Resuming upload of {} ({} parts done)".format(self.file, len(parts)))
+            if self.callback is not None:
+                done = sum(min(self.chunk_size, self.size - (n - 1) * self.chunk_size) for n in parts)
+                self.callback(done)
+
+        # failed parts leave the state behind, so the next run resumes
+        missing = [n for n in range(1, self.num_parts + 1) if n not in parts]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, max(len(missing), 1))) as e:
+            etags = e.map(lambda n: self._upload_part(key, upload_id, n), missing)
+            parts.update(zip(missing, etags))
+
+        try:
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload=dict(Parts=[
+                    dict(PartNumber=n, ETag=parts[n]) for n in sorted(parts)
+                ]))
+        except ClientError:
+            self._abort(key, upload_id)
+            raise
+        self._clear_state()
+
+        if key != self.key:
+            self._move(key)
+
+
+def upload_file(
+        file,
+        s3_host,
+        s3_port,
+        s3_bucket,
+        s3_keybase,
+        region,
+        access_key_id,
+        secret_access_key,
+        session_token,
+        encryption_key_id,
+        progress=None,
+        chunk_size=8*1024*1024,
+        concurrency=4,
+        retries=2,
+        state_dir=None,
+        max_pool_connections=10,
+        ):
+    """
+    Upload a file to S3. Files larger than ``chunk_size`` are uploaded in
+    parts, ``concurrency`` at a time, and can be resumed if ``state_dir``
+    is given. ``progress`` is a ``ProgressCallback`` for the file.
+    """
+    try:
+        s3 = get_s3_client(
+            s3_host, s3_port, region, access_key_id, secret_access_key,
+            session_token, max_pool_connections)
+
         # s3 key
         s3_key = '{}/{}'.format(s3_keybase, os.path.basename(file))
 
-        # upload file to s3
-        s3.upload_file(
-            Filename=file,
-            Bucket=s3_bucket,
-            Key=s3_key,
-            Callback=progress,
-            ExtraArgs=dict(
-                ServerSideEncryption="aws:kms",
-                SSEKMSKeyId=encryption_key_id
-            ))
+        extra_args = dict(ServerSideEncryption="aws:kms")
+        if encryption_key_id is not None:
+            extra_args['SSEKMSKeyId'] = encryption_key_id
 
+        if os.path.getsize(file) > chunk_size:
+            MultipartUpload(
+                s3, file, s3_bucket, s3_key,
+                extra_args=extra_args,
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+                retries=retries,
+                state_dir=state_dir,
+                callback=progress).upload()
+        else:
+            # upload file to s3
+            s3.upload_file(
+                Filename=file,
+                Bucket=s3_bucket,
+                Key=s3_key,
+                Callback=progress,
+                Config=TransferConfig(multipart_threshold=chunk_size + 1),
+                ExtraArgs=extra_args)
+
+        if progress is not None:
+            progress.done()
         return s3_key
 
     except Exception as e:
         logger.debug(e)
-        progress.set_error()
+        if progress is not None:
+            progress.error(e)
         raise e
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Downloads
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class DownloadError(Exception):
+    """
+    Raised when a download fails. For bulk downloads, ``errors`` maps the id
+    of each failed file (or package, if listing its files failed) to its exception
+    and ``results`` holds the local paths of the files that did download.
+    """
+    def __init__(self, message, errors=None, results=None):
+        super(DownloadError, self).__init__(message)
+        self.errors = errors or {}
+        self.results = results or []
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket shared by concurrent transfers, limiting their combined
+    throughput to ``rate`` bytes per second.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._allowance = self.rate
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        with self._lock:
+            now = time.time()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= n
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RangedDownload(object):
+    """
+    Download of a single URL into ``path`` using concurrent HTTP Range
+    requests of ``chunk_size`` bytes.
+
+    Data is written into a preallocated ``<path>.part`` file; the chunks
+    that completed are recorded next to it (``<path>.part.json``), so an
+    interrupted download resumes where it left off, as long as the remote
+    object (its size and ETag) did not change. All ranges are requested with
+    ``If-Match`` on the ETag, and the final file size is verified before the
+    partial file is moved into place. (The ETag is not compared to an MD5 of
+    the contents: for multipart and KMS-encrypted S3 objects it is not one.)
+
+    Servers that ignore Range requests are downloaded in a single stream.
+    Requests time out after ``timeout`` seconds; timed out, dropped and 5xx
+    requests are retried up to ``retries`` times.
+
+    Concurrent downloads can share a ``BandwidthLimiter`` (``limiter``) and a
+    semaphore bounding the number of open range requests (``connections``).
+    """
+    def __init__(self, url, path, chunk_size=16*1024*1024, max_workers=4,
+                 retries=2, callback=None, session=None, limiter=None, connections=None,
+                 timeout=None):
+        self.url = url
+        self.path = path
+        self.part_file = '{}.part'.format(path)
+        self.state_file = '{}.part.json'.format(path)
+        self.chunk_size = max(chunk_size, 1)
+        self.max_workers = max(max_workers, 1)
+        self.retries = retries
+        self.timeout = timeout
+        self.callback = callback
+        self.limiter = limiter
+        self.connections = connections
+        self.size = None
+        self.etag = None
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        if not (os.path.exists(self.state_file) and os.path.exists(self.part_file)):
+            return set()
+        try:
+            with io.open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except ValueError:
+            return set()
+        if (state.get('size'), state.get('etag'), state.get('chunk_size')) != (self.size, self.etag, self.chunk_size):
+            # remote object changed, start over
+            return set()
+        return set(state['done'])
+
+    def _save_state(self, done):
+        tmp = '{}.tmp'.format(self.state_file)
+        with io.open(tmp, 'w') as f:
+            f.write(json.dumps(dict(
+                size=self.size,
+                etag=self.etag,
+                chunk_size=self.chunk_size,
+                done=sorted(done))))
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(tmp, self.state_file)
+
+    def _retry(self, attempt, e, what):
+        """
+        Whether to retry after ``e``: timeouts, dropped connections and
+        server errors are retried, after a backoff.
+        """
+        if isinstance(e, requests.exceptions.HTTPError):
+            retriable = e.response is not None and e.response.status_code >= 500
+        else:
+            retriable = isinstance(e, (requests.exceptions.ConnectionError,
+                                       requests.exceptions.Timeout,
+                                       requests.exceptions.ChunkedEncodingError))
+        if not retriable or attempt >= self.retries:
+            return False
+        logger.debug("{} failed ({}), retrying...".format(what, e))
+        time.sleep(0.5 * 2**attempt)
+        return True
+
+    def _probe(self):
+        """
+        Request the first byte, to learn the size, ETag and range support.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.get(
+                    self.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=self.timeout)
+                if r.status_code != requests.codes.requested_range_not_satisfiable:
+                    r.raise_for_status()
+                return r
+            except requests.exceptions.RequestException as e:
+                if not self._retry(attempt, e, "Request for {}".format(self.url)):
+                    raise
+
+    def _stream(self, response):
+        """
+        Server does not support ranges: write the whole response.
+        """
+        with io.open(self.part_file, 'wb') as f:
+            for data in response.iter_content(chunk_size=1024*1024):
+                if self.limiter is not None:
+                    self.limiter.consume(len(data))
+                f.write(data)
+                if self.callback is not None:
+                    self.callback(len(data))
+
+    def _fetch_chunk(self, fd, index):
+        if self.connections is None:
+            return self._fetch_range(fd, index)
+        with self.connections:
+            return self._fetch_range(fd, index)
+
+    def _fetch_range(self, fd, index):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if self.etag is not None:
+            headers['If-Match'] = self.etag
+
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+                if r.status_code == requests.codes.precondition_failed:
+                    raise DownloadError("{} changed during download".format(self.url))
+                r.raise_for_status()
+                if r.status_code != requests.codes.partial_content:
+                    raise DownloadError("Range request for {} was not honored".format(self.url))
+
+                offset = start
+                for data in r.iter_content(chunk_size=1024*1024):
+                    if self.limiter is not None:
+                        self.limiter.consume(len(data))
+                    _pwrite(fd, data, offset)
+                    offset += len(data)
+                if offset != end + 1:
+                    raise requests.exceptions.ConnectionError(
+                        "Incomplete range {}-{}".format(start, end))
+                break
+            except requests.exceptions.RequestException as e:
+                if not self._retry(attempt, e, "Range {}-{}".format(start, end)):
+                    raise
+
+        if self.callback is not None:
+            self.callback(end - start + 1)
+        return index
+
+    def download(self):
+        r = self._probe()
+        self.etag = r.headers.get('ETag')
+
+        if r.status_code == requests.codes.requested_range_not_satisfiable:
+            # no byte to return: only an empty object (``Content-Range: */0``)
+            r.close()
+            if r.headers.get('Content-Range', '').split('/')[-1] != '0':
+                r.raise_for_status()
+            self.size = 0
+            io.open(self.part_file, 'wb').close()
+        elif r.status_code != requests.codes.partial_content:
+            self._stream(r)
+            self.size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+        else:
+            r.close()
+            self.size = int(r.headers['Content-Range'].split('/')[-1])
+            self._download_ranges()
+
+        # verify
+        actual = os.path.getsize(self.part_file)
+        if self.size is not None and actual != self.size:
+            raise DownloadError("Downloaded {} bytes of {}, expected {}".format(
+                actual, self.url, self.size))
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.part_file, self.path)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        return self.path
+
+    def _download_ranges(self):
+        num_chunks = max(1, -(-self.size // self.chunk_size))
+        done = self._load_state()
+        if not done:
+            # (re)allocate the partial file
+            with io.open(self.part_file, 'wb') as f:
+                f.truncate(self.size)
+        elif self.callback is not None:
+            self.callback(sum(
+                min(self.chunk_size, self.size - i * self.chunk_size) for i in done))
+
+        missing = [i for i in range(num_chunks) if i not in done]
+        if not missing:
+            return
+
+        self._save_state(done)
+        fd = os.open(self.part_file, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as e:
+                futures = [e.submit(self._fetch_chunk, fd, i) for i in missing]
+                error = None
+                for future in as_completed(futures):
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    with self._lock:
+                        done.add(future.result())
+                        self._save_state(done)
+                if error is not None:
+                    raise error
+        finally:
+            os.close(fd)
+
+
+if hasattr(os, 'pwrite'):
+    def _pwrite(fd, data, offset):
+        while data:
+            n = os.pwrite(fd, data, offset)
+            data = data[n:]
+            offset += n
+else:
+    _pwrite_lock = threading.Lock()
+
+    def _pwrite(fd, data, offset):
+        # no positional writes (e.g. Windows), serialize seek + write
+        with _pwrite_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                n = os.write(fd, data)
+                data = data[n:]
+
+
+def download_file(url, path, chunk_size=16*1024*1024, max_workers=4, retries=2,
+                  callback=None, limiter=None, connections=None, timeout=None):
+    """
+    Download ``url`` to ``path`` using concurrent range requests, resuming
+    a previously interrupted download of the same object if possible.
+    """
+    return RangedDownload(url, path,
+        chunk_size=chunk_size,
+        max_workers=max_workers,
+        retries=retries,
+        callback=callback,
+        limiter=limiter,
+        connections=connections,
+        timeout=timeout).download()
+
+
+def _progress_sinks(progress):
+    """
+    ``progress`` argument (a sink, a callable or a list of those) -> sinks
+    """
+    if progress is None:
+        return []
+    if isinstance(progress, ProgressSink) or callable(progress):
+        progress = [progress]
+    return [p if isinstance(p, ProgressSink) else CallbackSink(p) for p in progress]
+
+
 class IOAPI(APIBase):
     """
     Input/Output interface.
@@ -193,7 +718,8 @@ class IOAPI(APIBase):
     name = 'io'
 
     def upload_files(self, destination, files, dataset=None, append=False,
-                     display_progress=False, recursive=False, use_agent=True):
+                     display_progress=False, recursive=False, use_agent=True, progress=None,
+                     include=None, exclude=None, manifest=None):
         if isinstance(destination, Dataset):
             # uploading into dataset
             destination_id = None
@@ -259,7 +785,10 @@ class IOAPI(APIBase):
                 append=append,
                 recursive=recursive,
                 display_progress=display_progress,
-                settings=self.session.settings)
+                settings=self.session.settings,
+                include=include,
+                exclude=exclude,
+                manifest=manifest)
 
         elif any(os.path.isdir(f) for f in files):
             raise Exception(
@@ -271,10 +800,22 @@ class IOAPI(APIBase):
                 "Blackfynn Agent required to upload recursively\n"
                 "Visit https://developer.blackfynn.io/agent for installation directions and pass `use_agent=True` to `upload`.`")
 
+        manifest = get_manifest(manifest, self.session.settings, scope=destination_id or dataset_id)
+        try:
+            if include or exclude or manifest is not None:
+                files = [path for path, _ in plan_upload(
+                    files, include=include, exclude=exclude, manifest=manifest)]
+                if not files:
+                    return []
 
-        # get preview
-        import_id_map = self.get_preview(files, append)
+            return self._upload_to_s3(
+                files, dataset_id, destination_id, append, display_progress, progress, manifest)
+        finally:
+            if manifest is not None:
+                manifest.close()
 
+    def _upload_to_s3(self, files, dataset_id, destination_id, append, display_progress,
+                      progress, manifest):
         # get upload credentials
         resp = self.session.security.get_upload_credentials(dataset_id)
         creds = resp['tempCredentials']
@@ -285,56 +826,143 @@ class IOAPI(APIBase):
         session_token = creds['sessionToken']
         encryption_key_id = resp['encryptionKeyId']
 
-        # upload session manager
-        upload_session = UploadManager()
+        # progress of all files
+        sinks = _progress_sinks(progress)
+        if display_progress:
+            sinks.append(TerminalSink())
+        tracker = ProgressTracker(sinks)
 
         # parallel upload to s3
-        file_results = {}
-        group_results = []
-        with ThreadPoolExecutor(max_workers=min(len(files),self.session.settings.max_upload_workers)) as e:
-            futures = {
-                e.submit(
-                    fn = upload_file,
-                    file = file,
-                    s3_host=self.session.settings.s3_host,
-                    s3_port=self.session.settings.s3_port,
-                    s3_bucket = s3_bucket,
-                    s3_keybase = '{}/{}'.format(resp['s3Key'], import_id_map[file]),
-                    region = region,
-                    access_key_id = access_key_id,
-                    secret_access_key = secret_access_key,
-                    session_token = session_token,
-                    encryption_key_id = encryption_key_id,
-                    upload_session_id = upload_session.init_file(file),
-                ): file
-                for file in files
-            }
-            # thread for displaying progress
-            if display_progress:
-                e.submit(upload_session.display_progress())
+        settings = self.session.settings
+        workers = min(len(files), settings.max_upload_workers)
+        import_id_map = {}
+        group_files = {}
+        # number of files still uploading, per import group
+        remaining = Counter()
+        failed_groups = set()
+        errors = OrderedDict()
+        completions = OrderedDict()
+        with tracker, \
+                ThreadPoolExecutor(max_workers=workers) as e, \
+                ThreadPoolExecutor(max_workers=settings.max_request_workers) as c:
+            # start uploading each batch of files as soon as it is previewed
+            futures = {}
+            for batch_map in self.iter_preview(files, append):
+                import_id_map.update(batch_map)
+                remaining.update(batch_map.values())
+                for file, import_id in batch_map.items():
+                    group_files.setdefault(import_id, []).append(file)
+                    if manifest is not None:
+                        manifest.prepare(file)
+                    future = e.submit(
+                        upload_file,
+                        file = file,
+                        s3_host=self.session.settings.s3_host,
+                        s3_port=self.session.settings.s3_port,
+                        s3_bucket = s3_bucket,
+                        s3_keybase = '{}/{}'.format(resp['s3Key'], import_id),
+                        region = region,
+                        access_key_id = access_key_id,
+                        secret_access_key = secret_access_key,
+                        session_token = session_token,
+                        encryption_key_id = encryption_key_id,
+                        progress = tracker.add(file, os.path.getsize(file)),
+                        chunk_size = settings.s3_chunk_size * 1024 * 1024,
+                        concurrency = settings.s3_max_concurrency,
+                        retries = settings.max_request_timeout_retries,
+                        state_dir = os.path.join(settings.blackfynn_dir, 'uploads'),
+                        max_pool_connections = max(10, workers * settings.s3_max_concurrency),
+                    )
+                    futures[future] = file
             # retrieve results
             for future in as_completed(futures):
                 fname = futures[future]
-                file_results[fname] = future.result()
-                if future.exception() is not None:
-                    raise future.exception()
                 import_id = import_id_map[fname]
-                # check to see if rest of the import group has uploaded
-                if all([ name in file_results for name, id in import_id_map.items() if id == import_id ]):
-                    # trigger ETL import
-                    group_results.append(self.set_upload_complete(import_id, dataset_id, destination_id, append))
+                if future.exception() is not None:
+                    logger.error("Upload of {} failed: {}".format(fname, future.exception()))
+                    errors[fname] = future.exception()
+                    failed_groups.add(import_id)
+
+                remaining[import_id] -= 1
+                if remaining[import_id] == 0 and import_id not in failed_groups:
+                    # the whole import group has uploaded, trigger ETL import
+                    completions[import_id] = c.submit(
+                        self.set_upload_complete, import_id, dataset_id, destination_id, append)
+
+            group_results = []
+            for import_id, future in completions.items():
+                if future.exception() is not None:
+                    errors[import_id] = future.exception()
+                else:
+                    group_results.append(future.result())
+                    if manifest is not None:
+                        for file in group_files[import_id]:
+                            manifest.add(file)
+
+        if errors:
+            raise UploadError(
+                "{} errors uploading {} files".format(len(errors), len(files)),
+                errors=errors,
+                results=group_results)
 
         return group_results
 
+    def _preview_batches(self, files):
+        """
+        Split files into batches of at most ``upload_preview_batch_size``.
+        Files that share a name (e.g. ``data.nev`` and ``data.ns2``) can be
+        imported as one package, so they are kept in the same batch.
+        """
+        batch_size = self.session.settings.upload_preview_batch_size
+        by_stem = OrderedDict()
+        for f in files:
+            stem = os.path.splitext(os.path.basename(f))[0]
+            by_stem.setdefault(stem, []).append(f)
+
+        batch = []
+        for group in by_stem.values():
+            if batch and len(batch) + len(group) > batch_size:
+                yield batch
+                batch = []
+            batch.extend(group)
+        if batch:
+            yield batch
+
+    def iter_preview(self, files, append, prefetch=2):
+        """
+        Preview files in batches, yielding a ``{file: import_id}`` map per
+        batch. Up to ``prefetch`` batches are previewed ahead of the one being
+        consumed.
+        """
+        batches = self._preview_batches(files)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as e:
+            for batch in batches:
+                pending.append(e.submit(self._preview, batch, append))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     def get_preview(self, files, append):
+        """
+        Returns a ``{file: import_id}`` map for all files.
+        """
+        import_id_map = dict()
+        for batch_map in self.iter_preview(files, append):
+            import_id_map.update(batch_map)
+        return import_id_map
+
+    def _preview(self, files, append):
         params = dict(
             append = append,
         )
 
+        sizes = get_file_sizes(files, max_workers=self.session.settings.max_request_workers)
         payload = { "files": [
             {
                 "fileName": os.path.basename(f),
-                "size": os.path.getsize(f),
+                "size": sizes[f],
                 "uploadId": i,
             } for i, f in enumerate(files)
         ]}
@@ -370,3 +998,181 @@ class IOAPI(APIBase):
             params=params,
             json = targets
             )
+
+    # ~~~~~~~~~~~~~~~~~~~
+    # Downloads
+    # ~~~~~~~~~~~~~~~~~~~
+
+    def download_file(self, url, path, callback=None):
+        """
+        Download ``url`` to ``path`` in concurrent ranges, resuming a
+        previously interrupted download if possible.
+        """
+        settings = self.session.settings
+        return download_file(url, path,
+            chunk_size = settings.download_chunk_size * 1024 * 1024,
+            max_workers = settings.max_download_workers,
+            retries = settings.max_request_timeout_retries,
+            timeout = settings.max_request_time,
+            callback = callback)
+
+    def download(self, collection, destination, parallel=None, max_bandwidth=None,
+                 skip_existing=True, callback=None):
+        """
+        Download the source files of all packages inside ``collection`` into
+        ``destination``, mirroring its folder structure. Each package gets a
+        folder named after it; siblings with the same name (collections or
+        packages) are numbered in order of their ids, so files of different
+        packages never share a local path and repeated downloads use the same
+        paths.
+
+        Packages are listed concurrently (see ``DataAPI.walk``) and their files
+        are downloaded as soon as they are listed, up to ``parallel`` files at
+        a time. ``parallel`` also bounds the number of range requests open
+        across all files, and ``max_bandwidth`` (bytes per second) their
+        combined throughput. Files that exist locally with the expected size
+        are skipped. Presigned URLs are requested for up to
+        ``download_url_batch_size`` files at a time, and only once the
+        downloads already started are about to finish, so that they do not
+        expire while queued.
+
+        ``callback(file, path, downloaded)`` is called for every file once it
+        is done. Returns the local paths of all files.
+        """
+        settings = self.session.settings
+        if parallel is None:
+            parallel = settings.max_parallel_downloads
+        parallel = max(parallel, 1)
+        batch_size = max(settings.download_url_batch_size, 1)
+        list_workers = settings.max_request_workers
+        limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+        connections = threading.BoundedSemaphore(parallel)
+
+        def list_files(folder, pkg):
+            return folder, pkg, self.session.packages.get_sources(pkg)
+
+        # collections by id, and the local folder of each
+        parents = {None: collection, collection.id: collection}
+        folders = {None: (), collection.id: ()}
+        # local name of every item, by id
+        names = {}
+
+        def local_folder(item):
+            if item.id not in names:
+                # name all children of the parent at once
+                same_name = OrderedDict()
+                for child in parents[item.parent].items:
+                    same_name.setdefault(child.name.replace('/', '_'), []).append(child)
+                for name, children in same_name.items():
+                    for i, child in enumerate(sorted(children, key=lambda c: c.id)):
+                        names[child.id] = name if i == 0 else u'{} ({})'.format(name, i + 1)
+            return folders[item.parent] + (names[item.id],)
+
+        def fetch(local, url):
+            local_dir = os.path.dirname(local)
+            if not os.path.isdir(local_dir):
+                try:
+                    os.makedirs(local_dir)
+                except OSError:
+                    # created concurrently
+                    if not os.path.isdir(local_dir):
+                        raise
+            download_file(url, local,
+                chunk_size = settings.download_chunk_size * 1024 * 1024,
+                max_workers = settings.max_download_workers,
+                retries = settings.max_request_timeout_retries,
+                timeout = settings.max_request_time,
+                limiter = limiter,
+                connections = connections)
+            return local
+
+        errors = OrderedDict()
+        results = []
+        downloads = OrderedDict()
+        running = set()
+        # (local path, file) of listed files waiting for a URL
+        ready = deque()
+
+        def done(f, local, downloaded):
+            results.append(local)
+            if callback is not None:
+                callback(f, local, downloaded)
+
+        with ThreadPoolExecutor(max_workers=list_workers) as lister, \
+                ThreadPoolExecutor(max_workers=parallel) as downloader:
+
+            def schedule(future):
+                try:
+                    folder, pkg, files = future.result()
+                except Exception as e:
+                    errors[listing[future].id] = e
+                    return
+                for f in files:
+                    if f.type == 'DirectoryViewerData':
+                        logger.warn("Skipping {}: downloading S3 directories is not supported".format(f))
+                        continue
+                    local = os.path.join(destination, *(folder + (os.path.basename(f.s3_key),)))
+                    if skip_existing and os.path.isfile(local) and os.path.getsize(local) == f.size:
+                        done(f, local, False)
+                    else:
+                        ready.append((local, f))
+
+            def start(final=False):
+                # request URLs for a full batch (or whatever is left at the
+                # end) whenever fewer than ``parallel`` downloads are running
+                while ready and (final or len(ready) >= batch_size or not running):
+                    running.difference_update([d for d in running if d.done()])
+                    if len(running) >= parallel:
+                        if not final:
+                            return
+                        wait(running, return_when=FIRST_COMPLETED)
+                        continue
+                    batch = [ready.popleft() for _ in range(min(batch_size, len(ready)))]
+                    try:
+                        urls = self.session.packages.get_presigned_urls_for_files(
+                            [f for _, f in batch])
+                    except Exception as e:
+                        for _, f in batch:
+                            errors[f.id] = e
+                        continue
+                    for local, f in batch:
+                        if f.id not in urls:
+                            errors[f.id] = Exception("Unable to get URL for file ID = {}".format(f.id))
+                            continue
+                        future = downloader.submit(fetch, local, urls[f.id])
+                        downloads[future] = f
+                        running.add(future)
+
+            listing = {}
+            pending = deque()
+            for _, item in self.session.data.walk(collection):
+                if isinstance(item, Collection):
+                    parents[item.id] = item
+                    folders[item.id] = local_folder(item)
+                    continue
+                future = lister.submit(list_files, local_folder(item), item)
+                listing[future] = item
+                pending.append(future)
+                while pending and (pending[0].done() or len(pending) > 2 * list_workers):
+                    schedule(pending.popleft())
+                start()
+            while pending:
+                schedule(pending.popleft())
+                start()
+            start(final=True)
+
+            for future in as_completed(downloads):
+                f = downloads[future]
+                try:
+                    local = future.result()
+                except Exception as e:
+                    logger.debug("Download of {} failed: {}".format(f, e))
+                    errors[f.id] = e
+                    continue
+                done(f, local, True)
+
+        if errors:
+            raise DownloadError(
+                "{} of {} downloads failed".format(len(errors), len(errors) + len(results)),
+                errors, results)
+        return results
@@ -179,8 +179,8 @@ class ClientSession(object):
         elif method == 'delete':
             func = self.session.delete
 
-        # serialize data
-        if 'data' in kwargs:
+        # serialize data (binary payloads are sent as-is)
+        if 'data' in kwargs and not isinstance(kwargs['data'], (bytes, bytearray)):
             kwargs['data'] = json.dumps(kwargs['data'])
 
         # we might specify a different host
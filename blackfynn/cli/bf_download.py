@@ -0,0 +1,81 @@
+'''
+Description
+  Download (or sync) all source files of a dataset, or of a collection
+  inside it, into a local directory that mirrors its folder structure,
+  with one folder per package.
+  Files that already exist locally with the same size are skipped, so
+  running the command again only downloads new or changed files.
+
+Usage:
+  bf_download version
+  bf_download help
+  bf_download <dataset> [<destination>] [options]
+
+Options:
+  --collection=<id>       Only download the contents of this collection
+  --parallel=<n>          Number of concurrent downloads
+  --max-bandwidth=<MB/s>  Limit the combined download rate
+  --overwrite             Download all files, even if they exist locally
+  --profile=<name>        Use specified profile (instead of default)
+  -q --quiet              Only report errors
+  -h --help               Show help
+
+Example:
+  bf_download "My Dataset" /scratch/my_dataset --parallel=8
+'''
+
+from __future__ import absolute_import, print_function
+import os
+import sys
+
+from docopt import docopt
+
+import blackfynn
+from blackfynn import Blackfynn
+from blackfynn.api.transfers import DownloadError
+
+
+def main():
+    args = docopt(__doc__, version=blackfynn.__version__)
+
+    if args['help']:
+        print(__doc__.strip('\n'))
+        return
+    elif args['version']:
+        print(blackfynn.__version__)
+        return
+
+    bf = Blackfynn(args['--profile'])
+    target = bf.get_dataset(args['<dataset>'])
+    if args['--collection']:
+        target = bf.get(args['--collection'])
+
+    destination = args['<destination>'] or os.path.join(os.getcwd(), target.name)
+    parallel = int(args['--parallel']) if args['--parallel'] else None
+    max_bandwidth = None
+    if args['--max-bandwidth']:
+        max_bandwidth = float(args['--max-bandwidth']) * 1024 * 1024
+
+    counts = {True: 0, False: 0}
+
+    def report(f, path, downloaded):
+        counts[downloaded] += 1
+        if downloaded and not args['--quiet']:
+            print(os.path.relpath(path, destination))
+
+    try:
+        target.download(
+            destination,
+            parallel=parallel,
+            max_bandwidth=max_bandwidth,
+            skip_existing=not args['--overwrite'],
+            callback=report)
+    except DownloadError as e:
+        for item, error in e.errors.items():
+            print("Failed: {} ({})".format(item, error), file=sys.stderr)
+        print("{} downloaded, {} up to date, {} failed".format(
+            counts[True], counts[False], len(e.errors)), file=sys.stderr)
+        sys.exit(1)
+
+    if not args['--quiet']:
+        print("{} downloaded, {} up to date".format(counts[True], counts[False]))
@@ -217,6 +217,11 @@ class Blackfynn(object):
               - "mYdata SET"
 
         """
+        # names of known datasets are resolved without a request
+        result = self._api.datasets.get_by_name_or_id(name_or_id, cached=True)
+        if result is not None and result.id != name_or_id:
+            return result
+
         try:
             return self._api.datasets.get(name_or_id)
         except:
@@ -286,13 +291,17 @@ class Blackfynn(object):
         """
         r = self._api.data.move(destination, *things)
 
-    def search(self, query, max_results=10):
+    def search(self, query, max_results=10, hydrate=True, raw=False):
         """
         Find an object on the platform.
 
         Args:
             query (str): query string to perform search.
             max_results (int, optional): the number of results to return
+            hydrate (bool, optional): if ``True`` (default), the full object of
+                each result is fetched (concurrently). If ``False``, results
+                are built from the search response without further requests.
+            raw (bool, optional): if ``True``, return the raw search results
 
         Example::
 
@@ -301,7 +310,7 @@ class Blackfynn(object):
                 print("found:", result)
 
         """
-        return self._api.search.query(query, max_results=max_results)
+        return self._api.search.query(query, max_results=max_results, hydrate=hydrate, raw=raw)
 
     def _check_context(self):
         if self.context is None:
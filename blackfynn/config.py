@@ -61,10 +61,32 @@ The following settings (and their default values) are available under ``[<profil
     # I/O
     'max_request_time'            : 120, # two minutes
     'max_request_timeout_retries' : 2,
+    'max_request_workers'         : 10,
     'max_upload_workers'          : 10,
+    's3_chunk_size'               : 8, # MB, files larger than this are uploaded in parts
+    's3_max_concurrency'          : 4, # parts uploaded concurrently, per file
+    'upload_preview_batch_size'   : 1000,
+    'agent_queue_batch_size'      : 1000, # files per agent queue_upload message
+    'max_hash_workers'            : 4, # files hashed concurrently for upload manifests
+    'max_download_workers'        : 4, # ranges downloaded concurrently, per file
+    'download_chunk_size'         : 16, # MB, size of each downloaded range
+    'max_parallel_downloads'      : 4, # files downloaded concurrently by Dataset.download()
+    'download_url_batch_size'     : 100, # presigned URLs requested per call by Dataset.download()
+
+    # Local objects
+    'max_local_objects'           : 1000, # recently fetched objects kept alive
+
+    # Models
+    'model_cache_ttl'             : 300, # five minutes, 0 to disable
+    'max_records_per_chunk'       : 1000,
 
     # Timeseries
     'max_points_per_chunk'        : 10000,
+    'stream_chunk_size'           : 50000, # samples per chunk when streaming data
+    'stream_batch_size'           : 4, # MB, size of each streaming request
+
+    # Tabular
+    'tabular_prefetch_chunks'     : 4, # chunks of rows requested concurrently
 
     # Directories
     'blackfynn_dir'               : $HOME/.blackfynn
@@ -139,6 +161,7 @@ Additional environment variables and their corresponding config options:
     BLACKFYNN_CACHE_MAX_SIZE                      # `cache_max_size`
     BLACKFYNN_CACHE_INSPECT_EVERY                 # `cache_inspect_interval`
     BLACKFYNN_TS_PAGE_SIZE                        # `ts_page_size`
+    BLACKFYNN_MODEL_CACHE_TTL                     # `model_cache_ttl`
 
 """
 
@@ -165,12 +188,34 @@ DEFAULTS = {
     # all requests
     'max_request_time'            : 120, # two minutes
     'max_request_timeout_retries' : 2,
+    'max_request_workers'         : 10,
 
     #io
     'max_upload_workers'          : 10,
+    's3_chunk_size'               : 8,
+    's3_max_concurrency'          : 4,
+    'upload_preview_batch_size'   : 1000,
+    'agent_queue_batch_size'      : 1000,
+    'max_hash_workers'            : 4,
+    'max_download_workers'        : 4,
+    'download_chunk_size'         : 16,
+    'max_parallel_downloads'      : 4,
+    'download_url_batch_size'     : 100,
+
+    # local object registry
+    'max_local_objects'           : 1000,
+
+    # models
+    'model_cache_ttl'             : 300,
+    'max_records_per_chunk'       : 1000,
 
     # timeseries
     'max_points_per_chunk'        : 10000,
+    'stream_chunk_size'           : 50000,
+    'stream_batch_size'           : 4,
+
+    # tabular
+    'tabular_prefetch_chunks'     : 4,
 
     # s3 (amazon/local)
     's3_host'                     : '',
@@ -199,6 +244,7 @@ ENVIRONMENT_VARIABLES = {
     'cache_max_size'         : ('BLACKFYNN_CACHE_MAX_SIZE', int),
     'cache_inspect_interval' : ('BLACKFYNN_CACHE_INSPECT_EVERY', int),
     'ts_page_size'           : ('BLACKFYNN_TS_PAGE_SIZE', int),
+    'model_cache_ttl'        : ('BLACKFYNN_MODEL_CACHE_TTL', int),
     'use_cache'              : ('BLACKFYNN_USE_CACHE', lambda x: bool(int(x))),
     'default_profile'        : ('BLACKFYNN_PROFILE', str),
 
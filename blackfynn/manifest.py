@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Local records of uploaded files, used to skip files that were already
+uploaded when the same directory is uploaded again.
+
+- ``UploadManifest``: a JSON-lines file, keyed by path, size and mtime
+- ``HashManifest``: a SQLite database (in ``blackfynn_dir``) that also keeps
+  a content hash, so files that were touched but not modified are skipped too
+"""
+from __future__ import absolute_import, division, print_function
+from builtins import object
+from future.utils import PY2
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import blackfynn.log as log
+
+logger = log.get_logger('blackfynn.manifest')
+
+
+class UploadManifest(object):
+    """
+    Append-only manifest of uploaded files (one JSON object per line),
+    keyed by absolute path, size and modification time. Files are added as
+    soon as their upload completes, so an interrupted upload can be resumed
+    by uploading the same files again with the same manifest.
+
+    ``prepare(path)`` is called when the upload of a file starts: the size
+    and mtime recorded are the ones the file had then.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._prepared = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry['path']] = (entry['size'], entry['mtime'])
+                except (ValueError, KeyError):
+                    # partially written line
+                    logger.debug("Ignoring invalid manifest entry: {}".format(line))
+
+    def contains(self, path, stat=None):
+        """
+        Was ``path`` uploaded, and is it unchanged since?
+        """
+        if stat is None:
+            stat = os.stat(path)
+        return self._entries.get(path) == (stat.st_size, stat.st_mtime)
+
+    def filter(self, files):
+        """
+        Generator of the ``(path, stat)`` tuples of ``files`` that still need
+        to be uploaded.
+        """
+        for path, stat in files:
+            if not self.contains(path, stat):
+                yield path, stat
+
+    def prepare(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            self._prepared[path] = stat
+
+    def add(self, path, stat=None):
+        with self._lock:
+            stat = self._prepared.pop(path, stat)
+        if stat is None:
+            stat = os.stat(path)
+        line = json.dumps(dict(path=path, size=stat.st_size, mtime=stat.st_mtime))
+        with self._lock:
+            if self._file is None:
+                self._file = io.open(self.path, 'a', encoding='utf-8')
+            self._file.write(u'{}\n'.format(line))
+            self._file.flush()
+            self._entries[path] = (stat.st_size, stat.st_mtime)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    SHA-256 of the contents of ``path``, read through a memory map.
+    """
+    h = hashlib.sha256()
+    with io.open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > 0 and PY2:
+            # no memoryview of mmap objects on Python 2
+            for data in iter(lambda: f.read(chunk_size), b''):
+                h.update(data)
+        elif size > 0:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(m)
+            try:
+                for offset in range(0, size, chunk_size):
+                    h.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+                m.close()
+    return 'sha256:{}'.format(h.hexdigest())
+
+
+class HashManifest(object):
+    """
+    Manifest of uploaded files in a SQLite database, keyed by upload
+    destination (``scope``) and path, with the size, mtime and content hash
+    of every file.
+
+    A file is skipped if its size and mtime are unchanged, or if only its
+    mtime changed but its contents hash to the same value. Hashes are
+    computed by ``max_workers`` threads, both when checking files and for the
+    files being uploaded: ``prepare(path)`` starts hashing a file (and takes
+    its size and mtime) when its upload starts, and ``add(path)`` records
+    that hash once the upload is done.
+    """
+    def __init__(self, path, scope='', max_workers=4, batch_size=500):
+        self.path = path
+        self.scope = scope or ''
+        self.max_workers = max(max_workers, 1)
+        self.batch_size = batch_size
+        self._conn = None
+        self._lock = threading.RLock()
+        self._executor = None
+        self._prepared = {}
+        self._pending = []
+        self.init_tables()
+
+    @property
+    def con(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # used by the upload planner and the thread following the upload
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        return self._conn
+
+    def init_tables(self):
+        with self._lock, self.con as con:
+            q = "SELECT name FROM sqlite_master WHERE type='table' AND name='uploads'"
+            if con.execute(q).fetchone() is None:
+                logger.info('Manifest - Creating \'uploads\' table')
+                con.execute("""
+                    CREATE TABLE uploads (
+                        scope    CHAR(100) NOT NULL,
+                        path     TEXT NOT NULL,
+                        size     INTEGER NOT NULL,
+                        mtime    REAL NOT NULL,
+                        hash     CHAR(80) NOT NULL,
+                        uploaded DATETIME NOT NULL,
+                        PRIMARY KEY (scope, path))
+                """)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _rows(self, paths):
+        with self._lock, self.con as con:
+            q = """
+                SELECT path, size, mtime, hash
+                FROM   uploads
+                WHERE  scope = ? AND path IN ({})
+            """.format(','.join('?' * len(paths)))
+            return dict((r[0], r[1:]) for r in con.execute(q, [self.scope] + list(paths)))
+
+    def _put(self, rows):
+        now = datetime.now().isoformat()
+        with self._lock, self.con as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.scope, path, size, mtime, h, now) for path, size, mtime, h in rows])
+
+    def contains(self, path, stat=None):
+        """
+        Was ``path`` uploaded, and is it unchanged since?
+        """
+        if stat is None:
+            stat = os.stat(path)
+        return not list(self.filter([(path, stat)]))
+
+    def filter(self, files):
+        """
+        Generator of the ``(path, stat)`` tuples of ``files`` that still need
+        to be uploaded. Files are looked up in batches, and the files whose
+        mtime changed are hashed concurrently.
+        """
+        batch = []
+        for item in files:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                for x in self._filter_batch(batch):
+                    yield x
+                batch = []
+        if batch:
+            for x in self._filter_batch(batch):
+                yield x
+
+    def _filter_batch(self, batch):
+        rows = self._rows([path for path, _ in batch])
+        # (path, stat, previous hash) of files that may have been touched only
+        check = []
+        for path, stat in batch:
+            row = rows.get(path)
+            if row is None or row[0] != stat.st_size:
+                yield path, stat
+            elif row[1] != stat.st_mtime:
+                check.append((path, stat, row[2]))
+
+        if not check:
+            return
+        hashes = list(self.executor.map(hash_file, [path for path, _, _ in check]))
+        touched = []
+        for (path, stat, previous), h in zip(check, hashes):
+            if h == previous:
+                touched.append((path, stat.st_size, stat.st_mtime, h))
+            else:
+                yield path, stat
+        # unchanged contents: remember the new mtime
+        self._put(touched)
+
+    def prepare(self, path):
+        """
+        Start hashing ``path`` in the background, before it is uploaded.
+        """
+        def digest():
+            # stat first: if the file changes while it is hashed, the
+            # recorded mtime is stale and it is checked again next time
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime, hash_file(path)
+
+        future = self.executor.submit(digest)
+        with self._lock:
+            self._prepared[path] = future
+
+    def add(self, path):
+        """
+        Record ``path`` as uploaded, with the size, mtime and hash taken by
+        ``prepare(path)`` (or now, if it was not prepared). ``flush()`` (or
+        ``close()``) waits until it is recorded.
+        """
+        with self._lock:
+            prepared = self._prepared.pop(path, None)
+
+        def record():
+            # submitted after the hash it waits for, so that one is running
+            if prepared is not None:
+                size, mtime, h = prepared.result()
+            else:
+                stat = os.stat(path)
+                size, mtime, h = stat.st_size, stat.st_mtime, hash_file(path)
+            self._put([(path, size, mtime, h)])
+
+        future = self.executor.submit(record)
+        with self._lock:
+            self._pending.append(future)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self):
+        with self._lock, self.con as con:
+            return con.execute(
+                "SELECT COUNT(*) FROM uploads WHERE scope = ?", (self.scope,)).fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_manifest(manifest, settings=None, scope=''):
+    """
+    ``manifest`` argument -> manifest. ``True`` is the ``HashManifest`` in
+    ``blackfynn_dir`` (for destination ``scope``), a string the path of an
+    ``UploadManifest``.
+    """
+    if manifest is None or manifest is False or hasattr(manifest, 'contains'):
+        return manifest or None
+    if manifest is True:
+        return HashManifest(
+            os.path.join(settings.blackfynn_dir, 'upload_manifest.db'),
+            scope=scope,
+            max_workers=settings.max_hash_workers)
+    return UploadManifest(manifest)
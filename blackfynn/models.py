@@ -9,13 +9,14 @@ import io
 import os
 import re
 import sys
+import weakref
+from collections import OrderedDict
 from uuid import uuid4
 
 import dateutil
 import numpy as np
 import pandas as pd
 import pytz
-import requests
 
 import blackfynn.log as log
 from blackfynn.utils import (
@@ -58,11 +59,93 @@ def get_package_class(data):
     return p
 
 
+_slot_names = {}
+
+def _get_slot_names(cls):
+    """
+    Names of all ``__slots__`` declared on ``cls`` and its bases.
+    """
+    names = _slot_names.get(cls)
+    if names is None:
+        names = []
+        for klass in cls.__mro__:
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, string_types):
+                slots = (slots,)
+            names.extend(n for n in slots if n not in ('__dict__', '__weakref__'))
+        names = _slot_names[cls] = tuple(names)
+    return names
+
+
+def _copy_state(target, source):
+    """
+    Copy the instance attributes of ``source`` onto ``target``, whether they
+    are stored in ``__slots__`` or in ``__dict__``.
+    """
+    for name in _get_slot_names(type(source)):
+        try:
+            setattr(target, name, getattr(source, name))
+        except AttributeError:
+            # slot was never assigned
+            pass
+    if hasattr(source, '__dict__'):
+        target.__dict__.update(source.__dict__)
+
+
+# state that is loaded or built separately from an object's payload
+_LOADED_STATE = ('_items', '_indexes', '_properties', '_schema', '_linked')
+
+_payload_attrs = {}
+
+def _payload_fields(cls, keys):
+    """
+    Names of the attributes of ``cls`` that are set from the constructor
+    arguments ``keys`` (see ``BaseNode._payload_attrs``).
+    """
+    attrs = _payload_attrs.get(cls)
+    if attrs is None:
+        attrs = {}
+        for klass in reversed(cls.__mro__):
+            attrs.update(klass.__dict__.get('_payload_attrs', {}))
+        _payload_attrs[cls] = attrs
+    fields = set()
+    for key in keys:
+        fields.update(attrs.get(key, (key,)))
+    return fields
+
+
+def _merge_state(target, source, fields=None):
+    """
+    Merge the state of ``source``, a freshly parsed copy of ``target``, into
+    ``target``. Attributes in ``fields`` (those set from the payload, see
+    ``_payload_fields``; all attributes if not given) replace those of
+    ``target``, also with None. Other attributes only fill in what ``target``
+    is missing, and loaded state (such as collection items) is only copied
+    if ``target`` has none.
+    """
+    names = list(_get_slot_names(type(source)))
+    if hasattr(source, '__dict__'):
+        names.extend(source.__dict__)
+    for name in names:
+        try:
+            value = getattr(source, name)
+        except AttributeError:
+            # slot was never assigned
+            continue
+        if fields is not None and name in fields:
+            setattr(target, name, value)
+        elif name in _LOADED_STATE:
+            if not getattr(target, name, None):
+                setattr(target, name, value)
+        elif fields is None or getattr(target, name, None) is None:
+            setattr(target, name, value)
+
+
 def _update_self(self, updated):
     if self.id != updated.id:
         raise Exception("cannot update {} with {}".format(self, updated))
 
-    self.__dict__.update(updated.__dict__)
+    _copy_state(self, updated)
 
     return self
 
@@ -105,6 +188,8 @@ class Property(object):
         data_type (str): one of 'string', 'integer', 'double', 'date', 'user'
 
     """
+    __slots__ = ('key', 'value', 'fixed', 'hidden', 'category', 'data_type')
+
     _data_types = ['string', 'integer', 'double', 'date', 'user', 'boolean']
     def __init__(self, key, value, fixed=False, hidden=False, category="Blackfynn", data_type=None):
         self.key = key
@@ -177,12 +262,66 @@ def _get_all_class_args(cls):
     return class_args
 
 
+_CAMEL_CASE = re.compile(r'[A-Z]')
+_NUMBER = re.compile(r'[0-9]')
+
+
+class _FieldMap(dict):
+    """
+    Maps API response keys to constructor arguments of a class. Each key
+    is resolved once, on first use.
+    """
+    def __init__(self, cls):
+        super(_FieldMap, self).__init__()
+        self.class_args = _get_all_class_args(cls)
+
+    def __missing__(self, k):
+        # check lower case var names
+        k_lower = k.lower()
+        # check camelCase --> camel_case
+        k_camel = _CAMEL_CASE.sub(lambda x: '_'+x.group(0).lower(), k)
+        # check s3case --> s3_case
+        k_camel_num = _NUMBER.sub(lambda x: x.group(0)+'_', k)
+
+        # match with existing args
+        if k_lower in self.class_args:
+            key = k_lower
+        elif k_camel in self.class_args:
+            key = k_camel
+        elif k_camel_num in self.class_args:
+            key = k_camel_num
+        else:
+            key = k
+
+        self[k] = key
+        return key
+
+
+_field_maps = {}
+
+def _get_field_map(cls):
+    field_map = _field_maps.get(cls)
+    if field_map is None:
+        field_map = _field_maps[cls] = _FieldMap(cls)
+    return field_map
+
+
 class BaseNode(object):
     """
     Base class to serve all objects
+
+    Note:
+        Subclasses without ``__slots__`` keep a regular ``__dict__``. High-volume
+        types (e.g. ``Record``, ``TimeSeriesAnnotation``) declare all of their
+        attributes as slots, including ``_api``, to keep per-instance overhead low.
     """
+    __slots__ = ('id', 'int_id', '__weakref__')
+
     _api = None
     _object_key = 'content'
+    # constructor arguments -> the attributes they set, where the names
+    # differ (see _payload_fields)
+    _payload_attrs = {}
 
     def __init__(self, id=None, int_id=None, *args, **kargs):
         self.id = id
@@ -202,32 +341,12 @@ class BaseNode(object):
         else:
             content = data[obj_key]
 
-        class_args = _get_all_class_args(cls)
+        field_map = _get_field_map(cls)
 
         # find overlapping keys
-        kwargs = {}
         thing_id = content.pop('id', None)
         thing_int_id = content.pop('intId', None)
-        for k,v in content.items():
-            # check lower case var names
-            k_lower = k.lower()
-            # check camelCase --> camel_case
-            k_camel = re.sub(r'[A-Z]', lambda x: '_'+x.group(0).lower(), k)
-            # check s3case --> s3_case
-            k_camel_num = re.sub(r'[0-9]', lambda x: x.group(0)+'_', k)
-
-            # match with existing args
-            if k_lower in class_args:
-                key = k_lower
-            elif k_camel in class_args:
-                key = k_camel
-            elif k_camel_num in class_args:
-                key = k_camel_num
-            else:
-                key = k
-
-            # assign
-            kwargs[key] = v
+        kwargs = {field_map[k]: v for k,v in content.items()}
 
         # init class with args
         item = cls.__new__(cls)
@@ -241,7 +360,9 @@ class BaseNode(object):
 
         if api is not None:
             item._api = api
-            item._api.core.set_local(item)
+            # reuse the local instance of this object, if there is one
+            fields = _payload_fields(cls, kwargs) | set(['id', 'int_id', '_api'])
+            item = api.core.merge_local(item, fields)
 
         return item
 
@@ -272,7 +393,15 @@ class BaseDataNode(BaseNode):
     """
     Base class to serve all "data" node-types on platform, e.g. Packages and Collections.
     """
+    __slots__ = ()
+
     _type_name = 'packageType'
+    _payload_attrs = {
+        'package_type': ('type',),
+        'dataset_id': ('dataset',),
+        'createdAt': ('created_at',),
+        'updatedAt': ('updated_at',),
+    }
 
     def __init__(self, name, type,
             parent=None,
@@ -300,6 +429,28 @@ class BaseDataNode(BaseNode):
         self.created_at = kwargs.pop('createdAt', None)
         self.updated_at = kwargs.pop('updatedAt', None)
 
+    @property
+    def name(self):
+        return self.__dict__.get('name')
+
+    @name.setter
+    def name(self, value):
+        # kept in __dict__ under its own name, so that copies and merges of
+        # the state see a plain attribute
+        self.__dict__['name'] = value
+        for ref in self.__dict__.get('_name_indexes', ()):
+            collection = ref()
+            if collection is not None:
+                collection._indexes.pop('name', None)
+
+    def _add_name_index(self, collection):
+        """
+        ``collection`` indexes this item by name: renaming it drops that index.
+        """
+        refs = self.__dict__.setdefault('_name_indexes', [])
+        if not any(ref() is collection for ref in refs):
+            refs.append(weakref.ref(collection))
+
     def update_properties(self):
         self._api.data.update_properties(self)
 
@@ -459,8 +610,8 @@ class BaseDataNode(BaseNode):
         }
 
         for k in ['parent', 'state', 'dataset']:
-            kval = self.__dict__.get(k, None)
-            if hasattr(self, k) and kval is not None:
+            kval = getattr(self, k, None)
+            if kval is not None:
                 d[k] = kval
 
         if self.provenance_id is not None:
@@ -477,11 +628,16 @@ class BaseDataNode(BaseNode):
         except:
             pass
 
-        item.owner_id = data.get('owner', data.get('ownerId', None))
+        if 'owner' in data or 'ownerId' in data:
+            item.owner_id = data.get('owner', data.get('ownerId'))
 
         # parse, store parent (ID only)
         parent = data.get('parent', None)
-        if parent is not None:
+        if parent is None:
+            if 'parent' in data:
+                # moved to the dataset root
+                item.parent = None
+        else:
             if isinstance(parent, string_types):
                 item.parent = parent
             else:
@@ -495,8 +651,9 @@ class BaseDataNode(BaseNode):
                 item._properties[cat] = {}
             item._properties[cat].update({prop.key: prop})
 
-        # parse properties
+        # parse properties, replacing those of a local instance
         if 'properties' in data:
+            item._properties = {}
             for entry in data['properties']:
                 if 'properties' not in entry:
                     # flat list of properties: [entry]
@@ -523,6 +680,8 @@ class BaseCollection(BaseDataNode):
         # items is None until an API response provides the item objects
         # to be parsed, which then updates this instance.
         self._items = None
+        # attribute -> (items, {value: [item, ...]}), see _find_items()
+        self._indexes = {}
 
     def add(self, *items):
         """
@@ -542,10 +701,11 @@ class BaseCollection(BaseDataNode):
 
             # create, if not already created
             new_item = self._api.core.create(item)
-            item.__dict__.update(new_item.__dict__)
+            _copy_state(item, new_item)
 
             # add item
             self._items.append(item)
+            self._indexes = {}
 
     def remove(self, *items):
         """
@@ -561,6 +721,7 @@ class BaseCollection(BaseDataNode):
         # remove locally
         for item in items:
             self._items.remove(item)
+        self._indexes = {}
 
     @property
     def items(self):
@@ -586,6 +747,30 @@ class BaseCollection(BaseDataNode):
     def _get_method(self):
         pass
 
+    def _find_items(self, attr, value):
+        """
+        Items whose ``attr`` equals ``value``. Uses an index over ``self.items``
+        that is rebuilt when the items change, or when an indexed item no
+        longer matches. Renaming an item drops the name index of the
+        collections it is indexed in (see ``BaseDataNode.name``).
+        """
+        items = self.items
+        cached = self._indexes.get(attr)
+        fresh = cached is None or cached[0] is not items
+        while True:
+            if fresh:
+                index = {}
+                for x in items:
+                    index.setdefault(getattr(x, attr), []).append(x)
+                    if attr == 'name':
+                        x._add_name_index(self)
+                cached = self._indexes[attr] = (items, index)
+
+            matches = cached[1].get(value, [])
+            if fresh or all(getattr(x, attr) == value for x in matches):
+                return list(matches)
+            fresh = True
+
     def print_tree(self, indent=0):
         """
         Prints a tree of **all** items inside object.
@@ -598,6 +783,82 @@ class BaseCollection(BaseDataNode):
             else:
                 print(u'{}{}'.format(' '*(indent+2), item))
 
+    def walk(self, package_type=None, max_depth=None, max_workers=None, refresh=True):
+        """
+        Walk **all** items inside object, breadth-first. Nested collections
+        are fetched concurrently.
+
+        Args:
+            package_type (str or list, optional): only return items of this type
+                (or types), e.g. ``'TimeSeries'`` or ``['Collection', 'PDF']``
+            max_depth (int, optional): how many levels to descend, where ``1`` only
+                returns the items directly inside this object
+            max_workers (int, optional): number of concurrent requests, defaults
+                to the ``max_request_workers`` setting
+            refresh (bool, optional): fetch the contents of every collection
+                (default), instead of using the items already loaded
+
+        Returns:
+            Generator of ``(path, item)`` tuples, where ``path`` is a tuple of
+            the names of the collections containing ``item``.
+
+        Example::
+
+            for path, pkg in ds.walk(package_type='TimeSeries'):
+                print('/'.join(path), pkg.name)
+
+        """
+        self._check_exists()
+        return self._api.data.walk(
+            self, package_type=package_type, max_depth=max_depth, max_workers=max_workers,
+            refresh=refresh)
+
+    def walk_packages(self, package_type=None, max_depth=None, max_workers=None, refresh=True):
+        """
+        Like ``walk()``, but only returns packages (no collections).
+        """
+        for path, item in self.walk(package_type, max_depth, max_workers, refresh):
+            if not isinstance(item, BaseCollection):
+                yield path, item
+
+    def download(self, destination, parallel=None, max_bandwidth=None, skip_existing=True, callback=None):
+        """
+        Download the source files of all packages inside object, recreating
+        its folder structure in ``destination``, with one folder per package.
+        Items with the same name in one folder are numbered in order of their
+        ids, e.g. ``data`` and ``data (2)``.
+
+        Args:
+            destination (str): local directory to download into
+            parallel (int, optional): number of concurrent downloads, defaults
+                to the ``max_parallel_downloads`` setting
+            max_bandwidth (int, optional): combined download rate limit, in
+                bytes per second
+            skip_existing (bool, optional): skip files that already exist
+                locally with the same size (default)
+            callback (callable, optional): called as ``callback(file, path, downloaded)``
+                after every file
+
+        Returns:
+            List of the local paths of all files.
+
+        Raises:
+            DownloadError: if any files failed to download; ``errors`` maps
+                their ids to their exception.
+
+        Example::
+
+            ds.download('/scratch/study', parallel=8)
+
+        """
+        self._check_exists()
+        return self._api.io.download(
+            self, destination,
+            parallel=parallel,
+            max_bandwidth=max_bandwidth,
+            skip_existing=skip_existing,
+            callback=callback)
+
     def get_items_by_name(self, name):
         """
         Get an item inside of object by name (if match is found).
@@ -615,7 +876,7 @@ class BaseCollection(BaseDataNode):
         """
         self._check_exists()
         # note: non-hierarchical
-        return [x for x in self.items if x.name==name]
+        return self._find_items('name', name)
 
     def get_items_names(self):
         self._check_exists()
@@ -633,6 +894,9 @@ class BaseCollection(BaseDataNode):
         Keyword Args:
             display_progress (boolean): If ``True``, a progress bar will be
                 shown to track upload progress. Defaults to ``False``.
+            progress: progress sink (see ``blackfynn.progress``), or a function
+                called with the ``TransferProgress`` of every updated file, or a
+                list of those. Only used when uploading without the Agent.
             use_agent (boolean): If ``True``, and a compatible version of the
                 Agent is installed, uploads will be performed by the
                 Blackfynn CLI Agent. This allows large file upload in excess
@@ -640,6 +904,18 @@ class BaseCollection(BaseDataNode):
             recursive (boolean): If ``True``, the nested folder structure of
                 the uploaded directory will be preversed. This can only be used
                 with the Blackfynn CLI Agent. Defaults to ``False``.
+            include (str or list): only upload files matching these glob
+                patterns (matched against the file name and the path relative to
+                the uploaded directory)
+            exclude (str or list): skip files and directories matching these
+                glob patterns
+            manifest (bool or str): skip files that were already uploaded to
+                this destination and did not change since. If ``True``, uploads
+                are recorded in a local database (in ``blackfynn_dir``) with a
+                hash of their contents, so files that were only touched are
+                skipped too; a string is the path of a manifest file recording
+                paths, sizes and modification times. Cannot be used with
+                ``recursive``.
 
         Example::
 
@@ -708,10 +984,11 @@ class BaseCollection(BaseDataNode):
         self._check_exists()
         if isinstance(item, string_types):
             some_id = self._api.data._get_id(item)
-            item_ids = [x.id for x in self.items]
-            contains = some_id in item_ids
+            contains = len(self._find_items('id', some_id)) > 0
         elif self._items is None:
             return False
+        elif isinstance(item, BaseNode) and item.exists:
+            return len(self._find_items('id', item.id)) > 0
         else:
             return item in self._items
 
@@ -726,14 +1003,17 @@ class BaseCollection(BaseDataNode):
     @classmethod
     def from_dict(cls, data, *args, **kwargs):
         item = super(BaseCollection, cls).from_dict(data, *args, **kwargs)
-        children = []
         if 'children' in data:
+            children = []
             for child in data['children']:
                 pkg_cls = get_package_class(child)
                 kwargs['api'] = item._api
                 pkg = pkg_cls.from_dict(child, *args, **kwargs)
                 children.append(pkg)
-        item.add(*children)
+            # the payload lists all children
+            item._items = []
+            item._indexes = {}
+            item.add(*children)
 
         return item
 
@@ -837,15 +1117,10 @@ class DataPackage(BaseDataNode):
         assert all([isinstance(r, Record) for r in records]), "all records must be object of type Record"
 
         # auto-create relationship type
-        relationships = self._api.concepts.relationships.get_all(self.dataset)
-        if 'belongs_to' not in relationships:
-            r = RelationshipType(dataset_id=self.dataset, name='belongs_to', description='belongs_to')
-            self._api.concepts.relationships.create(self.dataset, r)
-
-        return [
-            self._api.concepts.proxies.create(self.dataset, self.id, 'belongs_to', r, {})
-            for r in records
-        ]
+        relationship = self._api.concepts.relationships.get_or_create(self.dataset, 'belongs_to')
+
+        return list(self._api.concepts.relationships.instances.create_bulk(
+            self.dataset, relationship, [(self, r) for r in records]))
 
     def as_dict(self):
         d = super(DataPackage, self).as_dict()
@@ -955,10 +1230,7 @@ class File(BaseDataNode):
             # exact location
             f_local = destination
 
-        r = requests.get(self.url, stream=True)
-        with io.open(f_local, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk: f.write(chunk)
+        self._api.io.download_file(self.url, f_local)
 
         # set local path
         self.local_path = f_local
@@ -1095,7 +1367,7 @@ class TimeSeries(DataPackage):
         self._check_exists()
         for channel in channels:
             ch = self._api.timeseries.create_channel(self, channel)
-            channel.__dict__.update(ch.__dict__)
+            _copy_state(channel, ch)
 
     def remove_channels(self, *channels):
         """
@@ -1204,6 +1476,9 @@ class TimeSeries(DataPackage):
         Keyword Args:
             display_progress (boolean): If ``True``, a progress bar will be
                 shown to track upload progress. Defaults to ``False``.
+            progress: progress sink (see ``blackfynn.progress``), or a function
+                called with the ``TransferProgress`` of every updated file, or a
+                list of those. Only used when uploading without the Agent.
             use_agent (boolean): If ``True``, and a compatible version of the
                 Agent is installed, uploads will be performed by the
                 Blackfynn CLI Agent. This allows large file upload in excess
@@ -1213,9 +1488,34 @@ class TimeSeries(DataPackage):
         files = _flatten_file_args(files)
         return self._api.io.upload_files(self, files, append=True, **kwargs)
 
-    def stream_data(self, data):
+    def stream_data(self, data, channels=None, rate=None, start=None):
+        """
+        Append samples to the TimeSeries package, creating missing channels.
+
+        Args:
+            data:                        DataFrame (one column per channel), Series,
+                                         dict of channel to data, or array of shape
+                                         (samples, channels)
+            channels (list, optional):   channel names or objects, one per column
+            rate (float, optional):      sampling rate (Hz), for data without a
+                                         DatetimeIndex and for new channels
+            start (optional):            time of the first sample (datetime or
+                                         microseconds since Epoch), used with ``rate``
+
+        Returns:
+            List of ``TimeSeriesChannel`` written to.
+
+        Example::
+
+            df = pd.DataFrame({'ch1': ..., 'ch2': ...}, index=pd.date_range(...))
+            ts.stream_data(df)
+
+            ts.stream_data(samples, channels=['ch1', 'ch2'], rate=250, start=now)
+
+        """
         self._check_exists()
-        return self._api.timeseries.stream_data(self, data)
+        return self._api.timeseries.stream_data(
+            self, data, channels=channels, rate=rate, start=start)
 
     # ~~~~~~~~~~~~~~~~~~
     # Annotations
@@ -1356,7 +1656,14 @@ class TimeSeriesChannel(BaseDataNode):
         group (str, optional):        The channel group, default: "default"
 
     """
+    __slots__ = (
+        '_api', 'name', '_properties', 'parent', 'type', 'dataset', 'owner_id',
+        'provenance_id', 'state', 'created_at', 'updated_at', 'channel_type',
+        'rate', 'unit', 'last_annot', 'group', '_start', '_end', 'spike_duration',
+        '_pkg', '_sample_period')
+
     def __init__(self, name, rate, start=0, end=0, unit='V', channel_type='continuous', source_type='unspecified', group="default", last_annot=0, spike_duration=None, **kwargs):
+        self._api = None
         self.channel_type = channel_type.upper()
 
         super(TimeSeriesChannel, self).__init__(name=name, type=self.channel_type,**kwargs)
@@ -1413,7 +1720,7 @@ class TimeSeriesChannel(BaseDataNode):
     def update(self):
         self._check_exists()
         r = self._api.timeseries.update_channel(self)
-        self.__dict__.update(r.__dict__)
+        _copy_state(self, r)
 
     def segments(self, start=None, stop=None, gap_factor=2):
         """
@@ -1655,11 +1962,17 @@ class TimeSeriesAnnotation(BaseNode):
         description:    Description of annotation
 
     """
+    __slots__ = (
+        '_api', 'user_id', 'name', 'label', 'channel_ids', 'start', 'end',
+        'description', 'layer_id', 'time_series_id')
+
     _object_key = None
+    _payload_attrs = {'userId': ('user_id',)}
 
 
     def __init__(self, label, channel_ids, start, end, name='',layer_id= None,
                  time_series_id = None, description=None, **kwargs):
+        self._api = None
         self.user_id = kwargs.pop('userId', None)
         super(TimeSeriesAnnotation,self).__init__(**kwargs)
         self.name = ''
@@ -1732,12 +2045,33 @@ class Tabular(DataPackage):
         self._check_exists()
         return self._api.tabular.get_tabular_data(self,limit=limit,offset=offset ,order_by=order_by, order_direction=order_direction)
 
-    def get_data_iter(self, chunk_size=10000, offset=0, order_by = None, order_direction='ASC'):
+    def get_data_iter(self, chunk_size=10000, offset=0, order_by = None, order_direction='ASC', limit=None, output='dataframe'):
         """
         Iterate over tabular data, each data chunk will be of size ``chunk_size``.
+        At most ``limit`` rows are returned (all rows if ``None``).
+
+        Chunks are DataFrames, or ``pyarrow.RecordBatch`` objects if ``output``
+        is ``'arrow'`` (requires pyarrow).
         """
         self._check_exists()
-        return self._api.tabular.get_tabular_data_iter(self,chunk_size=chunk_size,offset=offset,order_by=order_by, order_direction=order_direction)
+        return self._api.tabular.get_tabular_data_iter(self,chunk_size=chunk_size,offset=offset,order_by=order_by, order_direction=order_direction, limit=limit, output=output)
+
+    def to_parquet(self, path, limit=None, offset=0, order_by=None, order_direction='ASC', chunk_size=10000):
+        """
+        Write tabular data to a Parquet file, one chunk at a time (requires pyarrow).
+
+        Args:
+            path:            Path of the Parquet file
+            limit:           Max number of rows to write (all rows if ``None``)
+            offset:          Offset when retrieving rows
+            order_by:        Column to order data
+            order_direction: Ascending ('ASC') or descending ('DESC')
+
+        Returns:
+            Number of rows written
+        """
+        self._check_exists()
+        return self._api.tabular.write_tabular_parquet(self, path, limit=limit, offset=offset, order_by=order_by, order_direction=order_direction, chunk_size=chunk_size)
 
     def set_schema(self, schema):
         self.schema = schema
@@ -1760,6 +2094,22 @@ class TabularSchema(BaseNode):
         self.name = name
         self.column_schema = column_schema
 
+    @property
+    def columns(self):
+        """
+        The columns returned to users (without internal columns).
+        """
+        return [x for x in self.column_schema if not x.internal]
+
+    def decode_rows(self, rows):
+        """
+        Decode rows returned by the API into one typed array per column
+        (see ``TabularSchemaColumn.decode``), keyed by display name.
+        """
+        return OrderedDict(
+            (x.label, x.decode([row.get(x.name) for row in rows]))
+            for x in self.columns)
+
     @classmethod
     def from_dict(cls, data):
         column_schema = []
@@ -1790,6 +2140,15 @@ class TabularSchema(BaseNode):
 
 class TabularSchemaColumn(object):
 
+    # python type of column values, by datatype
+    _data_types = {
+        'integer': int, 'int': int, 'long': int, 'bigint': int, 'smallint': int,
+        'double': float, 'float': float, 'real': float, 'decimal': float, 'numeric': float,
+        'boolean': bool, 'bool': bool,
+        'date': datetime.datetime, 'datetime': datetime.datetime, 'timestamp': datetime.datetime,
+        'string': str, 'text': str, 'varchar': str,
+    }
+
     def __init__(self, name, display_name, datatype, primary_key = False, internal = False, **kwargs):
         self.name=name
         self.display_name = display_name
@@ -1797,6 +2156,48 @@ class TabularSchemaColumn(object):
         self.internal = internal
         self.primary_key = primary_key
 
+    @property
+    def label(self):
+        return self.display_name if self.display_name else self.name
+
+    @property
+    def data_type(self):
+        """
+        Python type of values in this column (``None`` if unknown).
+        """
+        return self._data_types.get(str(self.datatype).lower())
+
+    # pandas dtype of integer and boolean columns, whether or not values are
+    # missing (nullable dtypes need pandas 1.0)
+    _nullable_dtypes = {
+        int: 'Int64' if hasattr(pd, 'Int64Dtype') else np.float64,
+        bool: 'boolean' if hasattr(pd, 'BooleanDtype') else object,
+    }
+
+    def decode(self, values):
+        """
+        Convert a list of column values to an array typed by the column
+        datatype only, so that all chunks of a table get the same dtypes:
+        datetime64 for dates, float64 for decimals, and nullable ``Int64``
+        and ``boolean`` arrays for integers and booleans. Empty strings in
+        these columns are missing values; columns with values that do not
+        convert are kept as object arrays.
+        """
+        data_type = self.data_type
+        if data_type in (int, float, bool, datetime.datetime):
+            values = [None if v == '' else v for v in values]
+        dtype = self._nullable_dtypes.get(data_type)
+        if dtype is None:
+            return _typed_array(data_type, values)
+        try:
+            if dtype is object:
+                return np.array(values, dtype=object)
+            elif dtype is np.float64:
+                return np.array([np.nan if v is None else v for v in values], dtype=dtype)
+            return pd.array(values, dtype=dtype)
+        except (TypeError, ValueError, OverflowError):
+            return np.array(values, dtype=object)
+
     @classmethod
     def from_dict(cls, data):
         return cls(
@@ -1915,26 +2316,35 @@ class Dataset(BaseCollection):
     def __repr__(self):
         return u"<Dataset name='{}' id='{}'>".format(self.name, self.id)
 
-    def get_topology(self):
+    def get_topology(self, lazy=False):
         """ Returns the set of Models and Relationships defined for the dataset
 
+        Args:
+            lazy (bool, optional): If True, defer fetching model schemas
+                until ``Model.schema`` is first accessed
+
         Returns:
             dict: Keys are either ``models`` or ``relationships``. Values are
             the list of objects of that type
 
         """
-        return self._api.concepts.get_topology(self)
+        return self._api.concepts.get_topology(self, lazy=lazy)
 
     def get_graph_summary(self):
         """ Returns summary metrics about the knowledge graph """
         return self._api.concepts.get_summary(self)
 
-    def models(self):
+    def models(self, lazy=False):
         """
+        Args:
+            lazy (bool, optional): If True, defer fetching model schemas
+                until ``Model.schema`` is first accessed. Useful when only
+                model names are needed.
+
         Returns:
             List of models defined in Dataset
         """
-        return self._api.concepts.get_all(self.id)
+        return self._api.concepts.get_all(self.id, lazy=lazy)
 
     def relationships(self):
         """
@@ -2187,6 +2597,8 @@ def target_type_string(target):
         raise Exception("target must be a string or model")
 
 
+_shared_property_types = {}
+
 class ModelPropertyType(object):
     '''
     Representation of model property types in the platform.
@@ -2225,6 +2637,21 @@ class ModelPropertyType(object):
 
         return ModelPropertyType.from_dict(data)
 
+    @staticmethod
+    def _shared(data):
+        """
+        Like ``_build_from``, but plain (string) types resolve to one shared
+        instance. Used by values, of which there may be millions.
+        """
+        if not isinstance(data, string_types):
+            return ModelPropertyType._build_from(data)
+
+        key = data.lower()
+        data_type = _shared_property_types.get(key)
+        if data_type is None:
+            data_type = _shared_property_types[key] = ModelPropertyType.from_dict(data)
+        return data_type
+
     @classmethod
     def from_dict(cls, data):
         if isinstance(data, dict):
@@ -2526,11 +2953,13 @@ class LinkedModelProperty(BaseNode):
             self.name, self.id)
 
 class BaseModelValue(object):
+    __slots__ = ('name', 'data_type', '_value')
+
     def __init__(self, name, value, data_type=None):
         assert " " not in name, "name cannot contain spaces, alternative names include {} and {}".format(name.replace(" ", "_"), name.replace(" ", "-"))
 
         self.name = name
-        self.data_type = ModelPropertyType._build_from(data_type)
+        self.data_type = ModelPropertyType._shared(data_type)
         self.value = value # Decoded in @value.setter
 
     @property
@@ -2606,6 +3035,13 @@ class LinkedModelValue(BaseNode):
 class BaseModelNode(BaseNode):
     _object_key = ''
     _property_cls = BaseModelProperty
+    _payload_attrs = {
+        'name': ('type',),
+        'createdAt': ('created_at',),
+        'updatedAt': ('updated_at',),
+        'schema': ('_schema',),
+        'linked': ('_linked',),
+    }
 
     def __init__(self, dataset_id, name, display_name = None, description = None, locked = False, default = True, *args, **kwargs):
         assert " " not in name, "type cannot contain spaces, alternative types include {} and {}".format(name.replace(" ", "_"), name.replace(" ", "-"))
@@ -2628,6 +3064,38 @@ class BaseModelNode(BaseNode):
 
         self._add_properties(schema)
 
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._load_schema()
+        return self._schema
+
+    @schema.setter
+    def schema(self, value):
+        self._schema = value
+
+    @property
+    def linked(self):
+        if self._linked is None:
+            self._load_schema()
+        return self._linked
+
+    @linked.setter
+    def linked(self, value):
+        self._linked = value
+
+    def _unload_schema(self):
+        """
+        Defer loading of the schema until it is first accessed.
+        """
+        self._schema = None
+        self._linked = None
+
+    # should be overridden by sub-class
+    def _load_schema(self):
+        self._schema = dict()
+        self._linked = dict()
+
     def _add_property(self, name, display_name=None, data_type=str, title=False, description=""):
         prop = self._property_cls(name=name, display_name=display_name,
                                   data_type=data_type, title=title,
@@ -2849,11 +3317,21 @@ class BaseModelNode(BaseNode):
         )
 
 class BaseRecord(BaseNode):
+    __slots__ = ()
+
     _object_key = ''
     _value_cls = BaseModelValue
+    _payload_attrs = {
+        'createdAt': ('created_at',),
+        'createdBy': ('created_by',),
+        'updatedAt': ('updated_at',),
+        'updatedBy': ('updated_by',),
+        'values': ('_values',),
+    }
 
     def __init__(self, dataset_id, type, *args, **kwargs):
 
+        self._api       = None
         self.type       = type
         self.dataset_id  = dataset_id
         self.created_at = kwargs.pop('createdAt', None)
@@ -3013,6 +3491,8 @@ class ModelProperty(BaseModelProperty):
         return u"<ModelProperty name='{}' {}>".format(self.name, self.type)
 
 class ModelValue(BaseModelValue):
+    __slots__ = ()
+
     @as_native_str()
     def __repr__(self):
         return u"<ModelValue name='{}' value='{}' {}>".format(self.name, self.value, self.type)
@@ -3080,6 +3560,12 @@ class Model(BaseModelNode):
 
         super(Model, self).__init__(dataset_id, name, display_name, description, locked, *args, **kwargs)
 
+    def _load_schema(self):
+        schema, linked = self._api.concepts.get_schema(self.dataset_id, self)
+        self._schema = dict()
+        self._add_properties(schema)
+        self._linked = linked
+
     def update(self):
         """
         Updates the details of the ``Model`` on the platform.
@@ -3192,6 +3678,10 @@ class Model(BaseModelNode):
         Returns:
             List of newly created ``Record`` objects.
 
+        Raises:
+            RecordCreateError: if some batches of records could not be created;
+                ``error.records`` holds the records that were created.
+
         Example::
 
             mouse.create_records([
@@ -3229,7 +3719,27 @@ class Model(BaseModelNode):
         return self._api.concepts.instances.create_many(self.dataset_id, self, *ci_list)
 
     def from_dataframe(self, df):
-        return self.create_many(*df.to_dict(orient='records'))
+        """
+        Creates one record per row of a pandas DataFrame. Column names must
+        match properties defined in the ``Model`` schema.
+
+        Rows are validated and encoded column by column, then sent to the
+        platform in concurrent batches of ``max_records_per_chunk`` records.
+
+        Args:
+            df (pd.DataFrame): record values, one column per property
+
+        Returns:
+            A ``pd.DataFrame`` indexed like ``df``, with the ``id`` of each
+            new record and an ``error`` for rows that could not be created.
+
+        Example::
+
+            result = mouse.from_dataframe(pd.read_csv('mice.csv'))
+            failed = result[result.error.notnull()]
+        """
+        self._check_exists()
+        return self._api.concepts.instances.create_from_dataframe(self.dataset_id, self, df)
 
     def delete_records(self, *records):
         """
@@ -3274,8 +3784,32 @@ class Model(BaseModelNode):
         """
         return self._api.concepts.get_related(self.dataset_id, self)
 
+    def iter_records(self, page_size=100, prefetch=2):
+        """
+        Iterates over all records of the model, fetching them from the
+        platform one page at a time.
+
+        Args:
+            page_size (int, optional): Number of records requested per page
+            prefetch (int, optional): Number of pages requested ahead of the
+                page being consumed
+
+        Returns:
+            A ``RecordCursor``, which yields ``Record`` objects when iterated
+            and pandas DataFrames via ``as_dataframes()``
+
+        Example::
+
+            for record in mouse.iter_records(page_size=1000):
+                print(record.get('weight'))
+
+            for df in mouse.iter_records().as_dataframes():
+                df.to_csv('mice.csv', mode='a')
+        """
+        return self._api.concepts.instances.iter_all(self.dataset_id, self, page_size=page_size, prefetch=prefetch)
+
     def __iter__(self):
-        for record in self.get_all():
+        for record in self.iter_records():
             yield record
 
     @as_native_str()
@@ -3289,6 +3823,10 @@ class Record(BaseRecord):
 
     Includes its neighbors, relationships, and links.
     """
+    __slots__ = (
+        '_api', 'type', 'dataset_id', 'created_at', 'created_by', 'updated_at',
+        'updated_by', '_values')
+
     _object_key = ''
     _value_cls = ModelValue
 
@@ -3406,21 +3944,17 @@ class Record(BaseRecord):
 
         # auto-create relationship type
         if isinstance(relationship_type, string_types):
-            relationships_types = self._api.concepts.relationships.get_all(self.dataset_id)
-            if relationship_type not in relationships_types:
-                r = RelationshipType(dataset_id=self.dataset_id, name=relationship_type, description=relationship_type,  source=self.model.id, destination=destinations[0].model.id)
-                relationship_type = self._api.concepts.relationships.create(self.dataset_id, r)
-            else:
-                relationship_type = relationships_types[relationship_type]
+            relationship_type = self._api.concepts.relationships.get_or_create(
+                self.dataset_id, relationship_type, source=self,
+                destination=destinations[0] if isinstance(destinations[0], Record) else None)
 
         # relationships (to packages)
         if isinstance(destinations[0], DataPackage):
-            # if linking packages, link one at a time
-            result = [
-                self._api.concepts.relationships.instances.link(self.dataset_id, relationship_type, self, d, values=v)
+            items = [
+                dict(source=self, destination=d, values=v)
                 for d,v in zip(destinations, values)
             ]
-            return RelationshipSet(relationship_type, result)
+            return self._api.concepts.relationships.instances.create_bulk(self.dataset_id, relationship_type, items)
 
         # relationships (to records)
         if direction == 'to':
@@ -3502,10 +4036,14 @@ class Record(BaseRecord):
         """
         The ``Model`` of the current record.
 
+        Note:
+            The model is looked up in the session's model cache, which
+            expires after ``model_cache_ttl`` seconds.
+
         Returns:
            A single ``Model``.
         """
-        return self._api.concepts.get(self.dataset_id, self.type)
+        return self._api.concepts.get(self.dataset_id, self.type, use_cache=True)
 
     def update(self):
         """
@@ -3632,6 +4170,8 @@ class RelationshipProperty(BaseModelProperty):
 
 
 class RelationshipValue(BaseModelValue):
+    __slots__ = ()
+
     @as_native_str()
     def __repr__(self):
         return u"<RelationshipValue name='{}' value='{}' {}>".format(self.name, self.value, self.type)
@@ -3663,8 +4203,10 @@ class RelationshipType(BaseModelNode):
         raise Exception("Updating Relationships is not available at this time.")
 
     def delete(self):
-        raise Exception("Deleting Relationships is not available at this time.")
-        #TODO: self._api.concepts.relationships.delete(self.dataset_id, self)
+        """
+        Deletes the relationship type from the platform.
+        """
+        return self._api.concepts.relationships.delete(self.dataset_id, self)
 
     def get_all(self):
         """
@@ -3725,7 +4267,7 @@ class RelationshipType(BaseModelNode):
         Create multiple relationships between records using current relationship type.
 
         Args:
-            items (list): List of relationships to be created.
+            items (list or pd.DataFrame): Relationships to be created.
                 Each relationship should be either a dictionary or tuple.
 
                 If relationships are dictionaries, they are required to have
@@ -3735,11 +4277,19 @@ class RelationshipType(BaseModelNode):
                 ``values`` should be a dictionary with key/value pairs.
 
                 If relationships are tuples, they must be in the form
-                ``(source, dest)``.
+                ``(source, dest)``. A two-column array is also accepted.
+
+                If ``items`` is a DataFrame, it must have ``source``/``destination``
+                (or ``from``/``to``) columns; all other columns are used as values.
 
         Returns:
             Array of newly created ``Relationships`` objects
 
+        Note:
+            Relationships are created concurrently in batches. If some batches
+            fail, a ``RelationshipLoadError`` is raised; ``error.loader.run()``
+            retries only the relationships that were not created.
+
         Example:
 
             Create multiple relationships (dictionary format)::
@@ -3757,49 +4307,7 @@ class RelationshipType(BaseModelNode):
                 ])
         """
         self._check_exists()
-
-        # handle non-array
-        if isinstance(items, (dict, tuple)):
-            items = [items]
-
-        relations = []
-        for value in items:
-            # get source, destination, and values
-            if isinstance(value, tuple):
-                src, dest = value
-                vals = {}
-            elif isinstance(value, dict):
-                src  = value.get('from',value.get('source'))
-                dest = value.get('to',value.get('destination'))
-                vals = value.get('values',{})
-            else:
-                raise Exception("Expected relationship as tuple or dictionary, found {}".format(type(value)))
-
-            # Check sources and destinations
-            if not isinstance(src, (Record, DataPackage, string_types)):
-                raise Exception('source must be object of type Record, DataPackage, or UUID')
-            if not isinstance(dest, (Record, DataPackage, string_types)):
-                raise Exception('destination must be object of type Record, DataPackage, or UUID')
-
-            # create local relationship object
-            relations.append(
-                Relationship(
-                    dataset_id  = self.dataset_id,
-                    type        = self.type,
-                    source      = src,
-                    destination = dest,
-                    values     = [
-                        dict(
-                            name=k,
-                            value=v,
-                            dataType=self.schema.get(k).type
-                        )
-                        for k,v in vals.items()
-                    ]
-                )
-            )
-
-        return self._api.concepts.relationships.instances.create_many(self.dataset_id, self, *relations)
+        return self._api.concepts.relationships.instances.create_bulk(self.dataset_id, self, items)
 
     def as_dict(self):
         d = super(RelationshipType, self).as_dict()
@@ -3942,24 +4450,158 @@ class RecordSet(BaseInstanceList):
             pd.DataFrame
 
         """
-        cols = list(self.type.schema.keys())
+        return RecordTable.from_records(self.type, self).as_dataframe(record_id_column_name)
+
+
+def _typed_column(prop, values):
+    """
+    Convert a list of decoded values to an array typed by the property:
+    dates become datetime64, enums categorical (with any values outside
+    the enum as extra categories), and numbers/booleans
+    numeric when no values are missing.
+    """
+    prop_type = prop._type if prop is not None else None
+    if prop_type is None:
+        return np.array(values, dtype=object)
+
+    if isinstance(prop_type, ModelPropertyEnumType):
+        if prop_type.multi_select:
+            column = np.empty(len(values), dtype=object)
+            for i, v in enumerate(values):
+                column[i] = v
+            return column
+        if prop_type.enum:
+            # values outside the enum are kept as extra categories
+            categories = list(prop_type.enum)
+            known = set(categories)
+            for v in values:
+                if v is not None and v not in known:
+                    known.add(v)
+                    categories.append(v)
+            return pd.Categorical(values, categories=categories)
+
+    return _typed_array(prop_type.data_type, values)
+
+
+def _typed_array(data_type, values):
+    """
+    Convert a list of values of python type ``data_type`` to a typed array.
+    Values that do not convert (e.g. ``''`` in a number column) give an
+    object array instead.
+    """
+    try:
+        if data_type in (datetime.date, datetime.datetime):
+            return pd.to_datetime(values, utc=True)
+        elif data_type is float:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif data_type is bool and None not in values:
+            # numpy would convert any string to True
+            if all(isinstance(v, (bool, np.bool_)) for v in values):
+                return np.array(values, dtype=np.bool_)
+        elif data_type is int and None not in values:
+            return np.array(values, dtype=np.int64)
+        elif data_type is int:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    return np.array(values, dtype=object)
+
+
+class RecordTable(object):
+    """
+    Columnar storage for the records of a single ``Model``: one array of
+    record ids, and one typed array per model property.
+
+    Example::
+
+        table = RecordTable.from_json(mouse, response)
+        df = table.as_dataframe()
+    """
+    def __init__(self, model, ids, columns):
+        self.model = model
+        self.ids = ids
+        self.columns = columns
+
+    @classmethod
+    def _build(cls, model, ids, rows, decode=False):
+        """
+        ``rows`` yields ``(index, name, value)`` triples. If ``decode`` is
+        set, values are raw API values.
+        """
+        schema = model.schema
+        names = list(schema.keys())
+        columns = {name: [None] * len(ids) for name in names}
+        for i, name, value in rows:
+            column = columns.get(name)
+            if column is None:
+                if schema:
+                    continue
+                column = columns[name] = [None] * len(ids)
+                names.append(name)
+            column[i] = value
+
+        typed = OrderedDict()
+        for name in names:
+            prop = schema.get(name)
+            values = columns[name]
+            if decode and prop is not None and isinstance(prop._type, ModelPropertyEnumType) and prop._type.multi_select:
+                # scalar columns are converted in bulk by _typed_column
+                values = [prop._type._decode_value(v) for v in values]
+            typed[name] = _typed_column(prop, values)
+        return cls(model, np.array(ids, dtype=object), typed)
+
+    @classmethod
+    def from_json(cls, model, items):
+        """
+        Build a table straight from record JSON returned by the API,
+        decoding values with the model schema types.
+        """
+        ids = [item.get('id') for item in items]
+        rows = (
+            (i, v['name'], v['value'])
+            for i, item in enumerate(items)
+            for v in item.get('values', [])
+        )
+        return cls._build(model, ids, rows, decode=True)
 
+    @classmethod
+    def from_records(cls, model, records):
+        """
+        Build a table from ``Record`` objects.
+        """
+        ids = [r.id for r in records]
+        rows = (
+            (i, name, v.value)
+            for i, r in enumerate(records)
+            for name, v in r._values.items()
+        )
+        return cls._build(model, ids, rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def as_dataframe(self, record_id_column_name=None):
+        """
+        Convert the table to a pandas DataFrame, one column per property.
+
+        Args:
+            record_id_column_name (string): If set, a column with the desired
+                name will be prepended to this dataframe that contains record ids.
+        """
+        columns = OrderedDict()
         if record_id_column_name:
-            if record_id_column_name in cols:
+            if record_id_column_name in self.columns:
                 raise ValueError("There is already a column called '{}' in this data set.".format(
                     record_id_column_name
                 ))
-            cols.insert(0, record_id_column_name)
-
-        data = []
-        for instance in self:
-            values = dict(instance.values)
-            if record_id_column_name:
-                values[record_id_column_name] = instance.id
-            data.append(values)
+            columns[record_id_column_name] = self.ids
+        columns.update(self.columns)
+        return pd.DataFrame(columns, columns=list(columns))
 
-        df = pd.DataFrame(data=data, columns=cols)
-        return df
+    @as_native_str()
+    def __repr__(self):
+        return u"<RecordTable type='{}' records={}>".format(self.model.type, len(self))
 
 
 class RelationshipSet(BaseInstanceList):
@@ -3981,20 +4623,13 @@ class RelationshipSet(BaseInstanceList):
             - ``__destination__``: ID of the instance's destination
             - ``__type__``: Type of relationship that the instance is
         """
-        cols = ['__source__', '__destination__', '__type__']
-        cols.extend(self.type.schema.keys())
-
-        data = []
-        for instance in self:
-            d = {}
-            d['_type'] = self.type.type
-            d['_source'] = instance.source
-            d['_destination'] = instance.destination
-
-            for name, value in instance.values.items():
-                d[name] = value
-
-            data.append(d)
+        columns = OrderedDict([
+            ('__source__', [instance.source for instance in self]),
+            ('__destination__', [instance.destination for instance in self]),
+            ('__type__', [self.type.type] * len(self)),
+        ])
+        for name, prop in self.type.schema.items():
+            values = [instance.get(name) for instance in self]
+            columns[name] = _typed_column(prop, values)
 
-        df = pd.DataFrame(data=data, columns=cols)
-        return df
+        return pd.DataFrame(columns, columns=list(columns))
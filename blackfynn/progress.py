@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Progress tracking for file transfers.
+
+Transfers report through a ``ProgressCallback``, which only appends events to
+a queue, so byte callbacks (called by many threads, for every chunk) never
+wait on a lock. A single ``ProgressTracker`` thread folds the queued events
+into per-transfer counters at a fixed interval and hands the changed
+transfers to its sinks:
+
+- ``TerminalSink``: progress bars on a terminal
+- ``LoggingSink``: a log line when a transfer starts, completes or fails
+- ``CallbackSink``: calls a function for every updated transfer
+- ``MetricsSink``: counters, also in the Prometheus text format
+"""
+from __future__ import absolute_import, division, print_function
+from builtins import object
+
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import blackfynn.log as log
+
+logger = log.get_logger('blackfynn.progress')
+
+WAITING = 'WAITING'
+ACTIVE = 'UPLOADING'
+DONE = 'DONE'
+ERRORED = 'ERRORED'
+
+# event types
+_ADD, _BYTES, _DONE, _ERROR = range(4)
+
+
+class TransferProgress(object):
+    """
+    Progress of a single transfer.
+    """
+    __slots__ = ('key', 'name', 'size', 'transferred', 'state', 'error')
+
+    def __init__(self, key, name, size):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.transferred = 0
+        self.state = WAITING
+        self.error = None
+
+    @property
+    def progress(self):
+        if self.state == DONE or self.size == 0:
+            return 1.0
+        if not self.size:
+            return 0.0
+        return min(self.transferred / float(self.size), 1.0)
+
+    @property
+    def finished(self):
+        return self.state in (DONE, ERRORED)
+
+    def __repr__(self):
+        return u"<TransferProgress name='{}' state='{}' transferred={} size={}>".format(
+            self.name, self.state, self.transferred, self.size)
+
+
+class ProgressCallback(object):
+    """
+    Reports the progress of one transfer to a ``ProgressTracker``. Call it
+    with the number of bytes transferred (like a boto3 ``Callback``), and
+    ``done()`` or ``error(e)`` once the transfer ends.
+    """
+    __slots__ = ('key', '_events')
+
+    def __init__(self, key, events):
+        self.key = key
+        self._events = events
+
+    def __call__(self, bytes_amount):
+        # deque.append is atomic: no lock on the hot path
+        self._events.append((_BYTES, self.key, bytes_amount))
+
+    def done(self):
+        self._events.append((_DONE, self.key, None))
+
+    def error(self, exception=None):
+        self._events.append((_ERROR, self.key, exception))
+
+
+class ProgressTracker(object):
+    """
+    Aggregates the progress of many transfers and updates ``sinks`` every
+    ``interval`` seconds (only with the transfers that changed).
+
+    Example::
+
+        with ProgressTracker([TerminalSink()]) as tracker:
+            callback = tracker.add('/path/to/file', size)
+            s3.upload_file(..., Callback=callback)
+            callback.done()
+
+    """
+    def __init__(self, sinks=None, interval=0.2):
+        self.sinks = list(sinks or [])
+        self.interval = interval
+        self._transfers = OrderedDict()
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, name, size=None, key=None):
+        """
+        Start tracking a transfer of ``name`` (``size`` bytes); returns the
+        ``ProgressCallback`` to report its progress with.
+        """
+        if key is None:
+            key = str(uuid.uuid4())
+        self._events.append((_ADD, key, (name, size)))
+        return ProgressCallback(key, self._events)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='blackfynn-progress')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Apply all pending events, update the sinks one last time and stop.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        for sink in self.sinks:
+            sink.close(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # a broken sink must not break the transfers
+                logger.debug("Progress update failed: {}".format(e))
+
+    def flush(self):
+        """
+        Apply pending events now and pass the changed transfers to the sinks.
+        """
+        with self._lock:
+            changed = OrderedDict()
+            events = self._events
+            while events:
+                try:
+                    kind, key, value = events.popleft()
+                except IndexError:
+                    break
+                if kind == _ADD:
+                    t = self._transfers[key] = TransferProgress(key, value[0], value[1])
+                else:
+                    t = self._transfers[key]
+                    if kind == _BYTES:
+                        t.transferred += value
+                        if t.state == WAITING:
+                            t.state = ACTIVE
+                    elif kind == _DONE:
+                        t.state = DONE
+                    elif kind == _ERROR:
+                        t.state = ERRORED
+                        t.error = value
+                changed[key] = t
+
+            if changed:
+                changed = list(changed.values())
+                for sink in self.sinks:
+                    sink.update(self, changed)
+
+    @property
+    def transfers(self):
+        return list(self._transfers.values())
+
+    @property
+    def done(self):
+        return all(t.finished for t in self._transfers.values())
+
+    @property
+    def transferred(self):
+        return sum(t.transferred for t in self._transfers.values())
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Sinks
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class ProgressSink(object):
+    """
+    Receives progress updates from a ``ProgressTracker``. Sinks are only
+    called from the tracker thread.
+    """
+    def update(self, tracker, changed):
+        pass
+
+    def close(self, tracker):
+        pass
+
+
+class TerminalSink(ProgressSink):
+    """
+    Progress bars, one line per transfer.
+    """
+    def __init__(self, stream=None, width=16):
+        self.stream = stream or sys.stdout
+        self.width = width
+        self.lines_on_screen = 0
+
+    def _draw(self, tracker):
+        transfers = tracker.transfers
+        out = ["\033[F" * self.lines_on_screen]
+        for t in transfers:
+            progress = t.progress
+            out.append(' [ {bars}{dashes} ] {state:12s} {percent:05.1f}% {name}\n'.format(
+                bars = '#' * int(progress * self.width),
+                dashes = '-' * (self.width - int(progress * self.width)),
+                percent = progress * 100,
+                name = os.path.basename(t.name),
+                state = t.state))
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.lines_on_screen = len(transfers)
+
+    def update(self, tracker, changed):
+        self._draw(tracker)
+
+    def close(self, tracker):
+        self._draw(tracker)
+
+
+class LoggingSink(ProgressSink):
+    """
+    Logs when transfers start, complete or fail.
+    """
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or log.get_logger('blackfynn.progress')
+        self.level = level
+        self._states = {}
+
+    def update(self, tracker, changed):
+        for t in changed:
+            if self._states.get(t.key) == t.state:
+                continue
+            self._states[t.key] = t.state
+            if t.state == ACTIVE:
+                self.logger.log(self.level, "Uploading {}".format(t.name))
+            elif t.state == DONE:
+                self.logger.log(self.level, "Uploaded {} ({} bytes)".format(t.name, t.transferred))
+            elif t.state == ERRORED:
+                self.logger.error("Upload of {} failed: {}".format(t.name, t.error))
+
+
+class CallbackSink(ProgressSink):
+    """
+    Calls ``func(transfer)`` for every transfer that changed.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def update(self, tracker, changed):
+        for t in changed:
+            self.func(t)
+
+
+class MetricsSink(ProgressSink):
+    """
+    Aggregate counters of all transfers: see ``metrics()``, or
+    ``exposition()`` for the Prometheus text format.
+    """
+    def __init__(self, prefix='blackfynn_upload'):
+        self.prefix = prefix
+        self.started = time.time()
+        self._metrics = dict(
+            bytes_total=0, size_bytes=0, files_total=0,
+            files_active=0, files_done=0, files_errored=0)
+
+    def update(self, tracker, changed):
+        transfers = tracker.transfers
+        counts = dict((state, 0) for state in (WAITING, ACTIVE, DONE, ERRORED))
+        for t in transfers:
+            counts[t.state] += 1
+        self._metrics = dict(
+            bytes_total = tracker.transferred,
+            size_bytes = sum(t.size or 0 for t in transfers),
+            files_total = len(transfers),
+            files_active = counts[ACTIVE],
+            files_done = counts[DONE],
+            files_errored = counts[ERRORED])
+
+    def close(self, tracker):
+        self.update(tracker, [])
+
+    def metrics(self):
+        metrics = dict(self._metrics)
+        elapsed = time.time() - self.started
+        metrics['bytes_per_second'] = metrics['bytes_total'] / elapsed if elapsed > 0 else 0.0
+        return metrics
+
+    def exposition(self):
+        lines = []
+        for name, value in sorted(self.metrics().items()):
+            lines.append('{}_{} {}'.format(self.prefix, name, value))
+        return '\n'.join(lines) + '\n'
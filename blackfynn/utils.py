@@ -61,6 +61,12 @@ def is_decimal(s):
     except ValueError:
         return False
 
+def chunks(items, size):
+    """
+    Split a sequence into consecutive chunks of at most ``size`` items.
+    """
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
 # time-series helpers
 
 def infer_epoch_msecs(thing):
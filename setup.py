@@ -33,10 +33,14 @@ setup(
     package_dir={'blackfynn': 'blackfynn'},
     setup_requires=['cython'],
     install_requires = reqs,
+    extras_require = {
+        'arrow': ['pyarrow'],
+    },
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, <4.0',
     entry_points = {
         'console_scripts': [
             'bf_profile=blackfynn.cli.bf_profile:main',
+            'bf_download=blackfynn.cli.bf_download:main',
         ]
     },
     license = "",
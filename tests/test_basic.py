@@ -1,4 +1,6 @@
+import copy
 import datetime
+import gc
 import os
 
 import pytest
@@ -7,9 +9,19 @@ import requests
 from blackfynn import Blackfynn
 from blackfynn.base import UnauthorizedException
 # client library
-from blackfynn.models import BaseNode, DataPackage, Dataset, File
+from blackfynn.api.core import SearchAPI
+from blackfynn.api.data import DataAPI, DatasetsAPI, PackagesAPI
+from blackfynn.models import (
+    BaseNode,
+    Collection,
+    DataPackage,
+    Dataset,
+    File,
+    TimeSeriesAnnotation,
+    TimeSeriesAnnotationLayer
+)
 
-from .utils import get_test_client
+from .utils import get_offline_session, get_test_client
 
 
 def test_basenode(client, dataset):
@@ -21,6 +33,239 @@ def test_basenode(client, dataset):
     assert node1 != object()
     assert [node1, node2] == [node2, node1]
 
+def test_local_registry():
+    session = get_offline_session(lambda *a, **kw: None, max_local_objects=2)
+
+    def package(name):
+        return {'content': {'id': 'N:package:1', 'name': name, 'packageType': 'Text'}}
+
+    pkg = DataPackage.from_dict(package('one'), api=session)
+    again = DataPackage.from_dict(package('two'), api=session)
+    assert again is pkg
+    assert pkg.name == 'two'
+    assert session.core.get_local('N:package:1') is pkg
+
+    # same id, different type: not merged
+    dataset = Dataset.from_dict({'content': {'id': 'N:package:1', 'name': 'ds'}}, api=session)
+    assert dataset is not pkg
+    assert session.core.get_local('N:package:1') is dataset
+
+    # only the most recent objects are kept alive
+    for i in range(5):
+        TimeSeriesAnnotation.from_dict(
+            {'id': i, 'label': 'a', 'channelIds': [], 'start': 0, 'end': 1}, api=session)
+    del pkg, again, dataset
+    gc.collect()
+
+    stats = session.core.local_stats()
+    assert stats['size'] == stats['recent'] == 2
+    assert stats['hits'] == 1
+    assert stats['misses'] == 7
+    assert sorted(a.id for a in session.core.get_locals()) == [3, 4]
+
+
+def test_local_registry_merge():
+    session = get_offline_session(lambda *a, **kw: None)
+
+    collection = Collection.from_dict({
+        'content': {'id': 'N:collection:1', 'name': 'col', 'packageType': 'Collection',
+                    'state': 'READY'},
+        'owner': 'N:user:1',
+        'properties': [{'category': 'Blackfynn', 'properties': [
+            {'key': 'k', 'value': 'v', 'fixed': False, 'hidden': False, 'dataType': 'string'}]}],
+        'children': [{'content': {'id': 'N:package:1', 'name': 'a', 'packageType': 'Text'}}],
+    }, api=session)
+    assert len(collection._items) == 1
+
+    # partial payloads (e.g. search hits) do not wipe loaded state
+    again = Collection.from_dict(
+        {'content': {'id': 'N:collection:1', 'name': 'renamed', 'packageType': 'Collection'}},
+        api=session)
+    assert again is collection
+    assert collection.name == 'renamed'
+    assert collection.state == 'READY'
+    assert collection.owner_id == 'N:user:1'
+    assert [i.id for i in collection._items] == ['N:package:1']
+    assert collection.get_property('k').value == 'v'
+
+    # children in the payload replace the loaded items
+    Collection.from_dict({
+        'content': {'id': 'N:collection:1', 'name': 'renamed', 'packageType': 'Collection'},
+        'children': [{'content': {'id': 'N:package:2', 'name': 'b', 'packageType': 'Text'}}],
+    }, api=session)
+    assert [i.id for i in collection._items] == ['N:package:2']
+
+    # payload fields replace local values, also with null; properties in the
+    # payload replace the local ones
+    collection.parent = 'N:collection:9'
+    Collection.from_dict({
+        'content': {'id': 'N:collection:1', 'name': 'renamed', 'packageType': 'Collection',
+                    'state': None},
+        'parent': None,
+        'properties': [{'category': 'Blackfynn', 'properties': [
+            {'key': 'k2', 'value': 'v2', 'fixed': False, 'hidden': False, 'dataType': 'string'}]}],
+    }, api=session)
+    assert collection.state is None
+    assert collection.parent is None
+    assert collection.get_property('k') is None
+    assert collection.get_property('k2').value == 'v2'
+    assert collection.owner_id == 'N:user:1'
+
+    # integer ids are only unique per type
+    layer = TimeSeriesAnnotationLayer.from_dict(
+        {'id': 1, 'name': 'layer', 'time_series_id': 'N:package:3'}, api=session)
+    annotation = TimeSeriesAnnotation.from_dict(
+        {'id': 1, 'label': 'a', 'channelIds': [], 'start': 0, 'end': 1}, api=session)
+    assert session.core.get_local(layer) is layer
+    assert session.core.get_local(annotation) is annotation
+    assert TimeSeriesAnnotationLayer.from_dict(
+        {'id': 1, 'name': 'layer', 'time_series_id': 'N:package:3'}, api=session) is layer
+
+def test_walk():
+    def node(id, name, package_type, children=None):
+        d = {'content': {'id': id, 'name': name, 'packageType': package_type}}
+        if children is not None:
+            d['children'] = children
+        return d
+
+    # dataset -> a.txt, col1 -> (b.txt, col2 -> c.ts), col3 -> (empty)
+    tree = {
+        'N:dataset:1': node('N:dataset:1', 'ds', 'DataSet', [
+            node('N:package:1', 'a.txt', 'Text'),
+            node('N:collection:1', 'col1', 'Collection'),
+            node('N:collection:3', 'col3', 'Collection')]),
+        'N:collection:1': node('N:collection:1', 'col1', 'Collection', [
+            node('N:package:2', 'b.txt', 'Text'),
+            node('N:collection:2', 'col2', 'Collection')]),
+        'N:collection:2': node('N:collection:2', 'col2', 'Collection', [
+            node('N:package:3', 'c.ts', 'TimeSeries')]),
+        'N:collection:3': node('N:collection:3', 'col3', 'Collection', []),
+    }
+    requested = []
+
+    def responder(method, endpoint, **kwargs):
+        id = endpoint.strip('/').replace('%3A', ':')
+        requested.append(id)
+        return copy.deepcopy(tree[id])
+
+    session = get_offline_session(responder, DataAPI, DatasetsAPI, PackagesAPI)
+    ds = session.datasets.get('N:dataset:1')
+
+    del requested[:]
+    walked = sorted((path, item.name) for path, item in ds.walk(max_workers=3))
+    assert walked == [
+        ((), 'a.txt'), ((), 'col1'), ((), 'col3'),
+        (('col1',), 'b.txt'), (('col1',), 'col2'),
+        (('col1', 'col2'), 'c.ts')]
+    # every collection is fetched once per walk
+    assert sorted(requested) == sorted(tree)
+
+    assert [(p, i.name) for p, i in ds.walk(package_type='timeseries')] == [(('col1', 'col2'), 'c.ts')]
+    assert sorted(i.name for _, i in ds.walk(max_depth=1)) == ['a.txt', 'col1', 'col3']
+    assert sorted(i.name for _, i in ds.walk_packages(max_depth=2)) == ['a.txt', 'b.txt']
+
+    # changes made elsewhere show up in the next walk
+    tree['N:collection:3']['children'].append(node('N:package:4', 'd.txt', 'Text'))
+    assert (('col3',), 'd.txt') in [(p, i.name) for p, i in ds.walk()]
+
+    # without refresh, loaded collections are not fetched again
+    del requested[:]
+    assert len(list(ds.walk(refresh=False))) == 7
+    assert requested == []
+
+def test_dataset_name_index():
+    datasets = [
+        {'content': {'id': 'N:dataset:1', 'name': 'My Dataset'}},
+        {'content': {'id': 'N:dataset:2', 'name': 'other'}},
+    ]
+    calls = []
+
+    def responder(method, endpoint, **kwargs):
+        calls.append((method, endpoint))
+        if method == 'get':
+            return copy.deepcopy(datasets)
+        elif method == 'post':
+            return {'content': dict(kwargs['json'], id='N:dataset:3')}
+
+    session = get_offline_session(responder, DatasetsAPI)
+    assert session.datasets.get_by_name_or_id('my_dataset').id == 'N:dataset:1'
+    assert session.datasets.get_by_name_or_id('N:dataset:2').name == 'other'
+    assert session.datasets.get_by_name_or_id('OTHER').id == 'N:dataset:2'
+    assert len(calls) == 1
+
+    # a miss reloads the index
+    datasets.append({'content': {'id': 'N:dataset:4', 'name': 'new'}})
+    assert session.datasets.get_by_name_or_id('new').id == 'N:dataset:4'
+    assert session.datasets.get_by_name_or_id('missing') is None
+    assert len(calls) == 3
+
+    # created datasets are indexed; duplicate checks do not list datasets
+    created = session.datasets.create(Dataset('Created'))
+    assert created.id == 'N:dataset:3'
+    with pytest.raises(Exception):
+        session.datasets.create(Dataset('created'))
+    assert session.datasets.get_by_name_or_id('created') is created
+    with pytest.raises(Exception):
+        session.datasets.create(Dataset('other'))
+    assert calls[3:] == [('post', '')]
+
+def test_collection_name_index():
+    session = get_offline_session(lambda *a, **kw: None, DataAPI)
+    ds = Dataset('ds')
+    ds.id = 'N:dataset:1'
+    ds._api = session
+    pkgs = [DataPackage('a', 'Text'), DataPackage('b', 'Text'), DataPackage('a', 'PDF')]
+    for i, pkg in enumerate(pkgs):
+        pkg.id = 'N:package:{}'.format(i)
+    ds._items = list(pkgs)
+
+    assert ds.get_items_by_name('a') == [pkgs[0], pkgs[2]]
+    assert 'name' in ds._indexes
+    assert 'N:package:1' in ds
+    assert pkgs[1] in ds
+    assert 'N:package:9' not in ds
+
+    # renaming an item drops the name index, so it is found right away
+    pkgs[1].name = 'a'
+    assert 'name' not in ds._indexes
+    assert len(ds.get_items_by_name('a')) == 3
+    assert ds.get_items_by_name('b') == []
+
+    ds._items = pkgs[:1]
+    assert ds.get_items_by_name('a') == [pkgs[0]]
+    assert 'N:package:1' not in ds
+
+def test_search():
+    hits = [
+        {'id': 'N:dataset:1', 'name': 'ds'},
+        {'id': 'N:package:1', 'name': 'pkg', 'packageType': 'Text'},
+        {'id': 'N:collection:1', 'name': 'col', 'packageType': 'Collection'},
+    ]
+    gets = []
+
+    def responder(method, endpoint, base=None, **kwargs):
+        if base == '/search':
+            return copy.deepcopy(hits)
+        id = endpoint.strip('/').replace('%3A', ':')
+        gets.append(id)
+        hit = [h for h in hits if h['id'] == id][0]
+        return {'content': dict(hit, name=hit['name'] + ' (full)')}
+
+    session = get_offline_session(responder, SearchAPI, DatasetsAPI, PackagesAPI, max_request_workers=3)
+
+    assert session.search.query('x', raw=True) == hits
+
+    results = session.search.query('x')
+    assert [type(r) for r in results] == [Dataset, DataPackage, Collection]
+    assert [r.name for r in results] == ['ds (full)', 'pkg (full)', 'col (full)']
+    assert sorted(gets) == sorted(h['id'] for h in hits)
+
+    del gets[:]
+    results = session.search.query('x', hydrate=False)
+    assert [(type(r), r.id) for r in results] == [
+        (Dataset, 'N:dataset:1'), (DataPackage, 'N:package:1'), (Collection, 'N:collection:1')]
+    assert gets == []
+
 def test_update_dataset(client, dataset, session_id):
     # update name of dataset
     ds_name = 'Same Dataset, Different Name {}'.format(session_id)
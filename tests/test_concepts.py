@@ -1,16 +1,41 @@
+import copy
 import datetime
+import json as json_module
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from past.builtins import unicode  # Alias of str in Python 3
 
+import numpy as np
+import pandas as pd
 import pytest
+from requests.exceptions import ConnectTimeout, ReadTimeout
 
+from blackfynn.api.concepts import (
+    ModelCache,
+    ModelsAPI,
+    RecordCreateError,
+    RelationshipLoadError
+)
 from blackfynn.models import (
     DataPackage,
+    Model,
     ModelProperty,
     ModelPropertyEnumType,
     ModelPropertyType,
+    Record,
+    RecordSet,
+    RecordTable,
+    Relationship,
+    RelationshipProperty,
+    RelationshipSet,
+    RelationshipType,
+)
+from tests.utils import (
+    create_test_dataset,
+    current_ts,
+    get_offline_session,
+    get_test_client
 )
-from tests.utils import create_test_dataset, current_ts, get_test_client
 
 
 @pytest.mark.parametrize('from_type,blackfynn_type,data_type', [
@@ -40,6 +65,316 @@ def test_model_type_from_dict(json, data_type, format, unit):
     assert decoded.unit == unit
 
 
+def test_model_cache():
+    cache = ModelCache(ttl=60)
+    model = Model(dataset_id='N:dataset:1', name='patient', id='model-1')
+    cache.set_model(model)
+    cache.set('schema', 'N:dataset:1', 'model-1', ([], {}))
+    assert cache.get('model', 'N:dataset:1', 'patient') is model
+    assert cache.get('model', 'N:dataset:1', 'model-1') is model
+    assert cache.get('model', 'N:dataset:2', 'patient') is None
+
+    # invalidating by type also drops entries keyed by id
+    cache.invalidate('N:dataset:1', 'patient')
+    assert cache.get('model', 'N:dataset:1', 'model-1') is None
+    assert cache.get('schema', 'N:dataset:1', 'model-1') is None
+
+    # expired entries are not returned
+    cache.ttl = -1
+    cache.set_model(model)
+    assert cache.get('model', 'N:dataset:1', 'patient') is None
+
+    # caching disabled
+    cache.ttl = 0
+    cache.set_model(model)
+    assert cache.get('model', 'N:dataset:1', 'patient') is None
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+def test_record_cursor(prefetch):
+    records = [
+        {'id': str(i), 'type': 'patient', 'values': [{'name': 'n', 'value': i, 'dataType': 'long'}]}
+        for i in range(250)
+    ]
+    requested = []
+
+    def responder(method, endpoint, params=None, **kwargs):
+        requested.append(params['offset'])
+        return [dict(r) for r in records[params['offset']:params['offset'] + params['limit']]]
+
+    session = get_offline_session(responder, ModelsAPI)
+    model = Model(dataset_id='N:dataset:1', name='patient', id='model-1',
+                  schema=[ModelProperty('n', data_type=int, title=True)])
+    cursor = session.concepts.instances.iter_all('N:dataset:1', model, page_size=100, prefetch=prefetch)
+
+    assert [r.get('n') for r in cursor] == list(range(250))
+    assert set(requested[:3]) == set([0, 100, 200])
+
+    frames = list(cursor.as_dataframes())
+    assert [len(df) for df in frames] == [100, 100, 50]
+    assert list(frames[2]['n']) == list(range(200, 250))
+
+
+def test_create_records_from_dataframe():
+    posted = []
+
+    def responder(method, endpoint, json=None, **kwargs):
+        assert method == 'post' and endpoint.endswith('/instances/batch')
+        if any(v['values'][0]['value'] == 'fail' for v in json):
+            raise Exception('batch rejected')
+        posted.append(json)
+        return [{'id': 'record-{}'.format(v['values'][0]['value']), 'type': 'patient', 'values': v['values']} for v in json]
+
+    session = get_offline_session(responder, ModelsAPI, max_records_per_chunk=2)
+    model = Model(dataset_id='N:dataset:1', name='patient', id='model-1', schema=[
+        ModelProperty('name', data_type=str, title=True),
+        ModelProperty('age', data_type=int),
+        ModelProperty('born', data_type=datetime.datetime),
+        ModelProperty('sex', data_type=ModelPropertyEnumType(data_type=str, enum=['F', 'M'])),
+    ])
+
+    df = pd.DataFrame({
+        'name': ['a', 'b', 'c', 'fail', 'e'],
+        'age': [1, 2, None, 4, 5],
+        'born': ['2019-01-01', '2019-01-02', None, '2019-01-04', '2019-01-05'],
+        'sex': ['F', 'M', 'F', 'M', None],
+    }, index=[10, 11, 12, 13, 14])
+    result = session.concepts.instances.create_from_dataframe('N:dataset:1', model, df)
+
+    assert list(result.index) == [10, 11, 12, 13, 14]
+    assert list(result['id']) == ['record-a', 'record-b', None, None, 'record-e']
+    assert list(result['error'].notnull()) == [False, False, True, True, False]
+
+    # missing values are omitted, and values are encoded by type
+    first, last = posted[0][0]['values'], posted[-1][0]['values']
+    assert dict((v['name'], v['value']) for v in first) == {
+        'name': 'a', 'age': 1, 'born': '2019-01-01T00:00:00.000000+00:00', 'sex': 'F'}
+    assert [v['name'] for v in last] == ['name', 'age', 'born']
+
+    bad = pd.DataFrame({'name': ['a', 'b', 'c'], 'age': ['1', 'two', 1.5], 'sex': ['F', 'X', 'M']})
+    with pytest.raises(Exception) as e:
+        session.concepts.instances.create_from_dataframe('N:dataset:1', model, bad)
+    assert "'age' has invalid values in rows [1, 2]" in str(e.value)
+    assert "'sex' has invalid values in rows [1]" in str(e.value)
+
+
+def test_create_records_retries():
+    calls = []
+
+    def responder(method, endpoint, json=None, **kwargs):
+        calls.append(json[0]['values'][0]['value'])
+        name = json[0]['values'][0]['value']
+        if name == 'unreachable' and calls.count(name) == 1:
+            raise ConnectTimeout('not sent')
+        if name == 'slow':
+            raise ReadTimeout('sent, but no response')
+        return [{'id': 'record-{}'.format(v['values'][0]['value']), 'type': 'patient', 'values': v['values']} for v in json]
+
+    session = get_offline_session(responder, ModelsAPI, max_records_per_chunk=1)
+    model = Model(dataset_id='N:dataset:1', name='patient', id='model-1', schema=[
+        ModelProperty('name', data_type=str, title=True),
+    ])
+    model._api = session
+
+    # requests that could not be sent are retried
+    records = model.create_records([{'name': 'unreachable'}, {'name': 'a'}])
+    assert [r.id for r in records] == ['record-unreachable', 'record-a']
+    assert calls.count('unreachable') == 2
+
+    # requests that may have been received are not, and the records
+    # created by the other batches are kept
+    with pytest.raises(RecordCreateError) as e:
+        model.create_records([{'name': 'b'}, {'name': 'slow'}, {'name': 'c'}])
+    assert calls.count('slow') == 1
+    assert [r.id for r in e.value.records] == ['record-b', 'record-c']
+    assert len(e.value.errors) == 1
+
+
+def test_bulk_relationship_loader():
+    fail = set(['r3'])
+    calls = []
+
+    def responder(method, endpoint, json=None, **kwargs):
+        if endpoint.endswith('/instances/batch'):
+            calls.append('batch')
+            if any(r['from'] in fail for r in json):
+                raise Exception('batch rejected')
+            return [[dict(r, id='rel-' + r['from'], type='has')] for r in json]
+        elif '/proxy/package/instances' in endpoint:
+            calls.append('proxy')
+            return [{'relationshipInstance': {
+                'id': 'rel-' + json['externalId'], 'type': 'has',
+                'from': json['externalId'], 'to': json['conceptInstanceId']}}]
+        raise AssertionError(endpoint)
+
+    session = get_offline_session(responder, ModelsAPI, max_records_per_chunk=2)
+    relationship = RelationshipType(dataset_id='N:dataset:1', name='has', id='rt-1')
+    relationship._api = session
+    items = pd.DataFrame({
+        'source': ['r1', 'r2', 'r3', 'r4', 'N:package:1'],
+        'destination': ['d1', 'd2', 'd3', 'd4', 'model-record'],
+    })
+    session.concepts.cache.set_model(Model(dataset_id='N:dataset:1', name='patient', id='model-1'))
+    relationship.destination = 'model-1'
+
+    with pytest.raises(RelationshipLoadError) as e:
+        relationship.create(items)
+    loader = e.value.loader
+    assert sorted(calls) == ['batch', 'batch', 'proxy']
+    assert [r.source for r in loader.relationships] == ['r1', 'r2', 'N:package:1']
+
+    # resuming only resubmits the failed batch
+    fail.clear()
+    created = loader.run()
+    assert sorted(calls) == ['batch', 'batch', 'batch', 'proxy']
+    assert [r.source for r in created] == ['r1', 'r2', 'r3', 'r4', 'N:package:1']
+
+
+def test_bulk_relationships_from_numpy_columns():
+    sent = []
+
+    def responder(method, endpoint, json=None, **kwargs):
+        # the payload must be JSON serializable
+        json = json_module.loads(json_module.dumps(json))
+        if '/proxy/package/instances' in endpoint:
+            sent.append(json)
+            return [{'relationshipInstance': {
+                'id': 'rel-' + json['externalId'], 'type': 'has',
+                'from': json['externalId'], 'to': json['conceptInstanceId']}}]
+        sent.extend(json)
+        return [[dict(r, id='rel-' + r['from'], type='has')] for r in json]
+
+    session = get_offline_session(responder, ModelsAPI)
+    relationship = RelationshipType(dataset_id='N:dataset:1', name='has', id='rt-1', schema=[
+        RelationshipProperty('count', data_type=int),
+        RelationshipProperty('weight', data_type=float),
+        RelationshipProperty('ok', data_type=bool),
+        RelationshipProperty('rank', data_type=float),
+    ])
+    relationship._api = session
+    session.concepts.cache.set_model(Model(dataset_id='N:dataset:1', name='patient', id='model-1'))
+    relationship.destination = 'model-1'
+    items = pd.DataFrame({
+        'from': ['r1', 'r2', 'N:package:1'],
+        'to': ['d1', 'd2', 'model-record'],
+        'count': np.array([1, 2, 3], dtype=np.int64),
+        # numpy scalars in an object column are not converted by pandas
+        'rank': pd.Series([np.int64(1), np.int32(2), np.float32(3)], dtype=object),
+        'weight': np.array([0.5, np.nan, 1.5]),
+        'ok': np.array([True, False, True]),
+    })
+
+    relationship.create(items)
+    values = [{v['name']: v['value'] for v in r['values']} for r in sent[:2]]
+    assert values == [
+        {'count': 1, 'weight': 0.5, 'ok': True, 'rank': 1},
+        {'count': 2, 'ok': False, 'rank': 2}]
+    # values of relationships to packages are sent as they are
+    proxy_values = sent[2]['targets'][0]['relationshipData']
+    assert {v['name']: v['value'] for v in proxy_values} == {
+        'count': 3, 'weight': 1.5, 'ok': True, 'rank': 3}
+
+
+def test_relationship_type_registry():
+    calls = []
+    posted = []
+
+    listed = [{'id': 'rt-1', 'name': 'has', 'type': 'relationship'}]
+
+    def responder(method, endpoint, json=None, **kwargs):
+        calls.append((method, endpoint))
+        if method == 'get' and endpoint.endswith('/relationships'):
+            return copy.deepcopy(listed)
+        elif method == 'post':
+            posted.append(json)
+            listed.append(dict(json, id='rt-{}'.format(len(posted) + 1), type='relationship'))
+            return copy.deepcopy(listed[-1])
+        elif method == 'delete':
+            del listed[[r['id'] for r in listed].index(endpoint.split('/')[-1])]
+            return None
+        raise AssertionError(endpoint)
+
+    session = get_offline_session(responder, ModelsAPI)
+    registry = session.concepts.relationships
+    session.concepts.cache.set_model(Model(dataset_id='N:dataset:1', name='patient', id='model-1'))
+
+    assert registry.get_or_create('N:dataset:1', 'has').id == 'rt-1'
+    assert registry.get_or_create('N:dataset:1', 'has').id == 'rt-1'
+    assert len(calls) == 1
+
+    # concurrent callers only create the relationship type once
+    with ThreadPoolExecutor(max_workers=8) as e:
+        created = list(e.map(lambda _: registry.get_or_create('N:dataset:1', 'treats', source='patient'), range(8)))
+    assert set(r.id for r in created) == set(['rt-2'])
+    assert posted[0]['from'] == 'model-1'
+    assert [c[0] for c in calls].count('post') == 1
+
+    registry.invalidate_cache('N:dataset:1')
+    registry.get_or_create('N:dataset:1', 'has')
+    assert [c[0] for c in calls].count('get') == 3
+
+    # deleted types are created again
+    has = registry.get_or_create('N:dataset:1', 'has')
+    has.delete()
+    assert registry.get_or_create('N:dataset:1', 'has').id == 'rt-3'
+    assert [c[0] for c in calls].count('post') == 2
+
+    # types deleted elsewhere are gone after a fresh listing
+    del listed[:]
+    registry.get_all('N:dataset:1')
+    assert registry.get_or_create('N:dataset:1', 'treats').id == 'rt-4'
+
+
+def test_record_table_typed_columns():
+    model = Model(dataset_id='N:dataset:1', name='patient', id='model-1', schema=[
+        ModelProperty('name', data_type=str, title=True),
+        ModelProperty('age', data_type=int),
+        ModelProperty('born', data_type=datetime.datetime),
+        ModelProperty('sex', data_type=ModelPropertyEnumType(data_type=str, enum=['F', 'M'])),
+        ModelProperty('scores', data_type=ModelPropertyEnumType(data_type=int, multi_select=True)),
+    ])
+    items = [
+        {'id': 'r1', 'values': [
+            {'name': 'name', 'value': 'a', 'dataType': 'string'},
+            {'name': 'age', 'value': 3, 'dataType': 'long'},
+            {'name': 'born', 'value': '2019-01-01T00:00:00.000000+00:00', 'dataType': 'date'},
+            {'name': 'sex', 'value': 'F', 'dataType': 'string'},
+            {'name': 'scores', 'value': [1, 2], 'dataType': {'type': 'array', 'items': {'type': 'long'}}}]},
+        {'id': 'r2', 'values': [
+            {'name': 'name', 'value': 'b', 'dataType': 'string'},
+            {'name': 'sex', 'value': 'M', 'dataType': 'string'}]},
+    ]
+    df = RecordTable.from_json(model, items).as_dataframe('record_id')
+
+    assert list(df.columns) == ['record_id', 'name', 'age', 'born', 'sex', 'scores']
+    assert list(df['record_id']) == ['r1', 'r2']
+    assert str(df['born'].dtype).startswith('datetime64')
+    assert str(df['sex'].dtype) == 'category'
+    assert list(df['sex'].cat.categories) == ['F', 'M']
+    assert df['age'].isnull().tolist() == [False, True]
+    assert df['scores'][0] == [1, 2]
+
+    records = RecordSet(model, [Record.from_dict(dict(item, dataset_id='N:dataset:1', type='patient')) for item in items])
+    assert records.as_dataframe().equals(df.drop('record_id', axis=1))
+
+    # values outside the enum are not lost
+    items[1]['values'][1]['value'] = 'X'
+    df = RecordTable.from_json(model, items).as_dataframe()
+    assert list(df['sex']) == ['F', 'X']
+    assert list(df['sex'].cat.categories) == ['F', 'M', 'X']
+
+
+def test_relationship_set_as_dataframe():
+    relationship = RelationshipType(dataset_id='N:dataset:1', name='has', id='rt-1',
+                                    schema=[RelationshipProperty('weight', data_type=float)])
+    relationships = RelationshipSet(relationship, [
+        Relationship(dataset_id='N:dataset:1', type='has', source='r1', destination='r2',
+                     values=[{'name': 'weight', 'value': 0.5, 'dataType': 'double'}]),
+    ])
+    df = relationships.as_dataframe()
+    assert df.to_dict('records') == [{'__source__': 'r1', '__destination__': 'r2', '__type__': 'has', 'weight': 0.5}]
+
+
 def test_model_with_invalid_properties(dataset):
     invalid_schema = [('an_integer', int, 'An Integer')]
     new_model = dataset.create_model(
@@ -475,6 +810,17 @@ def test_get_topology(simple_graph):
     assert 'relationships' in topology
     assert len(topology['relationships']) == 1
 
+
+def test_lazy_model_schemas(simple_graph):
+    models = simple_graph.dataset.models(lazy=True)
+    assert len(models) == 2
+    model = models['Model_A']
+    assert model._schema is None
+    assert 'prop1' in model.schema
+
+    topology = simple_graph.dataset.get_topology(lazy=True)
+    assert all('prop1' in m.schema for m in topology['models'])
+
 def test_get_graph_summary(simple_graph):
     summary = simple_graph.dataset.get_graph_summary()
     expected_fields = ["modelCount", "modelRecordCount", "modelSummary",
@@ -1,10 +1,49 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
 import uuid
 import pytest
 
+from requests.exceptions import HTTPError
+from websocket import WebSocketTimeoutException
+from botocore.exceptions import ClientError
 from pkg_resources import resource_filename
 
-from blackfynn.models import TimeSeries
-from blackfynn.api.agent import AgentError
+from blackfynn.config import Settings
+from blackfynn.manifest import HashManifest, UploadManifest, hash_file
+from blackfynn.models import Dataset, TimeSeries
+from blackfynn.api import agent
+from blackfynn.api.agent import AgentError, UploadManager
+from blackfynn.api.core import SecurityAPI
+from blackfynn.api.data import DataAPI, DatasetsAPI, PackagesAPI
+from blackfynn.api.transfers import (
+    MAX_PARTS,
+    MIN_CHUNK_SIZE,
+    IOAPI,
+    MultipartUpload,
+    UploadError,
+    RangedDownload,
+    DownloadError,
+    download_file,
+    get_file_sizes,
+    get_s3_client,
+    upload_file
+)
+
+from blackfynn.progress import (
+    CallbackSink,
+    LoggingSink,
+    MetricsSink,
+    ProgressTracker,
+    TerminalSink
+)
+
+from .utils import get_offline_session
 
 
 def _resource_path(fname):
@@ -163,3 +202,782 @@ def test_append(dataset, append_args, n_files):
 @pytest.mark.agent
 def test_progress_for_empty_files(dataset):
     dataset.upload(FILE_EMPTY, display_progress=True)
+
+
+@pytest.fixture
+def s3():
+    moto = pytest.importorskip('moto')
+    mock = getattr(moto, 'mock_aws', None) or moto.mock_s3
+    with mock():
+        client = get_s3_client('', '', 'us-east-1', 'key', 'secret', 'token')
+        client.create_bucket(Bucket='bucket')
+        yield client
+
+
+def test_s3_clients_are_reused(s3):
+    assert get_s3_client('', '', 'us-east-1', 'key', 'secret', 'token') is s3
+    assert get_s3_client('', '', 'us-east-1', 'key2', 'secret', 'token') is not s3
+
+
+def test_multipart_upload_resumes(s3, tmpdir):
+    data = os.urandom(MIN_CHUNK_SIZE * 2 + 1024)
+    path = str(tmpdir.join('big.bin'))
+    with open(path, 'wb') as f:
+        f.write(data)
+    state_dir = str(tmpdir.join('uploads'))
+
+    uploaded = []
+    fail = [True]
+    upload_part = s3.upload_part
+
+    def failing_upload_part(**kwargs):
+        if kwargs['PartNumber'] == 3 and fail[0]:
+            raise ClientError({'Error': {'Code': '500', 'Message': 'boom'}}, 'UploadPart')
+        uploaded.append(kwargs['PartNumber'])
+        return upload_part(**kwargs)
+
+    s3.upload_part = failing_upload_part
+    progress = []
+
+    def upload(key, chunk_size=MIN_CHUNK_SIZE):
+        MultipartUpload(
+            s3, path, 'bucket', key, chunk_size=chunk_size,
+            concurrency=1, retries=0, state_dir=state_dir,
+            callback=progress.append).upload()
+
+    def pending():
+        return s3.list_multipart_uploads(Bucket='bucket').get('Uploads', [])
+
+    with pytest.raises(ClientError):
+        upload('import1/key')
+    assert uploaded == [1, 2]
+    assert len(os.listdir(state_dir)) == 1
+
+    # a re-run (new import, new key) only uploads the missing part and
+    # moves the completed object to the new key
+    fail[0] = False
+    del uploaded[:], progress[:]
+    upload('import2/key')
+    assert uploaded == [3]
+    assert sum(progress) == len(data)
+    assert os.listdir(state_dir) == []
+    assert pending() == []
+
+    obj = s3.get_object(Bucket='bucket', Key='import2/key')
+    assert obj['Body'].read() == data
+    keys = [o['Key'] for o in s3.list_objects_v2(Bucket='bucket')['Contents']]
+    assert keys == ['import2/key']
+
+    # uploads superseded by a different chunk size are aborted
+    fail[0] = True
+    with pytest.raises(ClientError):
+        upload('import3/key')
+    assert len(pending()) == 1
+    fail[0] = False
+    del uploaded[:]
+    upload('import3/key', chunk_size=MIN_CHUNK_SIZE * 2)
+    assert uploaded == [1, 2]
+    assert pending() == []
+    assert os.listdir(state_dir) == []
+
+
+def test_multipart_upload_part_count(s3, tmpdir):
+    path = str(tmpdir.join('big.bin'))
+    with open(path, 'wb') as f:
+        f.truncate(MAX_PARTS * MIN_CHUNK_SIZE + 1)
+    upload = MultipartUpload(s3, path, 'bucket', 'key', chunk_size=MIN_CHUNK_SIZE)
+    # raised to whole MiB, to stay within the part limit
+    assert upload.chunk_size == MIN_CHUNK_SIZE + 1024 * 1024
+    assert upload.num_parts <= MAX_PARTS
+
+
+def test_multipart_upload_keeps_object_when_copy_fails(s3, tmpdir):
+    data = os.urandom(MIN_CHUNK_SIZE + 1024)
+    path = str(tmpdir.join('big.bin'))
+    with open(path, 'wb') as f:
+        f.write(data)
+    s3.put_object(Bucket='bucket', Key='import1/key', Body=data)
+
+    upload = MultipartUpload(s3, path, 'bucket', 'import2/key', chunk_size=MIN_CHUNK_SIZE)
+    head_object = s3.head_object
+    s3.head_object = lambda **kwargs: dict(head_object(**kwargs), ContentLength=10)
+    try:
+        with pytest.raises(Exception):
+            upload._move('import1/key')
+    finally:
+        s3.head_object = head_object
+    assert s3.get_object(Bucket='bucket', Key='import1/key')['Body'].read() == data
+
+
+def test_upload_file(s3, tmpdir):
+    path = str(tmpdir.join('small.txt'))
+    with open(path, 'wb') as f:
+        f.write(b'hello')
+
+    metrics = MetricsSink()
+    with ProgressTracker([metrics]) as tracker:
+        key = upload_file(
+            path, '', '', 'bucket', 'base', 'us-east-1', 'key', 'secret', 'token',
+            None, progress=tracker.add(path, 5))
+    assert key == 'base/small.txt'
+    assert tracker.transfers[0].progress == 1
+    assert tracker.transfers[0].state == 'DONE'
+    assert metrics.metrics()['bytes_total'] == 5
+    assert s3.get_object(Bucket='bucket', Key=key)['Body'].read() == b'hello'
+
+
+def test_upload_completes_import_groups(tmpdir, monkeypatch):
+    files = []
+    for name in ['a1', 'a2', 'b1', 'c1']:
+        path = str(tmpdir.join(name))
+        with open(path, 'w') as f:
+            f.write(name)
+        files.append(path)
+    completed = []
+
+    def responder(method, endpoint, **kwargs):
+        if endpoint.startswith('/files/upload/preview'):
+            # one import group per leading letter
+            groups = {}
+            for f in kwargs['json']['files']:
+                groups.setdefault(f['fileName'][0], []).append(dict(uploadId=f['uploadId']))
+            return {'packages': [dict(importId=k, files=v) for k, v in groups.items()]}
+        elif endpoint.startswith('/files/upload/complete'):
+            completed.append(kwargs['params']['importId'])
+            return kwargs['params']['importId']
+        elif endpoint.startswith('/user/credentials/upload'):
+            return {
+                'tempCredentials': dict(region='us-east-1', accessKey='key',
+                                        secretKey='secret', sessionToken='token'),
+                's3Bucket': 'bucket', 's3Key': 'base', 'encryptionKeyId': None}
+
+    def fake_upload_file(file, *args, **kwargs):
+        if os.path.basename(file) == 'b1':
+            kwargs['progress'].error()
+            raise Exception('upload failed')
+        kwargs['progress'](len(os.path.basename(file)))
+        kwargs['progress'].done()
+        return file
+
+    monkeypatch.setattr('blackfynn.api.transfers.upload_file', fake_upload_file)
+    session = get_offline_session(responder, IOAPI, SecurityAPI)
+    dataset = Dataset('ds', id='N:dataset:1')
+
+    states = {}
+    with pytest.raises(UploadError) as e:
+        session.io.upload_files(dataset, files, use_agent=False,
+                                progress=lambda t: states.update({t.name: t.state}))
+    assert states == {f: 'ERRORED' if f == files[2] else 'DONE' for f in files}
+
+    # the group with the failed file is not completed, the others are
+    assert sorted(completed) == ['a', 'c']
+    assert sorted(e.value.results) == ['a', 'c']
+    assert list(e.value.errors) == [files[2]]
+
+
+def test_batched_preview(tmpdir):
+    files = []
+    for name in ['a.nev', 'a.ns2', 'b.txt', 'c.txt', 'd.txt'] + ['e{}.txt'.format(i) for i in range(10)]:
+        path = str(tmpdir.join(name))
+        with open(path, 'w') as f:
+            f.write(name)
+        files.append(path)
+    batches = []
+
+    def responder(method, endpoint, **kwargs):
+        batch = kwargs['json']['files']
+        batches.append([f['fileName'] for f in batch])
+        return {'packages': [
+            dict(importId=f['fileName'], files=[dict(uploadId=f['uploadId'])])
+            for f in batch
+        ]}
+
+    assert get_file_sizes(files) == {f: len(os.path.basename(f)) for f in files}
+
+    session = get_offline_session(responder, IOAPI, upload_preview_batch_size=3)
+    import_id_map = session.io.get_preview(files, append=False)
+    assert import_id_map == {f: os.path.basename(f) for f in files}
+
+    batched = {}
+    for batch_map in session.io.iter_preview(files, append=False):
+        assert len(batch_map) <= 3
+        batched.update(batch_map)
+    assert batched == import_id_map
+    assert all(len(batch) <= 3 for batch in batches)
+    # files with the same name are previewed together
+    assert ['a.nev', 'a.ns2'] in [batch[:2] for batch in batches]
+
+
+class _Server(object):
+    """
+    Local HTTP server for ``data``, with optional Range and ETag support.
+    """
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = self
+        self.data = b''
+        self.etag = '"v1"'
+        self.ranges = True
+        self.fail = set()
+        self.flaky = set()
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                data, header = server.data, self.headers.get('Range')
+                server.requests.append(header)
+                if header is None or not server.ranges:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                if self.headers.get('If-Match', server.etag) != server.etag:
+                    self.send_response(412)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if not data:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = [int(x) for x in header.split('=')[1].split('-')]
+                if start in server.fail or start in server.flaky:
+                    server.flaky.discard(start)
+                    self.send_response(500)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('ETag', server.etag)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(data[start:end + 1])
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/file?signature=abc'.format(self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever).start()
+
+
+@pytest.fixture
+def http_server():
+    server = _Server()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def test_ranged_download(http_server, tmpdir):
+    http_server.data = os.urandom(10 * 1000 + 7)
+    path = str(tmpdir.join('file.bin'))
+    progress = []
+
+    assert download_file(http_server.url, path, chunk_size=1000, max_workers=4,
+                         callback=progress.append) == path
+    with open(path, 'rb') as f:
+        assert f.read() == http_server.data
+    assert sum(progress) == len(http_server.data)
+    assert sorted(os.listdir(str(tmpdir))) == ['file.bin']
+    # probe + 11 ranges
+    assert len(http_server.requests) == 12
+
+
+def test_ranged_download_resumes(http_server, tmpdir):
+    http_server.data = os.urandom(5000)
+    path = str(tmpdir.join('file.bin'))
+
+    http_server.fail = {3000}
+    with pytest.raises(HTTPError):
+        RangedDownload(http_server.url, path, chunk_size=1000, max_workers=1, retries=0).download()
+    assert not os.path.exists(path)
+    assert os.path.exists(path + '.part.json')
+
+    # only the failed range is fetched again
+    http_server.fail = set()
+    del http_server.requests[:]
+    progress = []
+    download_file(http_server.url, path, chunk_size=1000, retries=0, callback=progress.append)
+    assert http_server.requests == ['bytes=0-0', 'bytes=3000-3999']
+    assert sum(progress) == len(http_server.data)
+    with open(path, 'rb') as f:
+        assert f.read() == http_server.data
+    assert not os.path.exists(path + '.part.json')
+
+
+def test_ranged_download_retries_server_errors(http_server, tmpdir):
+    http_server.data = os.urandom(3000)
+    http_server.flaky = {0, 2000}
+    path = str(tmpdir.join('file.bin'))
+
+    download_file(http_server.url, path, chunk_size=1000, max_workers=1, retries=1)
+    # the probe and the range starting at 2000 are retried once
+    assert http_server.requests.count('bytes=0-0') == 2
+    assert http_server.requests.count('bytes=2000-2999') == 2
+    with open(path, 'rb') as f:
+        assert f.read() == http_server.data
+
+
+def test_ranged_download_empty(http_server, tmpdir):
+    path = str(tmpdir.join('empty.bin'))
+
+    assert download_file(http_server.url, path, chunk_size=1000) == path
+    assert http_server.requests == ['bytes=0-0']
+    assert os.path.getsize(path) == 0
+    assert sorted(os.listdir(str(tmpdir))) == ['empty.bin']
+
+
+def test_ranged_download_restarts_when_changed(http_server, tmpdir):
+    http_server.data = os.urandom(3000)
+    path = str(tmpdir.join('file.bin'))
+
+    http_server.fail = {2000}
+    with pytest.raises(HTTPError):
+        download_file(http_server.url, path, chunk_size=1000, max_workers=1, retries=0)
+
+    http_server.fail = set()
+    http_server.data = os.urandom(3000)
+    http_server.etag = '"v2"'
+    del http_server.requests[:]
+    download_file(http_server.url, path, chunk_size=1000)
+    assert len(http_server.requests) == 4
+    with open(path, 'rb') as f:
+        assert f.read() == http_server.data
+
+
+def test_download_without_ranges(http_server, tmpdir):
+    http_server.data = os.urandom(3000)
+    http_server.ranges = False
+    path = str(tmpdir.join('file.bin'))
+
+    download_file(http_server.url, path, chunk_size=1000)
+    assert http_server.requests == ['bytes=0-0']
+    with open(path, 'rb') as f:
+        assert f.read() == http_server.data
+
+
+def test_dataset_download(http_server, tmpdir):
+    http_server.data = os.urandom(2500)
+
+    def node(id, name, package_type, children=None):
+        d = {'content': {'id': id, 'name': name, 'packageType': package_type}}
+        if children is not None:
+            d['children'] = children
+        return d
+
+    def source(id, key, size):
+        return {'content': {'id': id, 'name': key, 's3bucket': 'bucket', 's3key': 'org/' + key,
+                            'size': size, 'fileType': 'Data'}}
+
+    tree = {
+        'N:dataset:1': node('N:dataset:1', 'ds', 'DataSet', [
+            node('N:package:1', 'a', 'Unknown'),
+            node('N:collection:1', 'col', 'Collection'),
+            # same name as N:collection:1
+            node('N:collection:2', 'col', 'Collection')]),
+        'N:collection:1': node('N:collection:1', 'col', 'Collection', [
+            node('N:package:4', 'b', 'Unknown'),
+            node('N:package:3', 'c', 'Unknown'),
+            node('N:package:2', 'b', 'Unknown')]),
+        'N:collection:2': node('N:collection:2', 'col', 'Collection', [
+            node('N:package:5', 'd', 'Unknown')]),
+    }
+    sources = {
+        'N:package:1': [source(1, 'a.bin', 2500)],
+        'N:package:2': [source(2, 'b.bin', 2500), source(3, 'b.txt', 2500)],
+        'N:package:3': [source(4, 'c.bin', 2500)],
+        # same package and file name as N:package:2
+        'N:package:4': [source(5, 'b.bin', 2500)],
+        'N:package:5': [source(6, 'd.bin', 2500)],
+    }
+    url_batches = []
+
+    def responder(method, endpoint, **kwargs):
+        parts = endpoint.strip('/').replace('%3A', ':').split('/')
+        if parts[0] in tree:
+            return copy.deepcopy(tree[parts[0]])
+        elif parts == ['files', 'urls']:
+            files = kwargs['json']['files']
+            url_batches.append(sorted(f['fileId'] for f in files))
+            return [dict(f, url=http_server.url) for f in files]
+        elif parts[1] == 'sources':
+            if parts[0] == 'N:package:3':
+                raise Exception('listing failed')
+            return copy.deepcopy(sources[parts[0]])
+        raise Exception('unexpected request: {} {}'.format(method, endpoint))
+
+    session = get_offline_session(
+        responder, DataAPI, DatasetsAPI, PackagesAPI, IOAPI,
+        download_chunk_size=1, download_url_batch_size=2)
+    ds = session.datasets.get('N:dataset:1')
+    dest = str(tmpdir.join('ds'))
+
+    # existing files with the right size are skipped
+    os.makedirs(os.path.join(dest, 'col', 'b'))
+    with open(os.path.join(dest, 'col', 'b', 'b.txt'), 'wb') as f:
+        f.write(http_server.data)
+
+    done = []
+    with pytest.raises(DownloadError) as e:
+        ds.download(dest, parallel=2, max_bandwidth=100 * 1024 * 1024,
+                    callback=lambda f, path, downloaded: done.append((path, downloaded)))
+    assert list(e.value.errors) == ['N:package:3']
+    assert sorted(e.value.results) == sorted(path for path, _ in done)
+    # same-named siblings are numbered by id, whatever the listing order
+    assert sorted((os.path.relpath(p, dest), d) for p, d in done) == [
+        (os.path.join('a', 'a.bin'), True),
+        (os.path.join('col (2)', 'd', 'd.bin'), True),
+        (os.path.join('col', 'b (2)', 'b.bin'), True),
+        (os.path.join('col', 'b', 'b.bin'), True),
+        (os.path.join('col', 'b', 'b.txt'), False)]
+    # URLs are requested in batches, only for the files that are downloaded
+    assert all(len(batch) <= 2 for batch in url_batches)
+    assert sorted(sum(url_batches, [])) == [1, 2, 5, 6]
+    for path, _ in done:
+        with open(path, 'rb') as f:
+            assert f.read() == http_server.data
+
+
+def test_progress_tracker():
+    import logging
+
+    stream = io.StringIO()
+    metrics = MetricsSink()
+    updates = []
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    progress_logger = logging.getLogger('test_progress_tracker')
+    progress_logger.addHandler(Handler())
+    progress_logger.setLevel(logging.INFO)
+
+    sinks = [TerminalSink(stream=stream), LoggingSink(progress_logger), CallbackSink(updates.append), metrics]
+    with ProgressTracker(sinks, interval=0.01) as tracker:
+        a = tracker.add('/data/a.bin', 4000)
+        b = tracker.add('/data/b.bin', 1000)
+
+        # many threads reporting bytes at once
+        threads = [threading.Thread(target=lambda: [a(1) for _ in range(1000)]) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        a.done()
+        b(10)
+        b.error(Exception('boom'))
+
+    assert tracker.done
+    assert [(t.name, t.state, t.transferred) for t in tracker.transfers] == [
+        ('/data/a.bin', 'DONE', 4000), ('/data/b.bin', 'ERRORED', 10)]
+    assert updates[-1].state in ('DONE', 'ERRORED')
+
+    m = metrics.metrics()
+    assert (m['bytes_total'], m['size_bytes'], m['files_done'], m['files_errored']) == (4010, 5000, 1, 1)
+    assert 'blackfynn_upload_files_done 1\n' in metrics.exposition()
+
+    assert 'Uploaded /data/a.bin (4000 bytes)' in records
+    assert 'Upload of /data/b.bin failed: boom' in records
+    assert 'DONE' in stream.getvalue() and 'b.bin' in stream.getvalue()
+
+
+class _FakeAgentSocket(object):
+    """
+    Stands in for the agent websocket: answers every ``queue_upload``
+    request with the messages produced by ``respond``.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.messages = deque()
+        self.closed = False
+
+    def send(self, data):
+        request = json.loads(data)
+        self.requests.append(request)
+        self.messages.extend(json.dumps(m) for m in self.respond(request))
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self):
+        try:
+            return self.messages.popleft()
+        except IndexError:
+            time.sleep(0.01)
+            raise WebSocketTimeoutException()
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeAgentListener(object):
+    def __init__(self, *args):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _agent_responder(other=False):
+    """
+    Queues and completes every file of a request, one import per file.
+    """
+    count = [0]
+
+    def respond(request):
+        assert request['message'] == 'queue_upload'
+        if other:
+            # a file queued by another process shows up as well
+            yield dict(message='upload_progress', path='/other', import_id='other',
+                       percent_done=50, done=False)
+        imports = []
+        for f in request['body']['files']:
+            count[0] += 1
+            import_id = 'import-{}'.format(count[0])
+            imports.append((f, import_id))
+            yield dict(message='file_queued_for_upload', path=f, import_id=import_id)
+        for f, import_id in imports:
+            for percent in (10, 50, 100):
+                yield dict(message='upload_progress', path=f, import_id=import_id,
+                           percent_done=percent, done=percent == 100)
+            yield dict(message='upload_complete', import_id=import_id)
+    return respond
+
+
+def test_agent_upload_progress(tmpdir, monkeypatch):
+    files = [os.path.abspath(str(tmpdir.join('f{}'.format(i)))) for i in range(2000)]
+    for f in files:
+        open(f, 'w').close()
+
+    socket = _FakeAgentSocket(_agent_responder(other=True))
+    managers = []
+
+    class Manager(UploadManager):
+        def __init__(self, *args, **kwargs):
+            kwargs.update(frame_interval=3600, stream=io.StringIO())
+            super(Manager, self).__init__(*args, **kwargs)
+            self.draws = 0
+            managers.append(self)
+
+        def print_progress(self, *args, **kwargs):
+            last_draw = self._last_draw
+            super(Manager, self).print_progress(*args, **kwargs)
+            self.draws += self._last_draw is not last_draw
+
+    monkeypatch.setattr(agent, 'AgentListener', _FakeAgentListener)
+    monkeypatch.setattr(agent, 'create_agent_socket', lambda port: socket)
+    monkeypatch.setattr(agent, 'UploadManager', Manager)
+
+    agent.agent_upload(Dataset('ds', id='N:dataset:1'), files, dataset=None, append=False,
+                       recursive=False, display_progress=True,
+                       settings=Settings(overrides=dict(agent_queue_batch_size=500)))
+
+    manager = managers[0]
+    assert socket.closed
+    assert manager.done
+    # files are queued in batches
+    assert [len(r['body']['files']) for r in socket.requests] == [500] * 4
+    assert all(p.done and p.percent_done == 100 for p in manager.all_tracked_files() if p.ours)
+    assert manager.get_tracked_file(files[5], 'import-6').import_id == 'import-6'
+    assert manager.get_tracked_file(files[5], None) is None
+    assert not manager.get_tracked_file('/other', 'other').ours
+    # redraws are coalesced: the first frame and the final one
+    assert manager.draws == 2
+    assert manager.stream.getvalue().count('DONE') == len(files)
+
+
+def test_plan_upload(tmpdir):
+    root = tmpdir.mkdir('root')
+    for path in ['a.txt', 'b.csv', 'skip/c.txt', 'sub/d.txt', 'sub/deeper/e.csv']:
+        root.join(path).ensure()
+    root = str(root)
+
+    def plan(*args, **kwargs):
+        return sorted(os.path.relpath(p, root) for p, _ in agent.plan_upload([root], *args, **kwargs))
+
+    assert plan() == ['a.txt', 'b.csv']
+    assert plan(recursive=True) == sorted([
+        'a.txt', 'b.csv', os.path.join('skip', 'c.txt'), os.path.join('sub', 'd.txt'),
+        os.path.join('sub', 'deeper', 'e.csv')])
+    assert plan(recursive=True, include='*.csv') == ['b.csv', os.path.join('sub', 'deeper', 'e.csv')]
+    assert plan(recursive=True, exclude=['skip', '*.csv']) == ['a.txt', os.path.join('sub', 'd.txt')]
+
+
+def test_agent_upload_manifest(tmpdir, monkeypatch):
+    directory = tmpdir.mkdir('dir')
+    for name in ['a.txt', 'b.txt', 'c.csv']:
+        directory.join(name).write(name)
+    manifest = str(tmpdir.join('manifest'))
+
+    socket = _FakeAgentSocket(_agent_responder())
+    monkeypatch.setattr(agent, 'AgentListener', _FakeAgentListener)
+    monkeypatch.setattr(agent, 'create_agent_socket', lambda port: socket)
+
+    def upload():
+        del socket.requests[:]
+        agent.agent_upload(Dataset('ds', id='N:dataset:1'), [str(directory)], dataset=None,
+                           append=False, recursive=False, display_progress=False,
+                           settings=Settings(), exclude='*.csv', manifest=manifest)
+        return sorted(os.path.basename(f) for r in socket.requests for f in r['body']['files'])
+
+    assert upload() == ['a.txt', 'b.txt']
+    assert len(UploadManifest(manifest)) == 2
+
+    # only new and modified files are uploaded again
+    directory.join('b.txt').write('changed')
+    os.utime(str(directory.join('b.txt')), (0, 0))
+    directory.join('d.txt').write('new')
+    assert upload() == ['b.txt', 'd.txt']
+    assert upload() == []
+
+
+def test_agent_upload_recursive(tmpdir, monkeypatch):
+    directory = tmpdir.mkdir('dir')
+    for path in ['a.txt', 'sub/b.txt', 'sub/deeper/c.txt']:
+        directory.join(path).ensure()
+    respond = _agent_responder()
+
+    def respond_recursive(request):
+        # the agent lists the directory itself
+        assert request['body']['recursive']
+        files = [os.path.join(d, f) for d, _, fs in os.walk(request['body']['files'][0]) for f in fs]
+        request['body']['files'] = files
+        return respond(request)
+
+    socket = _FakeAgentSocket(respond_recursive)
+    monkeypatch.setattr(agent, 'AgentListener', _FakeAgentListener)
+    monkeypatch.setattr(agent, 'create_agent_socket', lambda port: socket)
+
+    agent.agent_upload(Dataset('ds', id='N:dataset:1'), [str(directory)], dataset=None,
+                       append=False, recursive=True, display_progress=False,
+                       settings=Settings(overrides=dict(agent_queue_batch_size=1)))
+    assert len(socket.requests) == 1
+    assert socket.requests[0]['body']['recursive']
+
+    with pytest.raises(AgentError):
+        agent.agent_upload(Dataset('ds', id='N:dataset:1'), [str(directory)], dataset=None,
+                           append=False, recursive=True, display_progress=False,
+                           settings=Settings(), include='*.txt')
+
+
+def test_hash_manifest(tmpdir):
+    paths = []
+    for i in range(5):
+        path = str(tmpdir.join('f{}'.format(i)))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000 + i))
+        paths.append(path)
+    with open(paths[0], 'rb') as f:
+        assert hash_file(paths[0], chunk_size=64) == 'sha256:' + hashlib.sha256(f.read()).hexdigest()
+    empty = str(tmpdir.join('empty'))
+    open(empty, 'w').close()
+    assert hash_file(empty) == 'sha256:' + hashlib.sha256(b'').hexdigest()
+
+    db = str(tmpdir.join('manifest', 'uploads.db'))
+
+    def pending(scope='N:dataset:1'):
+        with HashManifest(db, scope=scope, batch_size=2) as manifest:
+            return sorted(os.path.basename(p) for p, _ in
+                          manifest.filter((p, os.stat(p)) for p in paths))
+
+    with HashManifest(db, scope='N:dataset:1') as manifest:
+        for path in paths[:4]:
+            manifest.add(path)
+    assert len(HashManifest(db, scope='N:dataset:1')) == 4
+    assert pending() == ['f4']
+    assert pending(scope='N:dataset:2') == ['f0', 'f1', 'f2', 'f3', 'f4']
+
+    # touched, but not modified
+    os.utime(paths[1], (0, 0))
+    # modified, same size and modification time: trusted to be unchanged
+    stat = os.stat(paths[2])
+    with open(paths[2], 'wb') as f:
+        f.write(os.urandom(1002))
+    os.utime(paths[2], (stat.st_atime, stat.st_mtime))
+    # modified, same size
+    with open(paths[3], 'wb') as f:
+        f.write(os.urandom(1003))
+    os.utime(paths[3], (1, 1))
+
+    assert pending() == ['f3', 'f4']
+    assert pending() == ['f3', 'f4']
+
+    # hashed (with its size and mtime) when the upload starts: later changes
+    # are not recorded as uploaded
+    with HashManifest(db, scope='N:dataset:1') as manifest:
+        manifest.prepare(paths[4])
+        manifest._prepared[paths[4]].result()
+        with open(paths[4], 'wb') as f:
+            f.write(os.urandom(1004))
+        os.utime(paths[4], (2, 2))
+        manifest.add(paths[4])
+    assert pending() == ['f3', 'f4']
+
+
+def test_hash_file_without_mmap(tmpdir, monkeypatch):
+    path = str(tmpdir.join('f'))
+    with open(path, 'wb') as f:
+        f.write(os.urandom(1000))
+    expected = hash_file(path)
+    monkeypatch.setattr('blackfynn.manifest.PY2', True)
+    assert hash_file(path, chunk_size=64) == expected
+
+
+def test_upload_manifest(tmpdir, monkeypatch):
+    files = []
+    for name in ['a', 'b', 'c']:
+        path = str(tmpdir.join(name))
+        with open(path, 'w') as f:
+            f.write(name)
+        files.append(path)
+    uploaded = []
+
+    def responder(method, endpoint, **kwargs):
+        if endpoint.startswith('/files/upload/preview'):
+            return {'packages': [
+                dict(importId=f['fileName'], files=[dict(uploadId=f['uploadId'])])
+                for f in kwargs['json']['files']]}
+        elif endpoint.startswith('/files/upload/complete'):
+            return kwargs['params']['importId']
+        elif endpoint.startswith('/user/credentials/upload'):
+            return {
+                'tempCredentials': dict(region='us-east-1', accessKey='key',
+                                        secretKey='secret', sessionToken='token'),
+                's3Bucket': 'bucket', 's3Key': 'base', 'encryptionKeyId': None}
+
+    def fake_upload_file(file, *args, **kwargs):
+        uploaded.append(os.path.basename(file))
+        return file
+
+    monkeypatch.setattr('blackfynn.api.transfers.upload_file', fake_upload_file)
+    session = get_offline_session(
+        responder, IOAPI, SecurityAPI, blackfynn_dir=str(tmpdir.join('bf')))
+    dataset = Dataset('ds', id='N:dataset:1')
+
+    def upload():
+        del uploaded[:]
+        session.io.upload_files(dataset, files, use_agent=False, manifest=True)
+        return sorted(uploaded)
+
+    assert upload() == ['a', 'b', 'c']
+    assert upload() == []
+    with open(files[1], 'w') as f:
+        f.write('changed')
+    assert upload() == ['b']
+    assert os.path.exists(str(tmpdir.join('bf', 'upload_manifest.db')))
@@ -1,4 +1,15 @@
-from blackfynn.models import _get_all_class_args
+import pickle
+
+from blackfynn.models import (
+    Dataset,
+    Property,
+    Record,
+    TimeSeriesAnnotation,
+    TimeSeriesChannel,
+    _copy_state,
+    _get_all_class_args,
+    _get_field_map
+)
 from builtins import object
 
 def test_get_all_class_args():
@@ -11,3 +22,67 @@ def test_get_all_class_args():
             pass
 
     assert _get_all_class_args(B) == set(['self', 'x', 'y', 'z', 'args', 'kwargs'])
+
+
+def test_field_map():
+    class A(object):
+        def __init__(self, name, package_type, s3_bucket, **kwargs):
+            pass
+
+    field_map = _get_field_map(A)
+    assert field_map['NAME'] == 'name'
+    assert field_map['packageType'] == 'package_type'
+    assert field_map['s3bucket'] == 's3_bucket'
+    assert field_map['unknownKey'] == 'unknownKey'
+
+    # resolved once per class
+    assert _get_field_map(A) is field_map
+    assert 'packageType' in field_map
+
+
+def test_slotted_models():
+    record = Record.from_dict({
+        'id': 'N:record:1',
+        'type': 'patient',
+        'datasetId': 1,
+        'values': [
+            {'name': 'age', 'value': '4', 'dataType': 'long'},
+            {'name': 'weight', 'value': 2.5, 'dataType': 'Double'},
+        ]})
+    annotation = TimeSeriesAnnotation.from_dict({
+        'id': 1, 'label': 'spike', 'channelIds': ['N:channel:1'],
+        'start': 10, 'end': 20, 'layerId': 2, 'userId': 3})
+    channel = TimeSeriesChannel('ch', rate=100)
+    prop = Property('key', 'value')
+
+    for item in (record, annotation, channel, prop) + tuple(record._values.values()):
+        assert not hasattr(item, '__dict__')
+
+    assert record.values == {'age': 4, 'weight': 2.5}
+    assert record._api is None
+    assert annotation.user_id == 3
+    assert annotation.as_dict()['channelIds'] == ['N:channel:1']
+    assert channel.as_dict()['rate'] == 100
+
+    # plain property types are shared between values
+    other = Record.from_dict({
+        'id': 'N:record:2', 'type': 'patient', 'datasetId': 1,
+        'values': [{'name': 'age', 'value': 5, 'dataType': 'long'}]})
+    assert other._values['age'].data_type is record._values['age'].data_type
+
+    copied = pickle.loads(pickle.dumps(record))
+    assert copied.id == record.id
+    assert copied.values == record.values
+
+    # state is copied from both slots and __dict__
+    created = TimeSeriesChannel('ch', rate=200)
+    created.id = 'N:channel:1'
+    _copy_state(channel, created)
+    assert channel.id == 'N:channel:1'
+    assert channel.rate == 200
+
+    dataset, other_dataset = Dataset('a'), Dataset('b')
+    other_dataset.id = 'N:dataset:1'
+    other_dataset.int_id = 1
+    _copy_state(dataset, other_dataset)
+    assert (dataset.id, dataset.int_id, dataset.name) == ('N:dataset:1', 1, 'b')
@@ -1,10 +1,16 @@
 import pdb
+import threading
 
+import numpy as np
+import pandas as pd
 import pytest
 
 from blackfynn import Tabular, TabularSchema
+from blackfynn.api.data import TabularAPI
 from blackfynn.models import TabularSchemaColumn
 
+from .utils import get_offline_session
+
 
 def test_tabular(client, dataset):
     """
@@ -42,3 +48,180 @@ def test_tabular(client, dataset):
     assert t.exists
     a = t.get_schema()
     assert a.exists
+
+
+def _tabular_responder(n_rows, requests_made):
+    schema = dict(name='schema', id='N:schema:1', columns=[
+        dict(name='__id', displayName='', datatype='Integer', primaryKey=True, internal=True),
+        dict(name='a', displayName='A', datatype='Integer', primaryKey=False, internal=False),
+        dict(name='b', displayName='', datatype='String', primaryKey=False, internal=False),
+    ])
+    lock = threading.Lock()
+
+    def responder(method, endpoint, **kwargs):
+        if endpoint == '/N%3Apackage%3A1/schema':
+            return schema
+        assert endpoint == '/N%3Apackage%3A1'
+        params = kwargs['params']
+        with lock:
+            requests_made.append((params['offset'], params['limit']))
+        end = min(params['offset'] + params['limit'], n_rows)
+        return dict(rows=[
+            {'__id': i, 'a': i, 'b': str(i)} for i in range(params['offset'], end)])
+
+    return responder
+
+
+def test_tabular_data_limit():
+    requests_made = []
+    session = get_offline_session(
+        _tabular_responder(100, requests_made), TabularAPI, tabular_prefetch_chunks=3)
+    t = Tabular('t', id='N:package:1')
+    t._api = session
+
+    df = t.get_data(limit=25, offset=10)
+    assert list(df.columns) == ['A', 'b']
+    assert list(df.A) == list(range(10, 35))
+    assert list(df.index) == list(range(25))
+    assert requests_made == [(10, 25)]
+
+    # only the rows within the limit are requested
+    del requests_made[:]
+    chunks = list(t.get_data_iter(chunk_size=10, limit=25))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert sorted(requests_made) == [(0, 10), (10, 10), (20, 5)]
+
+
+def test_tabular_data_iter_prefetch():
+    requests_made = []
+    session = get_offline_session(
+        _tabular_responder(95, requests_made), TabularAPI, tabular_prefetch_chunks=4)
+    t = Tabular('t', id='N:package:1')
+    t._api = session
+
+    chunks = list(t.get_data_iter(chunk_size=10))
+    assert [len(c) for c in chunks] == [10] * 9 + [5]
+    df = session.tabular.get_tabular_data(t, limit=None, offset=0, order_by=None, order_direction='ASC')
+    assert list(df.A) == list(range(95))
+
+    # the table ends in a full chunk: no empty chunk
+    session = get_offline_session(
+        _tabular_responder(40, []), TabularAPI, tabular_prefetch_chunks=4)
+    t._api = session
+    assert [len(c) for c in t.get_data_iter(chunk_size=10)] == [10] * 4
+
+    # empty tables still have columns
+    session = get_offline_session(
+        _tabular_responder(0, []), TabularAPI)
+    t._api = session
+    chunks = list(t.get_data_iter(chunk_size=10))
+    assert len(chunks) == 1 and len(chunks[0]) == 0
+
+
+def _typed_session(rows, extra_columns=()):
+    schema = dict(name='schema', id='N:schema:1', columns=[
+        dict(name='__id', displayName='', datatype='Integer', primaryKey=True, internal=True),
+        dict(name='n', displayName='count', datatype='Integer', primaryKey=False, internal=False),
+        dict(name='x', displayName='', datatype='Double', primaryKey=False, internal=False),
+        dict(name='ok', displayName='', datatype='Boolean', primaryKey=False, internal=False),
+        dict(name='t', displayName='', datatype='DateTime', primaryKey=False, internal=False),
+        dict(name='s', displayName='', datatype='String', primaryKey=False, internal=False),
+    ] + [
+        dict(name=name, displayName='', datatype=datatype, primaryKey=False, internal=False)
+        for name, datatype in extra_columns
+    ])
+
+    def responder(method, endpoint, **kwargs):
+        if endpoint.endswith('/schema'):
+            return schema
+        params = kwargs['params']
+        return dict(rows=rows[params['offset']:params['offset'] + params['limit']])
+
+    return get_offline_session(responder, TabularAPI)
+
+
+_ROWS = [
+    {'__id': 0, 'n': 1, 'x': 0.5, 'ok': True, 't': '2019-01-01T00:00:00Z', 's': 'a'},
+    {'__id': 1, 'n': 2, 'x': None, 'ok': False, 't': '2019-01-02T00:00:00Z', 's': None},
+    {'__id': 2, 'n': None, 'x': 2, 'ok': True, 't': None, 's': 'c'},
+]
+
+
+def test_tabular_typed_columns():
+    t = Tabular('t', id='N:package:1')
+    t._api = _typed_session(_ROWS)
+
+    first, second = t.get_data_iter(chunk_size=2)
+    assert list(first.columns) == ['count', 'x', 'ok', 't', 's']
+    assert first['count'].dtype == 'Int64'
+    assert first['ok'].dtype == 'boolean'
+    assert first['x'].dtype == np.float64 and np.isnan(first['x'][1])
+    assert first['t'][1] == pd.Timestamp('2019-01-02', tz='UTC')
+    assert first['s'].dtype == object
+    # missing integers
+    assert second['count'].dtype == 'Int64' and pd.isnull(second['count'][0])
+    assert pd.isnull(second['t'][0])
+
+
+def test_tabular_chunk_dtypes():
+    # the second chunk has no integers, booleans or dates at all
+    rows = _ROWS[:2] + [{'__id': 2}, {'__id': 3, 's': ''}]
+    t = Tabular('t', id='N:package:1')
+    t._api = _typed_session(rows)
+
+    first, second = t.get_data_iter(chunk_size=2)
+    assert list(first.dtypes) == list(second.dtypes)
+    df = t._api.tabular.get_tabular_data(t, limit=None, offset=0, order_by=None, order_direction='ASC')
+    assert list(df.dtypes) == list(first.dtypes)
+    assert list(df['count'][:2]) == [1, 2] and df['count'][2:].isnull().all()
+
+
+_MIXED_ROWS = [
+    {'__id': 0, 'n': 1, 'x': '', 'ok': 'yes', 't': 'never', 's': 'a', 'u': {'k': 1}},
+    {'__id': 1, 'n': 2, 'x': 1.5, 'ok': True, 't': None, 's': 'b', 'u': None},
+]
+
+
+def test_tabular_unconverted_columns():
+    t = Tabular('t', id='N:package:1')
+    t._api = _typed_session(_MIXED_ROWS, extra_columns=[('u', 'Json')])
+
+    df, = t.get_data_iter(chunk_size=2)
+    assert df['count'].dtype == 'Int64'
+    # empty strings are missing values
+    assert df['x'].dtype == np.float64 and np.isnan(df['x'][0])
+    # values that do not match the column type are kept as they are
+    for column in ['ok', 't', 'u']:
+        assert df[column].dtype == object
+    assert list(df['ok']) == ['yes', True]
+    assert df['u'][0] == {'k': 1}
+
+
+def test_tabular_arrow_unknown_types():
+    pa = pytest.importorskip('pyarrow')
+    t = Tabular('t', id='N:package:1')
+    rows = [{'__id': 0, 'n': 1, 'x': '', 'u': {'k': 1}}, {'__id': 1, 'x': 1.5, 'u': None}]
+    t._api = _typed_session(rows, extra_columns=[('u', 'Json')])
+
+    batch, = t.get_data_iter(chunk_size=2, output='arrow')
+    assert batch.schema.field('u').type == pa.string()
+    assert batch.column(5).to_pylist() == [str({'k': 1}), None]
+    assert batch.column(1).to_pylist() == [None, 1.5]
+
+
+def test_tabular_arrow(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    t = Tabular('t', id='N:package:1')
+    t._api = _typed_session(_ROWS)
+
+    batches = list(t.get_data_iter(chunk_size=2, output='arrow'))
+    assert [b.num_rows for b in batches] == [2, 1]
+    # same schema for every chunk, with nulls instead of casts
+    assert batches[0].schema == batches[1].schema
+    assert batches[1].column(0).to_pylist() == [None]
+
+    path = str(tmpdir.join('t.parquet'))
+    assert t.to_parquet(path, chunk_size=2) == 3
+    table = pq.read_table(path)
+    assert table.column_names == ['count', 'x', 'ok', 't', 's']
+    assert table.column('count').to_pylist() == [1, 2, None]
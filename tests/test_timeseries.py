@@ -1,11 +1,21 @@
+import copy
 import datetime
 import pdb
+import struct
 
+import numpy as np
+import pandas as pd
 import pytest
+from requests.exceptions import ConnectTimeout
 
 from blackfynn import TimeSeries, TimeSeriesChannel
+from blackfynn.api.timeseries import TimeSeriesAPI, _stream_columns
+from blackfynn.cache.cache import read_segment
+from blackfynn.cache.cache_segment_pb2 import CacheSegment
 from blackfynn.models import TimeSeriesAnnotation, TimeSeriesAnnotationLayer
 
+from .utils import get_offline_session
+
 
 @pytest.fixture()
 def timeseries(client, dataset):
@@ -396,3 +406,108 @@ def test_timeseries_segments(client, timeseries):
 
     with pytest.raises(Exception):
         ch.segments(gap_factor="should be int")
+
+
+def test_stream_data():
+    channels = [dict(
+        content=dict(id='N:channel:1', name='ch1', rate=100.0, start=0, end=0,
+                     unit='V', channelType='CONTINUOUS'),
+        properties=[])]
+    bodies = []
+    failures = [ConnectTimeout('not sent')]
+
+    def responder(method, endpoint, **kwargs):
+        if endpoint == '/N%3Apackage%3A1/channels' and method == 'get':
+            return copy.deepcopy(channels)
+        if endpoint == '/N%3Apackage%3A1/channels' and method == 'post':
+            content = dict(kwargs['json'], id='N:channel:{}'.format(len(channels) + 1))
+            channels.append(dict(content=content, properties=[]))
+            return copy.deepcopy(channels[-1])
+        if endpoint == '/N%3Apackage%3A1/data' and method == 'post':
+            assert kwargs['headers']['Content-Type'] == 'application/octet-stream'
+            if failures:
+                raise failures.pop()
+            bodies.append(kwargs['data'])
+            return {}
+        raise AssertionError((method, endpoint))
+
+    def received():
+        segments = {}
+        for body in bodies:
+            offset = 0
+            while offset < len(body):
+                size, = struct.unpack('>I', body[offset:offset + 4])
+                segment = CacheSegment.FromString(body[offset + 4:offset + 4 + size])
+                segments.setdefault(segment.channelId, []).append(segment)
+                offset += 4 + size
+        return segments
+
+    session = get_offline_session(
+        responder, TimeSeriesAPI, stream_chunk_size=40, stream_batch_size=0.001,
+        max_request_timeout_retries=1)
+    ts = TimeSeries('ts', id='N:package:1')
+    ts._api = session
+
+    index = pd.date_range('2020-01-01', periods=100, freq='10ms')
+    df = pd.DataFrame(dict(ch1=np.arange(100.0), ch2=-np.arange(100.0)), index=index)
+    ch1, ch2 = ts.stream_data(df)
+
+    # missing channel is created, with the rate of the samples
+    assert (ch1.id, ch2.id) == ('N:channel:1', 'N:channel:2')
+    assert channels[1]['content']['name'] == 'ch2'
+    assert channels[1]['content']['rate'] == pytest.approx(100.0)
+    assert ch1.start == ch2.start == index[0].value // 1000
+    assert ch1.end == ch2.end == index[-1].value // 1000
+
+    # chunks of at most 40 samples, in several requests (after a retry)
+    assert not failures
+    assert len(bodies) > 1
+    segments = received()
+    for ch, column in [(ch1, 'ch1'), (ch2, 'ch2')]:
+        series = [read_segment(ch, s.SerializeToString()) for s in segments[ch.id]]
+        assert max(len(s) for s in series) == 40
+        series = pd.concat(series).sort_index()
+        assert (series.index == index).all()
+        assert (series.values == df[column].values).all()
+
+    # one channel per column
+    with pytest.raises(ValueError):
+        ts.stream_data(df, channels=['ch1'])
+    with pytest.raises(ValueError):
+        ts.stream_data(df['ch1'], channels=['ch1', 'ch2'])
+
+    # arrays are placed at `rate` from `start`
+    with pytest.raises(ValueError):
+        ts.stream_data(np.zeros((10, 2)), channels=['ch1', 'ch2'])
+    del bodies[:]
+    start = ch1.end + 10000
+    ts.stream_data(np.ones(10), channels='ch1', rate=100, start=start)
+    series = read_segment(ch1, received()['N:channel:1'][0].SerializeToString())
+    assert series.index[0].value // 1000 == start
+    assert series.index[-1].value // 1000 == start + 90000
+
+
+def test_stream_columns_sample_times():
+    start = int(1.5e15)
+    # default RangeIndex: rows are placed at `rate` from `start`
+    df = pd.DataFrame({'b': [1., 2., 3., 4.]})
+    (name, times, values), = _stream_columns(df, rate=10, start=start)
+    assert name == 'b'
+    assert list(times) == [start * 1000 + i * 100000000 for i in range(4)]
+    assert list(values) == [1., 2., 3., 4.]
+
+    # missing samples are skipped without shifting the later ones
+    df = pd.DataFrame({'a': [1., np.nan, 3., 4.], 'b': [np.nan] * 4})
+    (name, times, values), = _stream_columns(df, rate=10, start=start)
+    assert list(times) == [start * 1000 + i * 100000000 for i in (0, 2, 3)]
+    assert list(values) == [1., 3., 4.]
+    (_, times, _), = _stream_columns(df['a'], rate=10, start=start)
+    assert list(times) == [start * 1000 + i * 100000000 for i in (0, 2, 3)]
+
+    # row numbers are not times
+    with pytest.raises(ValueError):
+        _stream_columns(pd.DataFrame({'b': [1., 2.]}))
+    # a numeric index is read as microseconds since Epoch
+    series = pd.Series([1., 2.], index=[start, start + 100], name='b')
+    (_, times, _), = _stream_columns(series)
+    assert list(times) == [start * 1000, (start + 100) * 1000]
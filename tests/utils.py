@@ -4,6 +4,9 @@ import time
 from uuid import uuid4
 
 from blackfynn import Blackfynn
+from blackfynn.api.core import CoreAPI
+from blackfynn.base import ClientSession
+from blackfynn.config import Settings
 
 
 def current_ts():
@@ -34,3 +37,13 @@ def create_test_dataset(bf_client):
     # all_dataset_ids = [x.id for x in bf_client.datasets()]
     # assert ds_id in all_dataset_ids
     return ds
+
+
+def get_offline_session(responder, *components, **overrides):
+    """ Utility function to get a session that does not talk to the platform.
+        Every API call is answered by ``responder(method, endpoint, **kwargs)``
+    """
+    session = ClientSession(Settings(overrides=overrides))
+    session.register(CoreAPI, *components)
+    session._call = lambda method, endpoint, *args, **kwargs: responder(method, endpoint, **kwargs)
+    return session